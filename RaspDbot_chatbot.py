@@ -1,6 +1,8 @@
 import os
 import sys
-from llama_cpp import Llama
+
+from raspdbot_bot import GREETING_REPLY, NEED_DATA_REPLY, ROUTER
+from raspdbot_llm import create_llm
 
 MODEL_PATH = r"/home/dmachine/Documents/RaspDbot/raspdbot-car.Q4_K_M.gguf"
 
@@ -29,12 +31,11 @@ def main():
         print(f"Không tìm thấy model: {MODEL_PATH}")
         sys.exit(1)
 
-    llm = Llama(
-        model_path=MODEL_PATH,
+    # n_threads / n_batch / KV cache lấy từ profile của raspdbot_tune.py (nếu đã tune)
+    llm = create_llm(
+        MODEL_PATH,
         n_ctx=4096,      # tăng/giảm tùy RAM
-        n_threads=os.cpu_count() or 4,
         n_gpu_layers=0,  # 0 = chạy CPU; nếu có GPU + build CUDA thì tăng lên
-        verbose=False
     )
 
     history: list[dict] = []
@@ -44,8 +45,16 @@ def main():
         user_text = input("Bạn: ").strip()
         if not user_text:
             continue
-        if user_text.lower() in ("exit", "quit", "q"):
+        # Chào hỏi / hỏi dữ liệu realtime: trả lời ngay, không gọi LLM (router dùng chung với engine)
+        intents = ROUTER.intents(user_text)
+        if "exit" in intents:
             break
+        if "greeting" in intents:
+            print(f"\nBot: {GREETING_REPLY}\n")
+            continue
+        if "need_data" in intents:
+            print(f"\nBot: {NEED_DATA_REPLY}\n")
+            continue
 
         history.append({"role": "user", "content": user_text})
         prompt = build_prompt(history)
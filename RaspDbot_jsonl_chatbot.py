@@ -1,10 +1,25 @@
 import os
 import sys
-import json
-import re
+import threading
+import time
+from collections import deque
+from contextlib import closing
 from difflib import SequenceMatcher
-from typing import Dict, List, Tuple
-from llama_cpp import Llama
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# load_jsonl / extract_qa giờ nằm ở raspdbot_corpus (import lại để giữ tên cũ)
+from raspdbot_answer_cache import AnswerCache, model_fingerprint
+from raspdbot_cache import STATE_DIR
+from raspdbot_corpus import FacetedRetriever, extract_qa, load_jsonl
+from raspdbot_intent import EXIT_WORDS, IntentRouter, load_intents
+from raspdbot_kvcache import prime_prefix
+from raspdbot_llm import create_llm
+from raspdbot_memory import memory_stats
+from raspdbot_metrics import MetricsLogger, llama_perf, llama_perf_reset, metrics_enabled
+from raspdbot_reload import RELOAD_INTERVAL, LiveCorpus, format_reload
+from raspdbot_registry import CorpusRegistry
+from raspdbot_retrieval import Retriever, coverage, normalize
+from raspdbot_transcript import PromptTranscript
 
 # =========================
 # Paths
@@ -12,6 +27,35 @@ from llama_cpp import Llama
 MODEL_PATH = "/home/dmachine/Documents/RaspDbot/raspdbot-star.Q4_K_M.gguf"
 JSONL_PATH = "/home/dmachine/Documents/RaspDbot/raspDbot_star_training.jsonl"
 
+# =========================
+# Retrieval backend
+# =========================
+# "bm25" (mặc định) | "dense" | "hybrid"
+RETRIEVAL_BACKEND = os.environ.get("RASPDBOT_RETRIEVAL", "bm25")
+# Model GGUF dùng để embedding; để trống -> dùng luôn MODEL_PATH
+EMBED_MODEL_PATH = os.environ.get("RASPDBOT_EMBED_MODEL", "")
+EMBED_DTYPE = os.environ.get("RASPDBOT_EMBED_DTYPE", "float16")  # float16 | int8
+HYBRID_ALPHA = float(os.environ.get("RASPDBOT_HYBRID_ALPHA", "0.5"))
+
+# =========================
+# Generation
+# =========================
+SAMPLING_PARAMS = {
+    "max_tokens": 256,
+    "temperature": 0.3,  # bám dữ liệu hơn
+    "top_p": 0.9,
+}
+# Prompt một lượt (system + top-k mẫu + câu hỏi) đo được ~480..1050 token.
+# Chế độ ngân sách RAM không giảm n_ctx xuống dưới mức này + max_tokens.
+PROMPT_BUDGET_TOKENS = 1280
+MIN_CTX_TOKENS = PROMPT_BUDGET_TOKENS + SAMPLING_PARAMS["max_tokens"]
+STOP_TOKENS = ["### User:", "### System:", "### Assistant:", "### DỮ LIỆU THAM CHIẾU"]
+# Nhiều lượt: các lượt sinh bằng LLM nối tiếp trong một transcript token
+# (raspdbot_transcript) gồm system + các cặp hỏi/đáp; khối tham chiếu chỉ có
+# trong lượt hiện tại. Sắp tràn n_ctx thì bắt đầu lại từ system prompt.
+# RASPDBOT_MULTI_TURN=0 -> mỗi lượt độc lập như cũ.
+MULTI_TURN = os.environ.get("RASPDBOT_MULTI_TURN", "1").strip().lower() not in ("0", "false", "no", "off")
+
 # =========================
 # Greetings
 # =========================
@@ -35,11 +79,22 @@ CONFIRM_WORDS = [
     "đúng", "đúng vậy", "ừ", "uh", "có", "phải", "yes", "ok", "đúng rồi"
 ]
 
+# Một automaton cho mọi intent, khớp trọn từ (có/không dấu)
+INTENTS = load_intents({
+    "greeting": GREETINGS,
+    "confirm": CONFIRM_WORDS,
+    "exit": EXIT_WORDS,
+})
+ROUTER = IntentRouter(INTENTS, exact={"exit"})
+
 # =========================
 # Clarify session state
 # =========================
-clarify_sessions: Dict[str, Dict[str, str]] = {}
-# { session_id: { "count": int, "last_question": str } }
+def new_clarify_state() -> Dict[str, object]:
+    # Mỗi session (terminal / mỗi console của server) giữ state riêng;
+    # "domain" = domain của lượt trước, dùng khi câu hỏi mới không tự lộ domain;
+    # "transcript" = PromptTranscript của các lượt LLM (tạo khi cần)
+    return {"count": 0, "last_question": "", "domain": "", "transcript": None}
 
 # =========================
 # Base system prompt
@@ -68,71 +123,32 @@ BASE_SYSTEM_PROMPT = (
 # =========================
 # Helpers
 # =========================
-def normalize(text: str) -> str:
-    text = text.lower().strip()
-    text = re.sub(r"\s+", " ", text)
-    return text
-
 def is_greeting(text: str) -> bool:
-    t = normalize(text)
-    return any(g == t or g in t for g in GREETINGS)
+    return ROUTER.matches(text, "greeting")
 
 def is_confirm(text: str) -> bool:
-    t = normalize(text)
-    return any(w == t or w in t for w in CONFIRM_WORDS)
-
-def load_jsonl(path: str) -> List[Dict]:
-    """
-    Hỗ trợ JSONL format phổ biến:
-    1) {"prompt": "...", "completion": "..."}
-    2) {"question": "...", "answer": "..."}
-    3) {"messages":[{"role":"user","content":"..."},{"role":"assistant","content":"..."}]}
-    4) Fallback: {"instruction": "...", "response": "..."} hoặc {"input": "...", "output": "..."}
-    """
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f, start=1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                data.append(json.loads(line))
-            except json.JSONDecodeError:
-                print(f"[WARN] Dòng {i} không phải JSON hợp lệ, bỏ qua.")
-    return data
-
-def extract_qa(item: Dict) -> Tuple[str, str]:
-    if "prompt" in item and "completion" in item:
-        return str(item["prompt"]).strip(), str(item["completion"]).strip()
-
-    if "question" in item and "answer" in item:
-        return str(item["question"]).strip(), str(item["answer"]).strip()
-
-    if "instruction" in item and "response" in item:
-        return str(item["instruction"]).strip(), str(item["response"]).strip()
-
-    if "input" in item and "output" in item:
-        return str(item["input"]).strip(), str(item["output"]).strip()
-
-    if "messages" in item and isinstance(item["messages"], list):
-        user_parts, assistant_parts = [], []
-        for m in item["messages"]:
-            if not isinstance(m, dict):
-                continue
-            role = m.get("role", "")
-            content = str(m.get("content", "")).strip()
-            if role == "user":
-                user_parts.append(content)
-            elif role == "assistant":
-                assistant_parts.append(content)
-        return "\n".join(user_parts).strip(), "\n".join(assistant_parts).strip()
-
-    return "", ""
+    return ROUTER.matches(text, "confirm")
 
 def similarity(a: str, b: str) -> float:
     return SequenceMatcher(None, normalize(a), normalize(b)).ratio()
 
-def top_k_context(question: str, qa_pairs: List[Tuple[str, str]], k: int = 5) -> List[Tuple[float, str, str]]:
+def top_k_context(
+    question: str,
+    qa_pairs: Sequence[Tuple[str, str]],
+    k: int = 5,
+    index: Optional[Retriever] = None,
+    domain: Optional[str] = None,
+) -> List[Tuple[float, str, str]]:
+    # Có index (BM25 / dense / hybrid) -> chỉ chấm ứng viên, lấy top-k.
+    # Không có index -> quét tuyến tính bằng SequenceMatcher như cũ.
+    # domain (chỉ với FacetedRetriever): chấm trong domain đó trước, thiếu thì toàn corpus.
+    if index is not None:
+        if domain is not None and isinstance(index, FacetedRetriever):
+            hits = index.search_domain(question, k, domain)[0]
+        else:
+            hits = index.search(question, k)
+        return [(s, qa_pairs[i][0], qa_pairs[i][1]) for s, i in hits]
+
     scored = []
     for q, a in qa_pairs:
         if not q or not a:
@@ -142,31 +158,169 @@ def top_k_context(question: str, qa_pairs: List[Tuple[str, str]], k: int = 5) ->
     scored.sort(key=lambda x: x[0], reverse=True)
     return scored[:k]
 
+def build_retriever(corpus, backend: str = RETRIEVAL_BACKEND) -> Retriever:
+    if backend == "bm25":
+        # Dataset có metadata domain -> chấm theo partition domain (fallback toàn corpus)
+        if corpus.domain_ranges:
+            return FacetedRetriever(corpus)
+        return corpus.index
+
+    # Import muộn: chỉ cần numpy + model embedding khi bật dense/hybrid
+    from raspdbot_embed import EmbeddingIndex, HybridRetriever, create_embedder
+
+    # Không fallback sang model chat: nạp thêm một bản GGUF chat (vài GB) chỉ để embed,
+    # và model chat trả vector theo từng token chứ không pool thành một vector/câu
+    if not EMBED_MODEL_PATH:
+        raise ValueError(
+            f"Backend {backend} cần model embedding riêng: đặt RASPDBOT_EMBED_MODEL=/đường/dẫn/model-embed.gguf"
+        )
+    embed_path = EMBED_MODEL_PATH
+    # Như BM25: chỉ embed đại diện cụm gần trùng, các bản gần trùng không chiếm chỗ trong top-k
+    # (và hybrid không trộn cùng một cụm dưới hai doc id)
+    docs = corpus.indexed_docs()
+    questions = corpus.questions
+    dense = EmbeddingIndex.build_or_load(
+        create_embedder(embed_path),
+        embed_path,
+        corpus.doc_key,
+        [questions[i] for i in docs],
+        dtype=EMBED_DTYPE,
+        doc_ids=docs,
+        settings={"dedup": corpus.header.get("dedup", {})},
+    )
+    if backend == "dense":
+        return dense
+    if backend == "hybrid":
+        return HybridRetriever(corpus.index, dense, alpha=HYBRID_ALPHA)
+    raise ValueError(f"RETRIEVAL_BACKEND không hợp lệ: {backend}")
+
 def build_context_text(top: List[Tuple[float, str, str]]) -> str:
     lines = []
     for idx, (s, q, a) in enumerate(top, start=1):
         lines.append(f"[Mẫu {idx} | score={s:.2f}]\nHỏi: {q}\nĐáp: {a}\n")
     return "\n".join(lines).strip()
 
-def build_prompt(question: str, context: str) -> str:
-    return f"""### System:
+# Phần đầu prompt không đổi giữa các lượt -> snapshot KV (xem raspdbot_kvcache)
+SYSTEM_BLOCK = f"""### System:
 {BASE_SYSTEM_PROMPT}
 
-### DỮ LIỆU THAM CHIẾU (trích từ JSONL):
-{context}
+"""
+DATA_HEADER = "### DỮ LIỆU THAM CHIẾU (trích từ JSONL):\n"
+PROMPT_PREFIX = SYSTEM_BLOCK + DATA_HEADER
 
-### User:
+def build_user_turn(question: str) -> str:
+    return f"""### User:
 {question}
 
 ### Assistant:
 """
 
-def should_clarify(best_score: float) -> bool:
-    # Ngưỡng bạn có thể chỉnh:
+def build_turn(question: str, context: str) -> str:
+    return f"{context}\n\n" + build_user_turn(question)
+
+def build_prompt(question: str, context: str) -> str:
+    return PROMPT_PREFIX + build_turn(question, context)
+
+def drop_last_sample(context: str) -> str:
+    # Bỏ mẫu cuối (điểm thấp nhất) của build_context_text()
+    cut = context.rfind("\n\n[Mẫu ")
+    return context[:cut] if cut > 0 else ""
+
+def build_prompt_tokens(
+    transcript: PromptTranscript, question: str, context: str, max_tokens: int, multi_turn: bool = MULTI_TURN
+) -> Tuple[List[int], List[int]]:
+    """
+    -> (token prompt, token giữ lại trong transcript trước câu trả lời).
+    Transcript = system + các cặp hỏi/đáp; khối tham chiếu chỉ nằm trong prompt
+    của lượt hiện tại (đứng ngay trước câu hỏi) nên không tích luỹ top-k của
+    mọi lượt cũ. Lượt sau prefill lại câu hỏi + câu trả lời vừa rồi (nằm sau
+    khối tham chiếu trong KV) cùng khối tham chiếu mới.
+    """
+    if multi_turn and transcript.tokens:
+        prompt = transcript.extend("\n\n" + DATA_HEADER + build_turn(question, context))
+        if transcript.fits(prompt, max_tokens):
+            return prompt, transcript.tokens + transcript.segment("\n\n" + build_user_turn(question))
+    # Lượt đầu / hết chỗ trong n_ctx: bắt đầu lại từ system (token khớp snapshot prefix)
+    system = transcript.begin(SYSTEM_BLOCK)
+    while True:
+        prompt = system + transcript.segment(DATA_HEADER + build_turn(question, context))
+        if not context or transcript.fits(prompt, max_tokens):
+            break
+        # n_ctx nhỏ hơn dự kiến (vd model truyền vào) -> bớt mẫu điểm thấp tới khi vừa
+        context = drop_last_sample(context)
+    return prompt, system + transcript.segment(build_user_turn(question))
+
+CLARIFY_THRESHOLD = 0.60
+
+def should_clarify(best_score: float, threshold: float = CLARIFY_THRESHOLD) -> bool:
+    # Ngưỡng bạn có thể chỉnh (score BM25 đã chuẩn hoá về [0, 1]):
     # - >=0.60: khá chắc liên quan
     # - 0.45..0.60: lưng chừng, hỏi lại
     # - <0.45: nhiều khả năng ngoài dữ liệu
-    return best_score < 0.60
+    return best_score < threshold
+
+# =========================
+# Trả lời theo tầng (theo độ tin cậy của retrieval)
+# =========================
+# score >= DIRECT_THRESHOLD             -> trả nguyên câu trả lời trong dataset (không gọi LLM)
+# REWRITE_THRESHOLD <= score < DIRECT   -> LLM viết lại ngắn câu trả lời top-1
+# còn lại                               -> sinh đầy đủ với top-k context
+# Đo trên 2 dataset (raspdbot_eval, không tính câu gốc): bỏ dấu ~0.85..1.0, gõ sai /
+# bỏ 1 từ ~0.65..0.8; câu viết tay diễn đạt khác hẳn chỉ ~0.3..0.45 -> luôn sinh đầy đủ.
+DIRECT_THRESHOLD = float(os.environ.get("RASPDBOT_DIRECT_THRESHOLD", "0.85"))
+REWRITE_THRESHOLD = float(os.environ.get("RASPDBOT_REWRITE_THRESHOLD", "0.70"))
+# Top-2 gần bằng điểm mà đáp khác nhau -> không chắc, để LLM tổng hợp
+TIER_MIN_MARGIN = float(os.environ.get("RASPDBOT_TIER_MARGIN", "0.03"))
+# Score chỉ chuẩn hoá theo query: "xe" / "pin" khớp mọi term của câu bất kỳ chứa
+# từ đó -> ~1.0. Bỏ qua LLM chỉ khi câu hỏi và câu khớp phủ nhau đủ (coverage()).
+# Đo trên 2 dataset (raspdbot_eval, không tính câu gốc): top-1 đúng của câu sinh tự động
+# phủ >= 0.6 ở ~90%, >= 0.4 ở ~100%; câu viết tay (top-1 sai 45..80%) chỉ ~0.25..0.45;
+# "xe" / "pin" / "lidar bị lỗi" 0.1..0.5. Không đủ -> hạ xuống tầng kế tiếp.
+DIRECT_MIN_COVERAGE = float(os.environ.get("RASPDBOT_DIRECT_COVERAGE", "0.6"))
+REWRITE_MIN_COVERAGE = float(os.environ.get("RASPDBOT_REWRITE_COVERAGE", "0.4"))
+REWRITE_PARAMS = {
+    "max_tokens": 128,
+    "temperature": 0.1,
+    "top_p": 0.9,
+}
+DECISION_LOG_PATH = STATE_DIR / "decisions.jsonl"
+
+def choose_tier(
+    question: str,
+    top: List[Tuple[float, str, str]],
+    direct: float = DIRECT_THRESHOLD,
+    rewrite: float = REWRITE_THRESHOLD,
+    margin: float = TIER_MIN_MARGIN,
+    direct_coverage: float = DIRECT_MIN_COVERAGE,
+    rewrite_coverage: float = REWRITE_MIN_COVERAGE,
+) -> str:
+    if not top:
+        return "generate"
+    best = top[0][0]
+    ambiguous = len(top) > 1 and top[1][2] != top[0][2] and best - top[1][0] < margin
+    if ambiguous:
+        return "generate"
+    cov = coverage(question, top[0][1])
+    if best >= direct and cov >= direct_coverage:
+        return "direct"
+    if best >= rewrite and cov >= rewrite_coverage:
+        return "rewrite"
+    return "generate"
+
+def build_rewrite_prompt(question: str, answer: str) -> str:
+    return f"""### System:
+Bạn là chatbot chuyên gia về mô hình xe tự hành RaspDbot-Star.
+Viết lại CÂU TRẢ LỜI MẪU cho khớp với câu hỏi, ngắn gọn, giữ nguyên mọi số liệu.
+Không thêm thông tin nào ngoài câu trả lời mẫu.
+
+### CÂU TRẢ LỜI MẪU:
+{answer}
+
+### User:
+{question}
+
+### Assistant:
+"""
 
 def next_clarify_question() -> str:
     return (
@@ -174,6 +328,282 @@ def next_clarify_question() -> str:
         "Nếu có, bạn nói 'đúng' và mô tả rõ hơn (ví dụ: phần cứng/cảm biến/điều khiển/tốc độ...)."
     )
 
+# =========================
+# Chat (corpus + retriever + LLM dùng chung, state clarify theo session)
+# =========================
+class JsonlChat:
+    def __init__(
+        self,
+        model_path: str = MODEL_PATH,
+        jsonl_path: str = JSONL_PATH,
+        llm=None,
+        metrics=None,
+        direct_threshold: float = DIRECT_THRESHOLD,
+        rewrite_threshold: float = REWRITE_THRESHOLD,
+        tier_margin: float = TIER_MIN_MARGIN,
+        reload_interval: float = RELOAD_INTERVAL,
+        lookup_tokens: Optional[int] = None,
+    ):
+        self.model_path = model_path
+        self.jsonl_path = jsonl_path
+        self.direct_threshold = direct_threshold
+        self.rewrite_threshold = rewrite_threshold
+        self.tier_margin = tier_margin
+
+        # Lần nạp lại corpus chờ main loop in ra: thread theo dõi file không print
+        # (sẽ chen vào giữa câu trả lời đang stream). Server không đọc -> chỉ giữ vài lần cuối.
+        self.reload_notices: "deque[Dict]" = deque(maxlen=32)
+
+        # Corpus compile sẵn (offset + index BM25) rồi mmap; tự build lại khi JSONL đổi.
+        # File JSONL được theo dõi khi đang chạy: Q/A ghi thêm vào cuối được index
+        # thêm (bm25), sửa / cắt file thì compile lại — không cần restart bot.
+        self.live = LiveCorpus(
+            jsonl_path,
+            build_retriever,
+            incremental=RETRIEVAL_BACKEND == "bm25",
+            on_reload=self._on_reload,
+        )
+        if not self.qa_pairs:
+            raise ValueError("Không trích được Q/A từ JSONL. Kiểm tra format file.")
+
+        # Câu trả lời hay chép lại khối "Đáp:" của context -> prompt-lookup decoding
+        # (RASPDBOT_LOOKUP_TOKENS / _NGRAM / _WINDOW) đoán trúng nhiều token mỗi bước
+        self.llm = llm or create_llm(
+            model_path, n_ctx=4096, lookup_tokens=lookup_tokens, min_ctx=MIN_CTX_TOKENS
+        )
+        if llm is None:
+            prime_prefix(self.llm, model_path, SYSTEM_BLOCK, [""])
+
+        # Answer cache: tự xoá khi model hoặc dataset đổi
+        self.answer_cache = AnswerCache()
+        self.model_fp = model_fingerprint(model_path)
+        self.cache_scope = f"jsonl:{os.path.abspath(model_path)}:{os.path.abspath(jsonl_path)}"
+        self.answer_cache.bind(self.cache_scope, f"{self.model_fp}:{self.live.snapshot.fingerprint}")
+
+        # Metrics từng lượt (RASPDBOT_METRICS=1 để bật), ghi ra metrics.jsonl
+        self.metrics = metrics or MetricsLogger(enabled=metrics_enabled(False))
+        # Nhật ký quyết định tier từng lượt để soát lại ngưỡng (RASPDBOT_DECISION_LOG=0 để tắt)
+        self.decisions = MetricsLogger(
+            enabled=metrics_enabled(True, "RASPDBOT_DECISION_LOG"), path=DECISION_LOG_PATH
+        )
+        self.live.start(reload_interval)
+
+    # Corpus hiện hành (snapshot mới nhất); mỗi lượt hỏi lấy snapshot một lần
+    @property
+    def corpus(self):
+        return self.live.snapshot.base
+
+    @property
+    def qa_pairs(self):
+        return self.live.snapshot.qa_pairs
+
+    @property
+    def index(self):
+        return self.live.snapshot.retriever
+
+    def _on_reload(self, rec: Dict):
+        # Dataset đổi -> câu trả lời cache cũ không còn đúng
+        self.answer_cache.bind(self.cache_scope, f"{self.model_fp}:{self.live.snapshot.fingerprint}")
+        self.metrics.write({"source": "reload", **rec})
+        self.reload_notices.append(rec)
+
+    def pop_reload_notices(self) -> List[Dict]:
+        out = []
+        while self.reload_notices:
+            out.append(self.reload_notices.popleft())
+        return out
+
+    def ask_stream(
+        self, user_text: str, clarify: Dict[str, object], cancel: Optional[threading.Event] = None
+    ) -> Iterator[str]:
+        turn = self.metrics.start_turn("jsonl")
+        try:
+            yield from self._ask_stream(user_text, clarify, cancel, turn)
+        finally:
+            self.metrics.log(turn)
+
+    def _ask_stream(self, user_text: str, clarify: Dict[str, object], cancel, turn) -> Iterator[str]:
+        # 1) Greeting (một lượt quét cho mọi intent)
+        with turn.stage("intent"):
+            intents = ROUTER.intents(user_text)
+        if "greeting" in intents:
+            turn.set(route="greeting")
+            yield GREETING_RESPONSE
+            return
+
+        # 2) Clarify flow: nếu đang hỏi lại mà user confirm
+        if int(clarify["count"]) > 0 and "confirm" in intents:
+            # user xác nhận liên quan -> dùng câu hỏi trước đó để trả lời
+            user_text = str(clarify["last_question"])
+            clarify["count"] = 0
+            clarify["last_question"] = ""
+
+        # 3) Lấy context gần nhất (trong domain của câu hỏi / của session nếu có)
+        with turn.stage("retrieval"):
+            snap = self.live.snapshot
+            index, qa_pairs = snap.retriever, snap.qa_pairs
+            domain, domain_source = "", ""
+            if isinstance(index, FacetedRetriever):
+                domain, domain_source = index.detect_domain(user_text), "query"
+                if not domain and clarify.get("domain"):
+                    domain, domain_source = str(clarify["domain"]), "session"
+                hits, used = index.search_domain(user_text, 5, domain)
+                if not used:
+                    domain_source = "fallback" if domain else ""
+                clarify["domain"] = used or clarify.get("domain", "")
+                top = [(s, qa_pairs[i][0], qa_pairs[i][1]) for s, i in hits]
+            else:
+                top = top_k_context(user_text, qa_pairs, k=5, index=index)
+        best_score = top[0][0] if top else 0.0
+        turn.set(best_score=round(best_score, 4))
+        if domain:
+            turn.set(domain=domain, domain_source=domain_source)
+
+        # 4) Chọn tầng trả lời theo độ tin cậy (ghi lại để soát ngưỡng)
+        if should_clarify(best_score):
+            tier = "clarify"
+        else:
+            tier = choose_tier(user_text, top, self.direct_threshold, self.rewrite_threshold, self.tier_margin)
+        turn.set(tier=tier)
+        self.decisions.write({
+            "ts": time.time(),
+            "question": user_text,
+            "tier": tier,
+            "best_score": round(best_score, 4),
+            "second_score": round(top[1][0], 4) if len(top) > 1 else None,
+            "matched_question": top[0][1] if top else "",
+            "coverage": round(coverage(user_text, top[0][1]), 4) if top else 0.0,
+            "domain": domain,
+            "domain_source": domain_source,
+            "clarify_threshold": CLARIFY_THRESHOLD,
+            "direct_threshold": self.direct_threshold,
+            "rewrite_threshold": self.rewrite_threshold,
+            "direct_coverage": DIRECT_MIN_COVERAGE,
+            "rewrite_coverage": REWRITE_MIN_COVERAGE,
+            "margin": self.tier_margin,
+        })
+
+        # 5) Nếu không chắc liên quan -> hỏi lại tối đa 2 lần
+        if tier == "clarify":
+            turn.set(route="clarify")
+            c = int(clarify["count"])
+            if c < 2:
+                clarify["count"] = c + 1
+                clarify["last_question"] = user_text
+                yield next_clarify_question()
+            else:
+                # quá 2 lần vẫn không liên quan
+                clarify["count"] = 0
+                clarify["last_question"] = ""
+                yield "Tôi không có thông tin này."
+            return
+
+        # Gần như trùng câu hỏi trong dataset -> trả lời ngay, không gọi LLM
+        if tier == "direct":
+            turn.set(route="direct")
+            yield top[0][2]
+            return
+
+        # 6) Build prompt + generate (viết lại ngắn hoặc sinh đầy đủ)
+        transcript, base = None, None
+        with turn.stage("prompt"):
+            if tier == "rewrite":
+                prompt = build_rewrite_prompt(user_text, top[0][2])
+                params = dict(REWRITE_PARAMS)
+            else:
+                params = dict(SAMPLING_PARAMS)
+                transcript = self._transcript(clarify)
+                prompt, base = build_prompt_tokens(
+                    transcript, user_text, build_context_text(top), params["max_tokens"]
+                )
+
+        # Cùng câu hỏi + cùng context + cùng tham số (+ cùng phần hội thoại trước đó
+        # khi nhiều lượt) -> dùng lại câu trả lời
+        with turn.stage("cache"):
+            conversation = [transcript.digest()] if transcript is not None and transcript.turns else []
+            cache_key = AnswerCache.make_key(
+                self.model_fp,
+                user_text,
+                [q for _, q, _ in top],
+                {"backend": RETRIEVAL_BACKEND, "tier": tier, **params},
+                conversation=conversation,
+            )
+            answer = self.answer_cache.get(cache_key)
+        if answer is not None:
+            turn.set(route="cache")
+            if transcript is not None:
+                # User đã thấy câu trả lời này -> lượt sau của model cũng phải thấy
+                transcript.commit(prompt, answer, base=base)
+            yield answer
+            return
+
+        turn.set(route="llm")
+        # Lượt viết lại dùng prompt riêng: giữ KV của transcript để lượt sau không prefill lại
+        state = None
+        if transcript is None:
+            session = clarify.get("transcript")
+            if session is not None and session.turns:
+                state = self.llm.save_state()
+        else:
+            reused = transcript.measure(prompt)
+            turn.set(
+                prompt_tokens=len(prompt),
+                prefix_reused_tokens=reused,
+                prefix_new_tokens=len(prompt) - reused,
+                transcript=transcript.last_mode,
+            )
+        if turn.enabled:
+            llama_perf_reset(self.llm)
+        t_start = time.perf_counter()
+        if cancel is not None:
+            params["stopping_criteria"] = lambda input_ids, logits: cancel.is_set()
+        stream = self.llm(prompt, stop=STOP_TOKENS, stream=True, **params)
+        parts: List[str] = []
+        raw: List[str] = []
+        n_chunks = 0
+        try:
+            for chunk in stream:
+                if n_chunks == 0:
+                    turn.mark_first_token()
+                n_chunks += 1
+                text = chunk["choices"][0]["text"] or ""
+                raw.append(text)
+                # Bỏ khoảng trắng đầu câu trả lời (như .strip() khi chưa stream)
+                if not parts:
+                    text = text.lstrip()
+                if text:
+                    parts.append(text)
+                    yield text
+        finally:
+            stream.close()
+            if transcript is not None:
+                transcript.commit(prompt, "".join(raw).rstrip(), base=base)
+            elif state is not None:
+                self.llm.load_state(state)
+            turn.add_stage("generate", time.perf_counter() - t_start)
+            if turn.enabled:
+                turn.set(completion_tokens=n_chunks, **llama_perf(self.llm), **memory_stats(self.llm))
+
+        answer = "".join(parts).strip()
+        if cancel is not None and cancel.is_set():
+            turn.set(cancelled=True)
+        elif not answer:
+            yield "Chưa đủ dữ liệu."
+        else:
+            self.answer_cache.set(cache_key, answer, scope=self.cache_scope)
+
+    def _transcript(self, clarify: Dict[str, object]) -> PromptTranscript:
+        transcript = clarify.get("transcript")
+        if not isinstance(transcript, PromptTranscript) or transcript.llm is not self.llm:
+            transcript = PromptTranscript(self.llm)
+            clarify["transcript"] = transcript
+        return transcript
+
+    def close(self):
+        self.live.stop()
+        self.answer_cache.close()
+
+
 # =========================
 # Main
 # =========================
@@ -182,89 +612,44 @@ def main():
         print("Không tìm thấy model:", MODEL_PATH)
         sys.exit(1)
 
-    if not os.path.exists(JSONL_PATH):
-        print("Không tìm thấy JSONL:", JSONL_PATH)
+    jsonl_path = JSONL_PATH
+    if not os.path.exists(jsonl_path):
+        # Không có file cấu hình sẵn -> lấy dataset ứng với model trong registry
+        sources = CorpusRegistry().sources_for(MODEL_PATH)
+        if not sources:
+            print("Không tìm thấy JSONL:", JSONL_PATH)
+            sys.exit(1)
+        jsonl_path = sources[0]["path"]
+
+    try:
+        chat = JsonlChat(MODEL_PATH, jsonl_path)
+    except ValueError as e:
+        print(e)
         sys.exit(1)
 
-    raw = load_jsonl(JSONL_PATH)
-    qa_pairs: List[Tuple[str, str]] = []
-    for item in raw:
-        q, a = extract_qa(item)
-        if q and a:
-            qa_pairs.append((q, a))
-
-    if not qa_pairs:
-        print("Không trích được Q/A từ JSONL. Kiểm tra format file.")
-        sys.exit(1)
-
-    llm = Llama(
-        model_path=MODEL_PATH,
-        n_ctx=4096,
-        n_threads=os.cpu_count() or 4,
-        n_gpu_layers=0,
-        verbose=False
-    )
-
-    session_id = "terminal"  # bạn có thể đổi/nhân bản nếu làm nhiều session
-    clarify_sessions[session_id] = {"count": 0, "last_question": ""}
+    # Terminal = một session; server (raspdbot_server.py) giữ mỗi console một state
+    clarify = new_clarify_state()
 
     print("🤖 RaspDbot-Star Chat (JSONL) — gõ 'exit' để thoát\n")
 
     while True:
+        for rec in chat.pop_reload_notices():
+            print(format_reload(rec))
         user_text = input("Bạn: ").strip()
         if not user_text:
             continue
-        if user_text.lower() in ("exit", "quit", "q"):
+        if ROUTER.matches(user_text, "exit"):
             break
 
-        # 1) Greeting
-        if is_greeting(user_text):
-            print(f"\nBot: {GREETING_RESPONSE}\n")
-            continue
-
-        # 2) Clarify flow: nếu đang hỏi lại mà user confirm
-        if clarify_sessions[session_id]["count"] > 0 and is_confirm(user_text):
-            # user xác nhận liên quan -> dùng câu hỏi trước đó để trả lời
-            user_text = clarify_sessions[session_id]["last_question"]
-            clarify_sessions[session_id]["count"] = 0
-            clarify_sessions[session_id]["last_question"] = ""
-
-        # 3) Lấy context gần nhất
-        top = top_k_context(user_text, qa_pairs, k=5)
-        best_score = top[0][0] if top else 0.0
-
-        # 4) Nếu không chắc liên quan -> hỏi lại tối đa 2 lần
-        if should_clarify(best_score):
-            c = int(clarify_sessions[session_id]["count"])
-            if c < 2:
-                clarify_sessions[session_id]["count"] = c + 1
-                clarify_sessions[session_id]["last_question"] = user_text
-                print(f"\nBot: {next_clarify_question()}\n")
-                continue
-            else:
-                # quá 2 lần vẫn không liên quan
-                clarify_sessions[session_id]["count"] = 0
-                clarify_sessions[session_id]["last_question"] = ""
-                print("\nBot: Tôi không có thông tin này.\n")
-                continue
-
-        # 5) Build prompt + generate
-        context = build_context_text(top)
-        prompt = build_prompt(user_text, context)
-
-        out = llm(
-            prompt,
-            max_tokens=256,
-            temperature=0.3,  # bám dữ liệu hơn
-            top_p=0.9,
-            stop=["### User:", "### System:", "### Assistant:", "### DỮ LIỆU THAM CHIẾU"],
-        )
-
-        answer = out["choices"][0]["text"].strip()
-        if not answer:
-            answer = "Chưa đủ dữ liệu."
+        print("\nBot: ", end="", flush=True)
+        with closing(chat.ask_stream(user_text, clarify)) as stream:
+            for text in stream:
+                print(text, end="", flush=True)
+        print("\n")
 
-        print(f"\nBot: {answer}\n")
+    st = chat.answer_cache.stats()
+    print(f"[cache] hit={st['hits']} miss={st['misses']} entries={st['entries']}")
+    chat.close()
 
 if __name__ == "__main__":
     main()
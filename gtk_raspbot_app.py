@@ -1,13 +1,21 @@
 import os
 import json
 import threading
+from contextlib import closing
 from pathlib import Path
 
 import gi
 gi.require_version("Gtk", "4.0")
-from gi.repository import Gtk, GLib, Gio
+from gi.repository import Gtk, GLib, Gio, GObject, Pango
 
+from raspdbot_answer_cache import AnswerCache
 from raspdbot_bot import RaspDbotEngine
+from raspdbot_executor import InferenceExecutor
+from raspdbot_history import HistoryJournal, journal_path_for
+from raspdbot_memory import format_memory, format_plan, memory_stats
+from raspdbot_metrics import MetricsLogger, format_summary, metrics_enabled
+from raspdbot_pool import EnginePool
+from raspdbot_registry import CorpusRegistry
 
 APP_ID = "com.raspdbot.car.chat"
 APP_NAME = "RaspDbot-Car Chatbot"
@@ -17,12 +25,40 @@ DATA_DIR = Path(GLib.get_user_data_dir()) / "raspdbot"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 DEFAULT_HISTORY_PATH = DATA_DIR / "history.json"
 
+# Gom các đoạn stream lại, tối đa 1 lần cập nhật dòng đang sinh mỗi frame (~60 fps)
+STREAM_FRAME_MS = 16
+
+ROLE_PREFIX = {"user": "👤 Bạn: ", "assistant": "🤖 Tôi: "}
+
+
+def history_path_for(model_path: str) -> Path:
+    # Mỗi model một file history riêng (snapshot; journal nằm cạnh, đuôi .journal)
+    return DATA_DIR / f"history-{Path(model_path).stem}.json"
+
 
 def scan_models(project_dir: Path) -> list[str]:
     # Scan *.gguf ngay trong thư mục project (không scan sâu)
     return sorted([str(p) for p in project_dir.glob("*.gguf")])
 
 
+class ChatRow(GObject.Object):
+    # Một message trong transcript; "text" đổi khi đang stream -> label tự cập nhật
+    __gtype_name__ = "RaspDbotChatRow"
+
+    role = GObject.Property(type=str, default="")
+    text = GObject.Property(type=str, default="")
+
+    def __init__(self, role: str, text: str = ""):
+        super().__init__(role=role, text=text)
+
+    def append(self, text: str):
+        self.text = self.text + text
+
+
+def row_label(row: ChatRow) -> str:
+    return ROLE_PREFIX.get(row.role, "") + row.text
+
+
 class ChatWindow(Gtk.ApplicationWindow):
     def __init__(self, app: Gtk.Application):
         super().__init__(application=app)
@@ -35,7 +71,26 @@ class ChatWindow(Gtk.ApplicationWindow):
             self.models = ["(Không tìm thấy .gguf trong thư mục project)"]
 
         self.engine = None
-        self.busy = False
+        self.model_available = True
+        # Một thread duy nhất sở hữu engine: load / hỏi / reset chạy lần lượt
+        self.executor = InferenceExecutor()
+        self.answer_cache = AnswerCache()
+        # TTFT / tok/s mỗi lượt -> status bar + metrics.jsonl (RASPDBOT_METRICS=0 để tắt)
+        self.metrics = MetricsLogger(enabled=metrics_enabled(True))
+        # Giữ các model đã dùng gần đây trong RAM (RASPDBOT_POOL_RAM_MB)
+        self.pool = EnginePool(self.create_engine, on_evict=self.save_engine_history)
+        # Dataset JSONL theo model (Star / Car, RASPDBOT_CORPORA) làm tài liệu tham khảo (RASPDBOT_RAG=0 để tắt)
+        self.registry = CorpusRegistry() if metrics_enabled(True, "RASPDBOT_RAG") else None
+        # History mỗi model: journal append-only, ghi / fsync trên thread nền
+        self.journals: dict[str, HistoryJournal] = {}
+        self._journals_lock = threading.Lock()
+
+        # Stream: worker thread đẩy text vào đây, main loop flush theo frame
+        # Mỗi phần tử: ("row", role, text) mở dòng mới, ("text", chunk) nối vào dòng đang sinh
+        self._stream_lock = threading.Lock()
+        self._stream_pending: list[tuple] = []
+        self._stream_scheduled = False
+        self._stream_row: ChatRow | None = None
 
         # ===== Root =====
         root = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
@@ -74,17 +129,27 @@ class ChatWindow(Gtk.ApplicationWindow):
         menu_btn.set_menu_model(menu_model)
 
         # ===== Chat area =====
-        self.buffer = Gtk.TextBuffer()
-        self.textview = Gtk.TextView(buffer=self.buffer)
-        self.textview.set_editable(False)
-        self.textview.set_cursor_visible(False)
-        self.textview.set_wrap_mode(Gtk.WrapMode.WORD_CHAR)
+        # ListView chỉ tạo widget cho các dòng đang hiện (tái sử dụng khi cuộn):
+        # history dài không làm chậm lúc đổi model / load history
+        self.transcript = Gio.ListStore(item_type=ChatRow)
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self._on_row_setup)
+        factory.connect("bind", self._on_row_bind)
+        factory.connect("unbind", self._on_row_unbind)
+        self.listview = Gtk.ListView(model=Gtk.NoSelection(model=self.transcript), factory=factory)
+        self._row_bindings: dict[Gtk.Label, GObject.Binding] = {}
 
         scroller = Gtk.ScrolledWindow()
         scroller.set_vexpand(True)
-        scroller.set_child(self.textview)
+        scroller.set_child(self.listview)
         root.append(scroller)
 
+        # Tự cuộn xuống cuối khi có dòng mới / dòng đang sinh dài ra, trừ khi user đã cuộn lên
+        self._follow = True
+        self.vadj = scroller.get_vadjustment()
+        self.vadj.connect("value-changed", self._on_scroll)
+        self.vadj.connect("notify::upper", self._on_content_grew)
+
         # ===== Status row =====
         top_row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
         root.append(top_row)
@@ -114,40 +179,122 @@ class ChatWindow(Gtk.ApplicationWindow):
         self.send_btn.connect("clicked", self.on_send)
         row.append(self.send_btn)
 
-        self.append_text("🤖 Tôi: Xin chào! Đợi tôi tải model một chút nhé…\n")
+        self.stop_btn = Gtk.Button(label="Dừng")
+        self.stop_btn.set_tooltip_text("Dừng câu trả lời đang sinh")
+        self.stop_btn.set_sensitive(False)
+        self.stop_btn.connect("clicked", self.on_stop)
+        row.append(self.stop_btn)
+
+        self.add_row("assistant", "Xin chào! Đợi tôi tải model một chút nhé…")
 
         # ===== Events =====
         self.model_dd.connect("notify::selected", self.on_model_changed)
         self.connect("close-request", self.on_close_request)
 
         # ===== Init =====
-        self.set_busy(True)
-        threading.Thread(target=self.load_engine_for_selected_model, daemon=True).start()
+        self.load_engine_for_selected_model()
 
     # ---------------- UI helpers ----------------
-    def append_text(self, text: str):
-        end = self.buffer.get_end_iter()
-        self.buffer.insert(end, text)
-        mark = self.buffer.create_mark(None, self.buffer.get_end_iter(), False)
-        self.textview.scroll_mark_onscreen(mark)
-
-    def set_busy(self, busy: bool):
-        self.busy = busy
-        can_use = (self.engine is not None) and (not busy)
-        self.entry.set_sensitive(can_use)
-        self.send_btn.set_sensitive(can_use)
-        self.reset_btn.set_sensitive((self.engine is not None) and (not busy))
-        self.model_dd.set_sensitive(not busy)
+    def _on_row_setup(self, factory, list_item):
+        label = Gtk.Label(xalign=0, wrap=True, selectable=True)
+        label.set_wrap_mode(Pango.WrapMode.WORD_CHAR)
+        label.set_margin_top(4)
+        label.set_margin_bottom(4)
+        list_item.set_child(label)
+
+    def _on_row_bind(self, factory, list_item):
+        label = list_item.get_child()
+        row = list_item.get_item()
+        self._row_bindings[label] = row.bind_property(
+            "text", label, "label", GObject.BindingFlags.SYNC_CREATE, lambda _b, _v: row_label(row)
+        )
+
+    def _on_row_unbind(self, factory, list_item):
+        binding = self._row_bindings.pop(list_item.get_child(), None)
+        if binding is not None:
+            binding.unbind()
+
+    def _on_scroll(self, adj):
+        self._follow = adj.get_value() >= adj.get_upper() - adj.get_page_size() - 1
+
+    def _on_content_grew(self, adj, _pspec):
+        if self._follow:
+            adj.set_value(adj.get_upper() - adj.get_page_size())
+
+    def add_row(self, role: str, text: str = "") -> ChatRow:
+        # O(1): thêm một item vào ListStore, widget chỉ tạo khi dòng hiện ra
+        row = ChatRow(role, text)
+        self.transcript.append(row)
+        self._follow = True
+        return row
+
+    def add_notice(self, text: str):
+        self.add_row("info", text.strip())
+
+    def queue_stream_row(self, role: str, text: str = ""):
+        self._queue_stream(("row", role, text))
+
+    def queue_stream_text(self, text: str):
+        self._queue_stream(("text", text))
+
+    def queue_stream_call(self, fn):
+        # Chạy fn trên main loop đúng thứ tự với các đoạn stream đã xếp trước / sau nó
+        self._queue_stream(("call", fn))
+
+    def _queue_stream(self, op: tuple):
+        # Gọi từ worker thread
+        with self._stream_lock:
+            self._stream_pending.append(op)
+            if self._stream_scheduled:
+                return
+            self._stream_scheduled = True
+        GLib.timeout_add(STREAM_FRAME_MS, self.flush_stream_text)
+
+    def flush_stream_text(self):
+        with self._stream_lock:
+            ops = self._stream_pending
+            self._stream_pending = []
+            self._stream_scheduled = False
+        chunks: list[str] = []
+        for op in ops:
+            if op[0] == "row":
+                self._flush_chunks(chunks)
+                self._stream_row = self.add_row(op[1], op[2])
+            elif op[0] == "call":
+                self._flush_chunks(chunks)
+                op[1]()
+            else:
+                chunks.append(op[1])
+        self._flush_chunks(chunks)
+        return False
+
+    def _flush_chunks(self, chunks: list[str]):
+        # Một lần set "text" cho cả frame (label chỉ đo lại một lần)
+        if chunks and self._stream_row is not None:
+            self._stream_row.append("".join(chunks))
+        chunks.clear()
+
+    def update_controls(self):
+        # Gọi trên main loop; vẫn gõ được khi bot đang trả lời (câu hỏi xếp hàng)
+        job = self.executor.current
+        answering = job is not None and job.kind == "ask"
+        self.entry.set_sensitive(self.model_available)
+        self.send_btn.set_sensitive(self.model_available)
+        self.stop_btn.set_sensitive(answering)
+        self.reset_btn.set_sensitive(self.engine is not None)
+        if answering:
+            queued = self.executor.pending("ask")
+            self.status.set_text(f"Đang trả lời… ({queued} câu đang chờ)" if queued else "Đang trả lời…")
+        return False
 
     def rebuild_view_from_history(self):
-        self.buffer.set_text("")
-        if not self.engine:
-            return
-        for m in self.engine.history:
-            if m["role"] == "user":
-                self.append_text(f"\n👤 Bạn: {m['content']}\n")
-            else:
-                self.append_text(f"🤖 Tôi: {m['content']}\n")
+        # Một lần splice (một tín hiệu items-changed), không tạo widget cho dòng khuất
+        rows = []
+        if self.engine:
+            rows = [ChatRow("user" if m["role"] == "user" else "assistant", m["content"]) for m in self.engine.history]
+        self._stream_row = None
+        self.transcript.splice(0, self.transcript.get_n_items(), rows)
+        self._follow = True
 
     # ---------------- Model loading ----------------
     def get_selected_model_path(self) -> str:
@@ -157,17 +304,21 @@ class ChatWindow(Gtk.ApplicationWindow):
         return self.models[idx]
 
     def on_model_changed(self, *_):
-        if self.busy:
-            return
-        threading.Thread(target=self.load_engine_for_selected_model, daemon=True).start()
+        self.load_engine_for_selected_model()
 
     def load_engine_for_selected_model(self):
+        # Chỉ giữ lần đổi model mới nhất; load chạy sau câu trả lời đang sinh
         model_path = self.get_selected_model_path()
+        self.executor.cancel_pending("load")
+        self.status.set_text("Đang tải model…")
+        self.executor.submit("load", lambda job: self._load_engine(model_path))
+        self.update_controls()
 
+    def _load_engine(self, model_path: str):
+        # Chạy trên thread của executor
         def start():
             self.status.set_text("Đang tải model…")
-            self.append_text("\nℹ️ Đang tải model mới…\n")
-            self.set_busy(True)
+            self.add_notice("ℹ️ Đang tải model mới…")
             return False
 
         GLib.idle_add(start)
@@ -175,63 +326,154 @@ class ChatWindow(Gtk.ApplicationWindow):
         if not model_path or model_path.startswith("("):
             def no_model():
                 self.status.set_text("Chưa có model .gguf")
-                self.append_text("❌ Không tìm thấy file .gguf trong thư mục project.\n")
+                self.add_notice("❌ Không tìm thấy file .gguf trong thư mục project.")
                 self.engine = None
-                self.set_busy(True)
+                self.model_available = False
+                self.update_controls()
                 return False
             GLib.idle_add(no_model)
             return
 
+        warm = model_path in self.pool
+        previous = self.engine
+        if previous is not None and previous.model_path in self.pool.would_evict(model_path):
+            # Bỏ tham chiếu tới engine cũ trước khi nạp: pool sẽ đóng nó để lấy chỗ,
+            # và engine đã đóng không được dùng tiếp (history đã autosave)
+            self.engine = None
         try:
-            engine = RaspDbotEngine(model_path=model_path, n_ctx=2048)
+            engine = self.pool.get(model_path)
         except Exception as e:
+            # Engine cũ không bị evict, hoặc pool đã nạp lại nó sau khi nạp lỗi -> dùng tiếp
+            self.engine = self.pool.peek(previous.model_path) if previous is not None else None
+            restored = self.engine
+
             def fail():
                 self.status.set_text("Lỗi tải model")
-                self.append_text(f"❌ Lỗi: {e}\n")
-                self.engine = None
-                self.set_busy(True)
+                self.add_notice(f"❌ Lỗi: {e}")
+                if restored is not None and restored.model_path in self.models:
+                    self.add_notice(f"↩️ Dùng lại model cũ: {os.path.basename(restored.model_path)}")
+                    # Chọn lại model cũ trong dropdown (load kế tiếp lấy engine nóng trong pool)
+                    self.model_dd.set_selected(self.models.index(restored.model_path))
+                self.update_controls()
                 return False
             GLib.idle_add(fail)
             return
 
-        # Load default history (nếu có) cho model mới
-        if DEFAULT_HISTORY_PATH.exists():
-            try:
-                data = json.loads(DEFAULT_HISTORY_PATH.read_text(encoding="utf-8"))
-                engine.load_json(data)
-            except Exception:
-                pass
+        # Gán ngay trên thread executor: câu hỏi xếp hàng sau dùng engine mới
+        self.engine = engine
 
         def ok():
-            self.engine = engine
+            self.model_available = True
             self.status.set_text("Sẵn sàng ✅")
-            self.append_text(f"✅ Model đã tải: {os.path.basename(model_path)}\n")
+            state = "đã có sẵn" if warm else "đã tải"
             self.rebuild_view_from_history()
-            self.set_busy(False)
+            self.add_notice(f"✅ Model {state}: {os.path.basename(model_path)}")
+            memory = format_memory(memory_stats(engine.llm))
+            plan = format_plan(getattr(engine.llm, "memory_plan", None))
+            if memory or plan:
+                self.add_notice("🧠 " + " · ".join(p for p in (plan, memory) if p))
+            self.update_controls()
             self.entry.grab_focus()
-            return False
 
-        GLib.idle_add(ok)
+        # Vẽ lại history qua hàng đợi stream: chạy trước mọi đoạn của câu trả lời kế tiếp
+        # (không xoá mất đoạn đang stream) mà thread suy luận không phải chờ main loop
+        self.queue_stream_call(ok)
+
+        # Nạp sẵn model có khả năng được chọn tiếp theo (nếu còn RAM)
+        self.pool.preload(self.pool.predict_next(model_path, self.models))
+
+    def create_engine(self, model_path: str) -> RaspDbotEngine:
+        # Chạy trong thread nền (pool.get / pool.preload)
+        retriever = None
+        if self.registry is not None:
+            try:
+                retriever = self.registry.retriever_for(model_path)
+            except Exception:
+                retriever = None
+        engine = RaspDbotEngine(
+            model_path=model_path,
+            n_ctx=2048,
+            answer_cache=self.answer_cache,
+            metrics=self.metrics,
+            retriever=retriever,
+        )
+
+        # History riêng của model (snapshot + journal); file history.json cũ chỉ dùng nếu đúng model
+        try:
+            path = history_path_for(model_path)
+            first_run = not path.exists() and not journal_path_for(path).exists()
+            journal = self.journal_for(model_path)
+            data = journal.load()
+            if first_run and DEFAULT_HISTORY_PATH.exists():
+                legacy = json.loads(DEFAULT_HISTORY_PATH.read_text(encoding="utf-8"))
+                if legacy.get("model_path") == model_path:
+                    engine.load_json(legacy)
+                    journal.replace(engine.history)
+                    return engine
+            engine.load_json(data)
+            journal.attach(engine.history)
+        except Exception:
+            pass
+        return engine
 
     # ---------------- History IO ----------------
+    def journal_for(self, model_path: str) -> HistoryJournal:
+        with self._journals_lock:
+            journal = self.journals.get(model_path)
+            if journal is None:
+                journal = HistoryJournal(history_path_for(model_path), model_path)
+                self.journals[model_path] = journal
+            return journal
+
+    def save_engine_history(self, model_path: str, engine):
+        # Pool gọi trước khi đóng engine bị evict (thread executor / preload)
+        self.journal_for(model_path).sync(engine.history)
+
     def autosave_history(self):
+        # Chỉ đưa các message mới vào hàng đợi của journal (O(số message mới))
         if not self.engine:
             return
         try:
-            DEFAULT_HISTORY_PATH.write_text(
-                json.dumps(self.engine.to_json(), ensure_ascii=False, indent=2),
-                encoding="utf-8",
-            )
+            self.journal_for(self.engine.model_path).sync(self.engine.history)
         except Exception:
             pass
 
     def on_close_request(self, *_):
-        self.autosave_history()
+        # Huỷ câu trả lời đang sinh + hàng đợi, không chờ trên main loop (timeout=0):
+        # job có thể còn kẹt trong llama.cpp (vd prefill dài chưa tới điểm kiểm tra
+        # cancel), đóng model lúc này là free context đang dùng
+        if self.executor.shutdown(timeout=0):
+            self.release_resources()
+            return False
+        # Ẩn cửa sổ ngay, thread phụ đợi job thoát rồi mới giải phóng model và đóng hẳn
+        self.set_visible(False)
+
+        def wait():
+            self.executor.join()
+            GLib.idle_add(self._finish_close)
+
+        threading.Thread(target=wait, name="raspdbot-close", daemon=True).start()
+        return True
+
+    def _finish_close(self):
+        self.release_resources()
+        self.destroy()
         return False
 
+    def release_resources(self):
+        # Pool đóng trước: on_evict đưa history của mọi engine còn nạp vào journal
+        self.autosave_history()
+        self.pool.close()
+        with self._journals_lock:
+            for journal in self.journals.values():
+                journal.close()
+            self.journals.clear()
+        if self.registry is not None:
+            self.registry.close()
+
     # ---------------- Actions ----------------
     def on_send(self, *_):
-        if self.engine is None or self.busy:
+        if not self.model_available:
             return
 
         msg = self.entry.get_text().strip()
@@ -239,41 +481,75 @@ class ChatWindow(Gtk.ApplicationWindow):
             return
 
         self.entry.set_text("")
-        self.append_text(f"\n👤 Bạn: {msg}\n")
-        self.status.set_text("Đang trả lời…")
-        self.set_busy(True)
-
-        def worker():
+        self.executor.submit("ask", lambda job: self._answer(msg, job))
+        self.update_controls()
+
+    def on_stop(self, *_):
+        self.executor.cancel_current("ask")
+
+    def _answer(self, msg: str, job):
+        # Chạy trên thread của executor; dòng của user cũng đi qua stream buffer
+        # để không chen vào giữa câu trả lời trước đó
+        engine = self.engine
+        GLib.idle_add(self.update_controls)
+        self.queue_stream_row("user", msg)
+        self.queue_stream_row("assistant")
+        if engine is None:
+            self.queue_stream_text("Chưa có model, bạn chọn model rồi hỏi lại nhé.")
+        else:
             try:
-                reply = self.engine.ask(msg)
+                with closing(engine.ask_stream(msg, cancel=job.cancel)) as stream:
+                    for chunk in stream:
+                        self.queue_stream_text(chunk)
             except Exception as e:
-                reply = f"Lỗi khi chạy bot: {e}"
+                self.queue_stream_text(f"Lỗi khi chạy bot: {e}")
+        cancelled = job.cancel.is_set()
+
+        def update_ui():
+            self.flush_stream_text()
+            if cancelled and self._stream_row is not None:
+                self._stream_row.append(" ⏹️ (đã dừng)")
+            self._stream_row = None
+            summary = format_summary(engine.last_metrics) if engine else ""
+            if engine is not None and "rss_mb" not in engine.last_metrics:
+                # Metrics tắt (hoặc lượt không qua LLM): vẫn hiện RSS + KV đang dùng
+                summary = " · ".join(p for p in (summary, format_memory(memory_stats(engine.llm))) if p)
+            self.status.set_text(f"Sẵn sàng ✅ · {summary}" if summary else "Sẵn sàng ✅")
+            self.update_controls()
+            self.entry.grab_focus()
+            self.autosave_history()
+            return False
+
+        GLib.idle_add(update_ui)
+
+    def on_reset(self):
+        if self.engine is None:
+            return
+        # Bỏ các câu đang chờ, dừng câu đang trả lời rồi reset trên thread executor
+        self.executor.cancel_pending("ask")
+        self.executor.cancel_current("ask")
+
+        def reset(job):
+            engine = self.engine
+            if engine is None:
+                return
+            engine.reset()
 
             def update_ui():
-                self.append_text(f"🤖 Tôi: {reply}\n")
-                self.status.set_text("Sẵn sàng ✅")
-                self.set_busy(False)
-                self.entry.grab_focus()
+                self._stream_row = None
+                self.transcript.remove_all()
+                self.add_row("assistant", "Bắt đầu cuộc chat mới ✅")
                 self.autosave_history()
+                self.update_controls()
+                self.entry.grab_focus()
                 return False
 
             GLib.idle_add(update_ui)
 
-        threading.Thread(target=worker, daemon=True).start()
-
-    def on_reset(self):
-        if self.engine is None or self.busy:
-            return
-        self.engine.reset()
-        self.buffer.set_text("")
-        self.append_text("🤖 Tôi: Bắt đầu cuộc chat mới ✅\n")
-        self.autosave_history()
-        self.entry.grab_focus()
+        self.executor.submit("reset", reset)
 
     # ---------------- File dialogs (GTK4) ----------------
     def action_load_history(self, *_):
-        if self.busy:
-            return
         dialog = Gtk.FileDialog(title="Load history", modal=True)
         dialog.open(self, None, self._on_open_done)
 
@@ -287,23 +563,33 @@ class ChatWindow(Gtk.ApplicationWindow):
                 return
             data = json.loads(Path(path).read_text(encoding="utf-8"))
         except Exception as e:
-            self.append_text(f"\n❌ Load history lỗi: {e}\n")
+            self.add_notice(f"❌ Load history lỗi: {e}")
             return
 
         if self.engine is None:
-            self.append_text("\n❌ Chưa load model nên không nạp history được.\n")
+            self.add_notice("❌ Chưa load model nên không nạp history được.")
             return
 
-        try:
-            self.engine.load_json(data)
-            self.rebuild_view_from_history()
-            self.append_text("\n✅ Đã load history.\n")
-            self.autosave_history()
-        except Exception as e:
-            self.append_text(f"\n❌ Nạp history lỗi: {e}\n")
+        def load(job):
+            try:
+                self.engine.load_json(data)
+            except Exception as e:
+                GLib.idle_add(self.add_notice, f"❌ Nạp history lỗi: {e}")
+                return
+
+            def update_ui():
+                self.rebuild_view_from_history()
+                self.add_notice("✅ Đã load history.")
+                self.autosave_history()
+                return False
+
+            GLib.idle_add(update_ui)
+
+        # Đợi câu trả lời hiện tại xong rồi mới thay history
+        self.executor.submit("history", load)
 
     def action_save_history(self, *_):
-        if self.busy or self.engine is None:
+        if self.engine is None:
             return
         dialog = Gtk.FileDialog(title="Save history as", modal=True)
         dialog.save(self, None, self._on_save_done)
@@ -320,12 +606,12 @@ class ChatWindow(Gtk.ApplicationWindow):
                 json.dumps(self.engine.to_json(), ensure_ascii=False, indent=2),
                 encoding="utf-8",
             )
-            self.append_text(f"\n✅ Đã lưu history: {path}\n")
+            self.add_notice(f"✅ Đã lưu history: {path}")
         except Exception as e:
-            self.append_text(f"\n❌ Save history lỗi: {e}\n")
+            self.add_notice(f"❌ Save history lỗi: {e}")
 
     def action_export_text(self, *_):
-        if self.busy or self.engine is None:
+        if self.engine is None:
             return
         dialog = Gtk.FileDialog(title="Export chat as text", modal=True)
         dialog.save(self, None, self._on_export_done)
@@ -339,9 +625,9 @@ class ChatWindow(Gtk.ApplicationWindow):
             if not path:
                 return
             Path(path).write_text(self.engine.export_text(), encoding="utf-8")
-            self.append_text(f"\n✅ Đã export text: {path}\n")
+            self.add_notice(f"✅ Đã export text: {path}")
         except Exception as e:
-            self.append_text(f"\n❌ Export lỗi: {e}\n")
+            self.add_notice(f"❌ Export lỗi: {e}")
 
 
 class ChatApp(Gtk.Application):
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import diskcache
+
+from raspdbot_cache import CACHE_DIR, file_signature
+from raspdbot_retrieval import normalize
+
+# =========================
+# Cache câu trả lời (diskcache, LRU + giới hạn dung lượng + TTL)
+# =========================
+DEFAULT_SIZE_LIMIT = 64 * 1024 * 1024   # 64 MB
+DEFAULT_TTL = 7 * 24 * 3600             # 7 ngày
+
+
+def model_fingerprint(model_path: str) -> str:
+    # Không hash cả file GGUF (vài GB): dùng path + size + mtime
+    try:
+        sig = file_signature(model_path)
+    except OSError:
+        return os.path.abspath(model_path)
+    return f"{os.path.abspath(model_path)}:{sig['size']}:{sig['mtime_ns']}"
+
+
+def conversation_key(summary: str, messages: Sequence[Dict[str, str]]) -> List[str]:
+    # Digest phần hội thoại đứng trước câu hỏi trong prompt; [] khi chưa có gì (lượt đầu)
+    if not summary and not messages:
+        return []
+    payload = json.dumps([summary, [(m["role"], m["content"]) for m in messages]], ensure_ascii=False)
+    return [hashlib.sha256(payload.encode("utf-8")).hexdigest()]
+
+
+class AnswerCache:
+    """
+    Key = hash(model, câu hỏi đã normalize, id context đã retrieve, tham số sampling,
+    digest hội thoại trước đó nếu có).
+    Mỗi scope (vd "engine:<model>") gắn tag riêng; khi fingerprint của scope
+    (model/dataset) đổi thì evict toàn bộ entry của scope đó.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        size_limit: int = DEFAULT_SIZE_LIMIT,
+        ttl: Optional[float] = DEFAULT_TTL,
+    ):
+        self.directory = str(directory or CACHE_DIR / "answers")
+        self.cache = diskcache.Cache(
+            self.directory,
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+            tag_index=True,
+        )
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        model_fp: str,
+        question: str,
+        context_ids: Sequence = (),
+        params: Optional[Dict] = None,
+        conversation: Sequence = (),
+    ) -> str:
+        # conversation: phần hội thoại trước câu hỏi mà prompt có chứa (tóm tắt + lượt cũ);
+        # rỗng (lượt đầu / bot không giữ hội thoại) -> key như câu hỏi độc lập
+        parts = [model_fp, normalize(question), list(context_ids), params or {}]
+        if conversation:
+            parts.append(list(conversation))
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def bind(self, scope: str, fingerprint: str):
+        # Model hoặc dataset đổi -> bỏ hết câu trả lời cũ của scope này
+        meta_key = f"__fingerprint__:{scope}"
+        if self.cache.get(meta_key) != fingerprint:
+            self.cache.evict(scope)
+            self.cache.set(meta_key, fingerprint)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.cache.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, answer: str, scope: Optional[str] = None):
+        self.cache.set(key, answer, expire=self.ttl, tag=scope)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.cache),
+            "bytes": self.cache.volume(),
+        }
+
+    def close(self):
+        self.cache.close()
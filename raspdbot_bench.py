@@ -0,0 +1,333 @@
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import RaspDbot_jsonl_chatbot as jsonl_bot
+from raspdbot_bot import RaspDbotEngine
+from raspdbot_corpus import extract_qa, iter_jsonl, load_corpus
+from raspdbot_llm import LOOKUP_NGRAM, LOOKUP_WINDOW, StubLlama, create_llm, lookup_stats, make_lookup_draft
+from raspdbot_transcript import PromptTranscript
+
+# =========================
+# Benchmark offline: latency / throughput theo từng giai đoạn
+# =========================
+# Replay các câu hỏi của user trong dataset qua:
+#   - "jsonl":  retrieval -> build prompt -> prefill -> decode (pipeline của RaspDbot_jsonl_chatbot;
+#               --conversation: nối các lượt vào một transcript như bot nhiều lượt)
+#   - "engine": RaspDbotEngine.ask_stream (prompt+prefill đo bằng TTFT, decode)
+# Không có --model -> dùng StubLlama (tất định, chạy được trên CI).
+PROJECT_DIR = Path(__file__).resolve().parent
+DEFAULT_DATASETS = [
+    str(PROJECT_DIR / "raspdbot_car_dataset_clean.jsonl"),
+    str(PROJECT_DIR / "raspDbot_star_training.jsonl"),
+]
+DEFAULT_OUT_DIR = PROJECT_DIR / "bench_results"
+REGRESSION_TOLERANCE = 0.10
+
+
+def user_turns(path: str, limit: Optional[int] = None) -> List[str]:
+    turns = []
+    for _, item in iter_jsonl(path):
+        q, _ = extract_qa(item)
+        if q:
+            turns.append(q)
+        if limit and len(turns) >= limit:
+            break
+    return turns
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    # nearest-rank
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, math.ceil(p / 100.0 * len(s)) - 1))
+    return s[k]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "n": len(values),
+        "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+        "p50_ms": 1000 * percentile(values, 50),
+        "p95_ms": 1000 * percentile(values, 95),
+        "p99_ms": 1000 * percentile(values, 99),
+    }
+
+
+def peak_rss_mb() -> float:
+    # Linux: ru_maxrss tính bằng KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_DIR, capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}
+        self.tokens = 0
+        self.decode_s = 0.0
+        self.lookup_proposed = 0
+        self.lookup_accepted = 0
+        self.prompt_tokens = 0
+        self.reused_tokens = 0
+
+    def add(self, stage: str, seconds: float):
+        self.stages.setdefault(stage, []).append(seconds)
+
+    def add_lookup(self, llm):
+        # Cộng dồn số token nháp của lượt vừa chạy rồi reset bộ đếm của draft
+        st = lookup_stats(llm, reset=True)
+        self.lookup_proposed += st.get("lookup_proposed", 0)
+        self.lookup_accepted += st.get("lookup_accepted", 0)
+
+    def add_prefix(self, transcript: PromptTranscript):
+        # Token prompt / token dùng lại từ KV cache của lượt LLM vừa chạy
+        self.prompt_tokens += transcript.last_prompt_tokens
+        self.reused_tokens += transcript.last_reused
+
+    def merge(self, other: "StageTimer"):
+        for stage, values in other.stages.items():
+            self.stages.setdefault(stage, []).extend(values)
+        self.tokens += other.tokens
+        self.decode_s += other.decode_s
+        self.lookup_proposed += other.lookup_proposed
+        self.lookup_accepted += other.lookup_accepted
+        self.prompt_tokens += other.prompt_tokens
+        self.reused_tokens += other.reused_tokens
+
+    def report(self) -> Dict:
+        rep = {
+            "stages": {k: summarize(v) for k, v in self.stages.items()},
+            "completion_tokens": self.tokens,
+            "decode_tokens_per_s": self.tokens / self.decode_s if self.decode_s > 0 else 0.0,
+        }
+        if self.lookup_proposed:
+            rep["lookup_proposed"] = self.lookup_proposed
+            rep["lookup_accepted"] = self.lookup_accepted
+            rep["lookup_accept_rate"] = self.lookup_accepted / self.lookup_proposed
+        if self.prompt_tokens:
+            rep["prompt_tokens"] = self.prompt_tokens
+            rep["prefix_reused_tokens"] = self.reused_tokens
+            rep["prefix_reuse_rate"] = self.reused_tokens / self.prompt_tokens
+        return rep
+
+
+def consume_stream(stream, timer: StageTimer, t0: float, first_stage: str):
+    # Chunk đầu tiên đánh dấu hết prefill; mỗi chunk stream ~ 1 token
+    t_first = None
+    n = 0
+    for _ in stream:
+        if t_first is None:
+            t_first = time.perf_counter()
+            timer.add(first_stage, t_first - t0)
+        n += 1
+    t_end = time.perf_counter()
+    if t_first is None:
+        timer.add(first_stage, t_end - t0)
+        t_first = t_end
+    timer.add("decode", t_end - t_first)
+    timer.tokens += max(0, n - 1)
+    timer.decode_s += t_end - t_first
+
+
+def bench_jsonl(llm, dataset: str, turns: List[str], max_tokens: int, conversation: bool = False) -> Dict:
+    corpus = load_corpus(dataset)
+    index = corpus.index
+    timer = StageTimer()
+    params = dict(jsonl_bot.SAMPLING_PARAMS, max_tokens=max_tokens)
+    transcript = PromptTranscript(llm)
+
+    for question in turns:
+        t0 = time.perf_counter()
+        top = jsonl_bot.top_k_context(question, corpus.qa_pairs, k=5, index=index)
+        t1 = time.perf_counter()
+        context = jsonl_bot.build_context_text(top)
+        prompt, base = jsonl_bot.build_prompt_tokens(transcript, question, context, max_tokens, multi_turn=conversation)
+        t2 = time.perf_counter()
+        timer.add("retrieval", t1 - t0)
+        timer.add("prompt_build", t2 - t1)
+        transcript.measure(prompt)
+        timer.add_prefix(transcript)
+        raw: List[str] = []
+        stream = llm(prompt, stop=jsonl_bot.STOP_TOKENS, stream=True, **params)
+
+        def chunks():
+            for chunk in stream:
+                raw.append(chunk["choices"][0]["text"] or "")
+                yield chunk
+
+        consume_stream(chunks(), timer, time.perf_counter(), "prefill")
+        transcript.commit(prompt, "".join(raw).rstrip(), base=base)
+        timer.add("total", time.perf_counter() - t0)
+        timer.add_lookup(llm)
+    return timer.report()
+
+
+def bench_engine(engine: RaspDbotEngine, turns: List[str], conversation: bool) -> Dict:
+    # Lượt không gọi LLM (greeting / need_data / cache) trả lời gần như tức thì:
+    # tính riêng vào stage "non_llm", không kéo ttft / total / tok/s xuống
+    timer = StageTimer()
+    non_llm = 0
+    for question in turns:
+        if not conversation:
+            engine.reset()
+        transcript = engine.transcript()
+        n_turns = transcript.turns
+        turn = StageTimer()
+        t0 = time.perf_counter()
+        with closing(engine.ask_stream(question)) as stream:
+            consume_stream(stream, turn, t0, "ttft")
+        elapsed = time.perf_counter() - t0
+        turn.add_lookup(engine.llm)
+        if transcript.turns == n_turns:
+            non_llm += 1
+            timer.add("non_llm", elapsed)
+            continue
+        turn.add("total", elapsed)
+        turn.add_prefix(transcript)
+        timer.merge(turn)
+    rep = timer.report()
+    rep["llm_turns"] = len(turns) - non_llm
+    rep["non_llm_turns"] = non_llm
+    return rep
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = REGRESSION_TOLERANCE) -> List[str]:
+    # Trả về danh sách dòng báo cáo; dòng bắt đầu bằng "REGRESSION" nếu chậm hơn ngưỡng
+    lines = []
+    for name, res in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for stage, st in res["stages"].items():
+            b = base["stages"].get(stage)
+            if not b:
+                continue
+            for key in ("p50_ms", "p95_ms"):
+                old, new = b[key], st[key]
+                if old <= 0:
+                    continue
+                delta = (new - old) / old
+                tag = "REGRESSION" if delta > tolerance else "ok"
+                lines.append(f"{tag:10s} {name}/{stage} {key}: {old:.2f} -> {new:.2f} ({delta:+.1%})")
+    return lines
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark latency/throughput của RaspDbot trên dataset có sẵn.")
+    ap.add_argument("--model", default="", help="file GGUF thật; bỏ trống -> StubLlama")
+    ap.add_argument("--dataset", action="append", help="JSONL (mặc định: cả 2 dataset đi kèm)")
+    ap.add_argument("--limit", type=int, default=50, help="số câu hỏi mỗi dataset (0 = tất cả)")
+    ap.add_argument("--pipeline", choices=["all", "jsonl", "engine"], default="all")
+    ap.add_argument("--max-tokens", type=int, default=128)
+    ap.add_argument("--n-ctx", type=int, default=2048)
+    ap.add_argument("--conversation", action="store_true", help="giữ hội thoại giữa các lượt (engine + jsonl nhiều lượt)")
+    ap.add_argument("--stub-prefill-tps", type=float, default=0.0)
+    ap.add_argument("--stub-decode-tps", type=float, default=0.0)
+    ap.add_argument(
+        "--lookup-tokens", type=int, default=0,
+        help="> 0: chạy thêm mỗi pipeline với prompt-lookup decoding (số token nháp) để so tok/s",
+    )
+    ap.add_argument("--lookup-ngram", type=int, default=LOOKUP_NGRAM)
+    ap.add_argument("--lookup-window", type=int, default=LOOKUP_WINDOW)
+    ap.add_argument("--out", default=str(DEFAULT_OUT_DIR), help="thư mục lưu kết quả JSON")
+    ap.add_argument("--compare", default="", help="file kết quả cũ để so sánh")
+    ap.add_argument("--fail-on-regression", action="store_true")
+    args = ap.parse_args()
+
+    datasets = args.dataset or DEFAULT_DATASETS
+    stub = not args.model
+    if stub:
+        llm = StubLlama(n_ctx=args.n_ctx, prefill_tps=args.stub_prefill_tps, decode_tps=args.stub_decode_tps)
+    else:
+        llm = create_llm(args.model, n_ctx=args.n_ctx, lookup_tokens=0)
+
+    # draft_model là thuộc tính của Llama -> cùng một model, bật / tắt giữa các lượt chạy
+    variants = [("", None)]
+    draft = make_lookup_draft(args.lookup_tokens, args.lookup_ngram, args.lookup_window)
+    if draft is not None:
+        variants.append(("+lookup", draft))
+
+    results: Dict[str, Dict] = {}
+    for dataset in datasets:
+        name = Path(dataset).stem
+        turns = user_turns(dataset, args.limit or None)
+        for suffix, draft_model in variants:
+            llm.draft_model = draft_model
+            if args.pipeline in ("all", "jsonl"):
+                results[f"jsonl:{name}{suffix}"] = bench_jsonl(llm, dataset, turns, args.max_tokens, args.conversation)
+            if args.pipeline in ("all", "engine"):
+                engine = RaspDbotEngine(
+                    model_path=args.model or "stub.gguf", n_ctx=args.n_ctx, llm=llm, prefix_cache=not stub
+                )
+                results[f"engine:{name}{suffix}"] = bench_engine(engine, turns, args.conversation)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_revision(),
+            "model": os.path.abspath(args.model) if args.model else "stub",
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+
+    for name, res in results.items():
+        extra = ""
+        if "lookup_accept_rate" in res:
+            base = results.get(name.replace("+lookup", ""), {}).get("decode_tokens_per_s", 0.0)
+            gain = res["decode_tokens_per_s"] / base if base > 0 else 0.0
+            extra = f", nháp chấp nhận {res['lookup_accept_rate']:.1%}, x{gain:.2f} so với không lookup"
+        if "prefix_reuse_rate" in res:
+            extra += f", KV dùng lại {res['prefix_reuse_rate']:.0%} token prompt"
+        if res.get("non_llm_turns"):
+            extra += f", {res['llm_turns']} lượt LLM + {res['non_llm_turns']} lượt không gọi LLM (stage non_llm)"
+        print(f"== {name}  ({res['decode_tokens_per_s']:.1f} tok/s{extra})")
+        for stage, st in res["stages"].items():
+            print(
+                f"  {stage:13s} n={st['n']:4d}  p50={st['p50_ms']:8.2f}ms  "
+                f"p95={st['p95_ms']:8.2f}ms  p99={st['p99_ms']:8.2f}ms"
+            )
+    print(f"peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tag = "stub" if stub else Path(args.model).stem
+    out_path = out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{report['meta']['git']}-{tag}.json"
+    out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Đã lưu: {out_path}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        lines = compare(report, baseline)
+        print("\n".join(lines) or "(không có stage chung để so sánh)")
+        if args.fail_on_regression and any(l.startswith("REGRESSION") for l in lines):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,19 @@
 import os
-from typing import List, Dict, Optional
-from llama_cpp import Llama
+import threading
+import time
+import weakref
+from contextlib import closing
+from typing import Generator, Iterator, List, Dict, Optional, Tuple
+
+from raspdbot_answer_cache import AnswerCache, conversation_key, model_fingerprint
+from raspdbot_context import ConversationWindow, TokenCounter, render_message
+from raspdbot_kvcache import prime_prefix, restore_prefix
+from raspdbot_llm import create_llm
+from raspdbot_memory import memory_stats
+from raspdbot_intent import EXIT_WORDS, IntentRouter, load_intents
+from raspdbot_metrics import DISABLED, MetricsLogger, llama_perf, llama_perf_reset
+from raspdbot_transcript import PromptTranscript
+from raspdbot_retrieval import coverage
 
 # =========================
 # Greetings (chặn bằng code)
@@ -17,6 +30,24 @@ NEED_DATA_KEYWORDS = [
     "imu", "lidar", "camera", "log", "pin", "battery"
 ]
 
+# Router build một lần (khớp trọn từ, có/không dấu); greeting phải là cả câu.
+# Dùng chung cho engine và RaspDbot_chatbot.py
+INTENTS = load_intents({
+    "greeting": GREETINGS,
+    "need_data": NEED_DATA_KEYWORDS,
+    "exit": EXIT_WORDS,
+})
+ROUTER = IntentRouter(INTENTS, exact={"greeting", "exit"})
+
+GREETING_REPLY = "Xin chào 👋 Tôi đây. Bạn muốn hỏi gì về RaspDbot-Car?"
+NEED_DATA_REPLY = (
+    "Tôi chưa có dữ liệu realtime của xe (GPS/tốc độ/cảm biến/log).\n"
+    "Bạn hãy gửi một trong các thông tin sau để tôi phân tích:\n"
+    "- Log/telemetry (JSON/text)\n"
+    "- Thông số cảm biến\n"
+    "- Trạng thái hiện tại (vị trí/tốc độ/pin)\n"
+)
+
 # =========================
 # Prompt / Stop tokens
 # =========================
@@ -37,19 +68,149 @@ SYSTEM_PROMPT = (
 # Stop tokens có newline để chặn multi-turn "### Assistant:" sinh lại
 STOP_TOKENS = ["\n### User:", "\n### System:", "\n### Assistant:"]
 
+# Marker cắt câu trả lời nếu model lỡ in ra hoặc tự chat tiếp
+CUT_MARKERS = ["\n### ", "### Assistant:", "### User:", "### System:"]
+
+# Ép nhẹ xưng hô
+PERSONA_REPLACEMENTS = [("Mình ", "Tôi "), ("mình ", "tôi "), ("Tớ ", "Tôi "), ("tớ ", "tôi ")]
+
+MAX_TOKENS = 256
+
+# Tham số sampling (cũng là một phần key của answer cache)
+SAMPLING_PARAMS = {
+    "max_tokens": MAX_TOKENS,
+    "temperature": 0.35,
+    "top_p": 0.9,
+    "top_k": 50,
+    "repeat_penalty": 1.15,
+}
+
+# Ngân sách cho phần tóm tắt các lượt cũ (xem raspdbot_context.ConversationWindow)
+SUMMARY_MAX_TOKENS = 160
+CONTEXT_MARGIN_TOKENS = 64
+
+EMPTY_ANSWER = "(Tôi không sinh được câu trả lời — bạn thử tăng max_tokens hoặc đổi prompt template.)"
+
+# Tài liệu tham khảo lấy từ các corpus JSONL của model (raspdbot_registry)
+RAG_TOP_K = 3
+RAG_MIN_SCORE = 0.60      # như ngưỡng clarify của JSONL bot: thấp hơn coi như không liên quan
+# Score chỉ chuẩn hoá theo query nên câu mơ hồ ("xe", "pin") khớp ~1.0 với câu bất kỳ
+# chứa từ đó -> mẫu còn phải phủ câu hỏi đủ (coverage(), như tầng direct/rewrite của JSONL bot).
+# Đo trên 2 dataset (raspdbot_eval, top-1 đúng, không tính câu gốc): câu sinh tự động ~88..100%
+# >= 0.55; câu viết tay diễn đạt khác hẳn chỉ ~0.4 (và score < RAG_MIN_SCORE) -> không chèn,
+# đúng ý vì top-1 của chúng sai quá nửa. "xe" / "xe chạy" 0.5, "pin" 0.33.
+RAG_MIN_COVERAGE = float(os.environ.get("RASPDBOT_RAG_COVERAGE", "0.55"))
+RAG_MAX_TOKENS = 384
+RAG_HEADER = "### Tài liệu tham khảo (chỉ dùng nếu liên quan):\n"
+
+# Chế độ ngân sách RAM không giảm n_ctx dưới mức chứa được system + lượt hỏi
+# ngắn (~256 token) cùng phần trả lời và tóm tắt (+ RAG_MAX_TOKENS khi có retriever)
+MIN_CTX_TOKENS = MAX_TOKENS + SUMMARY_MAX_TOKENS + CONTEXT_MARGIN_TOKENS + 256
+
+
+def build_system_prefix() -> str:
+    return "### System:\n" + SYSTEM_PROMPT.strip() + "\n"
+
 
-def build_prompt(history: List[Dict[str, str]]) -> str:
+# Những gì có thể theo sau system prefix trong prompt thật (để xác định ranh giới token)
+PREFIX_CONTINUATIONS = ["\n### User:\n", "\n### Assistant:\n", "\n" + RAG_HEADER]
+
+
+def build_prompt(history: List[Dict[str, str]], summary: str = "", context: str = "") -> str:
+    # context (tài liệu tham khảo của lượt này) nằm ngay trước câu hỏi cuối:
+    # đổi theo từng lượt nên không được chen vào giữa prefix của các lượt trước
     parts: List[str] = []
-    parts.append("### System:\n" + SYSTEM_PROMPT.strip() + "\n")
+    parts.append(build_system_prefix())
+    if summary:
+        parts.append("### Tóm tắt hội thoại trước:\n" + summary.strip() + "\n")
+
+    for m in history[:-1]:
+        parts.append(render_message(m))
+    parts.extend(build_turn(history[-1:], context))
+    return "\n".join(parts)
 
-    for m in history:
-        if m["role"] == "user":
-            parts.append("### User:\n" + m["content"].strip() + "\n")
-        else:
-            parts.append("### Assistant:\n" + m["content"].strip() + "\n")
 
+def build_turn(messages: List[Dict[str, str]], context: str = "") -> List[str]:
+    # Các message chưa có trong transcript + context + câu hỏi cuối + header trả lời
+    parts = [render_message(m) for m in messages[:-1]]
+    if context:
+        parts.append(context)
+    parts.extend(render_message(m) for m in messages[-1:])
     parts.append("### Assistant:\n")
-    return "\n".join(parts)
+    return parts
+
+
+def build_summary_prompt(prev_summary: str, messages: List[Dict[str, str]]) -> str:
+    convo = "\n".join(
+        ("Bạn: " if m["role"] == "user" else "Tôi: ") + m["content"].strip() for m in messages
+    )
+    request = (
+        "Tóm tắt thật ngắn (tối đa 5 gạch đầu dòng) các ý chính của đoạn hội thoại sau, "
+        "giữ lại thông số/kết luận quan trọng.\n"
+    )
+    if prev_summary:
+        request += "Tóm tắt trước đó:\n" + prev_summary.strip() + "\n"
+    request += "Hội thoại:\n" + convo
+    return "\n".join([build_system_prefix(), render_message({"role": "user", "content": request}), "### Assistant:\n"])
+
+
+def cut_raw(text: str) -> str:
+    # Phần câu trả lời thô model đã sinh trước marker cắt (giữ khoảng trắng đầu như model thấy)
+    cut = min((i for i in (text.find(m) for m in CUT_MARKERS) if i != -1), default=-1)
+    return (text[:cut] if cut != -1 else text).rstrip()
+
+
+class StreamCutter:
+    """
+    Xử lý dần text stream: bỏ khoảng trắng đầu/cuối, cắt tại marker đầu tiên,
+    thay thế xưng hô. Giữ lại phần đuôi có thể là nửa đầu của marker/pattern
+    cho tới khi đủ dữ liệu để quyết định.
+    """
+
+    def __init__(self, markers: List[str], replacements: List[Tuple[str, str]]):
+        self.markers = markers
+        self.replacements = replacements
+        self.holdback = max(len(x) for x in markers + [p for p, _ in replacements]) - 1
+        self.pending = ""
+        self.started = False
+        self.done = False
+
+    def _replace(self, text: str) -> str:
+        for old, new in self.replacements:
+            text = text.replace(old, new)
+        return text
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        if self.done:
+            return "", True
+        self.pending += text
+        if not self.started:
+            self.pending = self.pending.lstrip()
+            if not self.pending:
+                return "", False
+
+        cut = min((i for i in (self.pending.find(m) for m in self.markers) if i != -1), default=-1)
+        if cut != -1:
+            self.pending = self.pending[:cut]
+            self.done = True
+            return self.finish(), True
+
+        self.pending = self._replace(self.pending)
+        # Không phát khoảng trắng cuối: có thể ngay sau đó là marker cần cắt
+        safe = len(self.pending[:max(0, len(self.pending) - self.holdback)].rstrip())
+        if safe <= 0:
+            return "", False
+        out, self.pending = self.pending[:safe], self.pending[safe:]
+        self.started = True
+        return out, False
+
+    def finish(self) -> str:
+        out = self._replace(self.pending).rstrip()
+        if not self.started:
+            out = out.lstrip()
+        self.pending = ""
+        self.started = self.started or bool(out)
+        return out
 
 
 class RaspDbotEngine:
@@ -59,78 +220,323 @@ class RaspDbotEngine:
         n_ctx: int = 2048,
         n_threads: Optional[int] = None,
         n_gpu_layers: int = 0,
+        prefix_cache: bool = True,
+        history_budget: Optional[int] = None,
+        answer_cache: Optional[AnswerCache] = None,
+        llm=None,
+        metrics: Optional[MetricsLogger] = None,
+        retriever=None,
+        lookup_tokens: Optional[int] = None,
     ):
+        # llm: truyền sẵn instance (vd StubLlama cho benchmark/CI) thay vì nạp GGUF
+        # retriever: có search() + qa_pairs (vd CorpusRegistry.retriever_for) -> thêm tài liệu tham khảo vào prompt
+        # lookup_tokens: số token nháp của prompt-lookup decoding (None = RASPDBOT_LOOKUP_TOKENS, 0 = tắt)
         self.model_path = model_path
-        if not os.path.exists(self.model_path):
+        if llm is None and not os.path.exists(self.model_path):
             raise FileNotFoundError(f"Không tìm thấy model: {self.model_path}")
 
-        self.llm = Llama(
-            model_path=self.model_path,
+        self.llm = llm or create_llm(
+            self.model_path,
             n_ctx=n_ctx,
-            n_threads=n_threads or (os.cpu_count() or 4),
+            n_threads=n_threads,
             n_gpu_layers=n_gpu_layers,
-            verbose=False,
+            lookup_tokens=lookup_tokens,
+            min_ctx=MIN_CTX_TOKENS + (RAG_MAX_TOKENS if retriever is not None else 0),
         )
         self.history: List[Dict[str, str]] = []
+        # Đo thời gian từng giai đoạn (tắt -> no-op); last_metrics cho status bar
+        self.metrics = metrics or DISABLED
+        self.last_metrics: Dict = {}
+        self.retriever = retriever
+        # Transcript token theo từng hội thoại (window) -> lượt sau chỉ prefill phần mới
+        self._transcripts: "weakref.WeakKeyDictionary[ConversationWindow, PromptTranscript]" = (
+            weakref.WeakKeyDictionary()
+        )
+        # LLM không thread-safe: generate và tóm tắt nền dùng chung lock
+        self._llm_lock = threading.Lock()
+
+        # Prompt chỉ chứa các lượt mới nhất vừa ngân sách token, phần cũ -> tóm tắt
+        counter = TokenCounter(self.llm)
+        if history_budget is None:
+            history_budget = (
+                self.llm.n_ctx()
+                - MAX_TOKENS
+                - counter.count(build_system_prefix())
+                - SUMMARY_MAX_TOKENS
+                - CONTEXT_MARGIN_TOKENS
+                - (RAG_MAX_TOKENS if retriever is not None else 0)
+            )
+        self._counter = counter
+        self._history_budget = history_budget
+        self.window = self.new_window()
+
+        # Cache câu trả lời cho câu hỏi lặp lại (scope theo model)
+        self.answer_cache = answer_cache
+        self._model_fp = model_fingerprint(self.model_path)
+        self._cache_scope = f"engine:{os.path.abspath(self.model_path)}"
+        if self.answer_cache is not None:
+            self.answer_cache.bind(self._cache_scope, self._model_fp)
+
+        # Prefill system prompt một lần (hoặc load snapshot trên đĩa)
+        self._prefix_state = None
+        if prefix_cache:
+            try:
+                self._prefix_state = prime_prefix(
+                    self.llm, self.model_path, build_system_prefix(), PREFIX_CONTINUATIONS
+                )
+            except Exception:
+                self._prefix_state = None
+
+    def new_window(self) -> ConversationWindow:
+        # Mỗi hội thoại (vd mỗi session của server) cần window riêng
+        return ConversationWindow(
+            self._counter, self._history_budget, summarizer=self._summarize, summary_max_tokens=SUMMARY_MAX_TOKENS
+        )
 
     def ask(self, user_text: str) -> str:
+        with closing(self.ask_stream(user_text)) as stream:
+            return "".join(stream)
+
+    def ask_stream(
+        self,
+        user_text: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        window: Optional[ConversationWindow] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Iterator[str]:
+        """
+        Như ask() nhưng yield từng đoạn text ngay khi model sinh ra.
+        Marker cắt / xưng hô được xử lý dần; gặp marker thì dừng sinh luôn.
+        Dừng vòng lặp giữa chừng (close generator) cũng dừng LLM, phần đã
+        sinh vẫn được lưu vào history. Generator giữ lock của LLM tới khi
+        xong / bị close(): caller dùng `with closing(engine.ask_stream(...))`.
+        history/window: hội thoại khác với hội thoại mặc định của engine
+        (server nhiều session dùng chung một model).
+        cancel: set() từ thread khác -> llama dừng sau token hiện tại
+        (stopping_criteria), phần đã sinh vẫn vào history nhưng không vào cache.
+        """
+        if history is None:
+            history, window = self.history, self.window
+        elif window is None:
+            raise ValueError("history riêng cần window riêng (new_window())")
+        turn = self.metrics.start_turn("engine")
+        try:
+            yield from self._ask_stream(user_text, history, window, cancel, turn)
+        finally:
+            self.last_metrics = self.metrics.log(turn)
+
+    def _ask_stream(self, user_text: str, history, window, cancel, turn) -> Iterator[str]:
         user_text = (user_text or "").strip()
         if not user_text:
-            return "Bạn hãy nhập câu hỏi trước nhé."
+            yield "Bạn hãy nhập câu hỏi trước nhé."
+            return
 
-        low = user_text.lower()
+        with turn.stage("intent"):
+            intents = ROUTER.intents(user_text)
 
         # 1) Greeting: trả lời ngay, không gọi LLM
-        if low in GREETINGS:
-            return "Xin chào 👋 Tôi đây. Bạn muốn hỏi gì về RaspDbot-Car?"
+        if "greeting" in intents:
+            turn.set(route="greeting")
+            yield GREETING_REPLY
+            return
 
         # 2) Realtime data: trả lời chắc chắn, không gọi LLM
-        if any(k in low for k in NEED_DATA_KEYWORDS):
-            return (
-                "Tôi chưa có dữ liệu realtime của xe (GPS/tốc độ/cảm biến/log).\n"
-                "Bạn hãy gửi một trong các thông tin sau để tôi phân tích:\n"
-                "- Log/telemetry (JSON/text)\n"
-                "- Thông số cảm biến\n"
-                "- Trạng thái hiện tại (vị trí/tốc độ/pin)\n"
-            )
+        if "need_data" in intents:
+            turn.set(route="need_data")
+            yield NEED_DATA_REPLY
+            return
 
-        self.history.append({"role": "user", "content": user_text})
-        prompt = build_prompt(self.history)
-
-        out = self.llm(
-            prompt,
-            max_tokens=256,
-            temperature=0.35,
-            top_p=0.9,
-            top_k=50,
-            repeat_penalty=1.15,
-            stop=STOP_TOKENS,
-        )
+        history.append({"role": "user", "content": user_text})
+
+        # 3) Tài liệu tham khảo từ dataset của model (RAG)
+        context, context_ids = "", []
+        if self.retriever is not None:
+            with turn.stage("retrieval"):
+                context, context_ids, best = self._retrieve(user_text)
+            turn.set(rag_docs=len(context_ids), rag_best_score=round(best, 4))
+
+        with turn.stage("prompt"):
+            summary, recent = window.select(history)
+
+        # 4) Câu hỏi đã gặp (cùng tài liệu, cùng phần hội thoại trước đó) -> trả lời từ cache, không gọi LLM
+        cache_key = None
+        if self.answer_cache is not None:
+            with turn.stage("cache"):
+                conversation = conversation_key(summary, recent[:-1])
+                cache_key = AnswerCache.make_key(
+                    self._model_fp, user_text, context_ids, SAMPLING_PARAMS, conversation=conversation
+                )
+                cached = self.answer_cache.get(cache_key)
+            if cached:
+                turn.set(route="cache")
+                history.append({"role": "assistant", "content": cached})
+                yield cached
+                return
+
+        with turn.stage("prompt"):
+            transcript = self.transcript(window)
+            prompt, key = self._prompt_tokens(transcript, history, summary, recent, context)
+        turn.set(route="llm", window_messages=len(recent), summary_chars=len(summary))
+
+        # Lock giữ suốt lúc stream: caller dừng sớm phải close() generator (with closing(...))
+        # để nhả lock; GeneratorExit / lỗi đều đi qua finally
+        with turn.stage("lock_wait"):
+            self._llm_lock.acquire()
+        try:
+            answer = yield from self._generate(prompt, history, cancel, turn, transcript, key)
+        finally:
+            self._llm_lock.release()
+            # Phần đã sinh đã vào history (kể cả khi dừng sớm) -> tóm tắt nền vẫn chạy
+            window.summarize_async(history)
+        cancelled = cancel is not None and cancel.is_set()
+        if cancelled:
+            turn.set(cancelled=True)
+        if cache_key is not None and answer and answer != EMPTY_ANSWER and not cancelled:
+            self.answer_cache.set(cache_key, answer, scope=self._cache_scope)
+
+    def transcript(self, window: Optional[ConversationWindow] = None) -> PromptTranscript:
+        window = window or self.window
+        transcript = self._transcripts.get(window)
+        if transcript is None:
+            transcript = PromptTranscript(self.llm)
+            self._transcripts[window] = transcript
+        return transcript
 
-        answer = (out["choices"][0]["text"] or "").strip()
-        if not answer:
-            answer = "(Tôi không sinh được câu trả lời — bạn thử tăng max_tokens hoặc đổi prompt template.)"
+    def _prompt_tokens(
+        self, transcript: PromptTranscript, history, summary: str, recent, context: str
+    ) -> Tuple[List[int], Tuple]:
+        """
+        Nối lượt mới vào transcript khi phần đầu hội thoại không đổi: cùng
+        list history, cùng điểm cắt window + tóm tắt, và transcript chưa vượt
+        quá lượt hiện tại. Ngược lại (window vừa cắt, tóm tắt LLM vừa xong,
+        reset / load history, sắp tràn n_ctx) thì build lại từ text; câu trả
+        lời cũ lúc đó lấy theo history (đã ép xưng hô).
+        -> (token prompt, key cho commit: (history, điểm cắt, tóm tắt)).
+        """
+        start = len(history) - len(recent)
+        key = (history, start, summary)
+        last = transcript.key      # key + số message đã có trong transcript
+        if transcript.tokens and last is not None and last[0] is history and last[1:3] == (start, summary):
+            n_messages = last[3]
+            if start <= n_messages < len(history):
+                tokens = transcript.extend("\n\n" + "\n".join(build_turn(history[n_messages:], context)))
+                if transcript.fits(tokens, MAX_TOKENS):
+                    return tokens, key
+        return transcript.start(build_prompt(recent, summary, context)), key
 
-        # 3) Cắt sạch nếu model lỡ in marker hoặc tự chat tiếp
-        for cut in ["\n### ", "### Assistant:", "### User:", "### System:"]:
-            idx = answer.find(cut)
-            if idx != -1:
-                answer = answer[:idx].strip()
+    def _retrieve(self, user_text: str) -> Tuple[str, List[str], float]:
+        # -> (đoạn context cho prompt, id các mẫu đã dùng cho cache key, score cao nhất)
+        hits = self.retriever.search(user_text, RAG_TOP_K)
+        best = hits[0][0] if hits else 0.0
+        entries: List[str] = []
+        ids: List[str] = []
+        used = 0
+        for score, doc in hits:
+            if score < RAG_MIN_SCORE:
                 break
+            q, a = self.retriever.qa_pairs[doc]
+            if coverage(user_text, q) < RAG_MIN_COVERAGE:
+                continue
+            entry = f"[{len(entries) + 1}] Hỏi: {q}\nĐáp: {a}\n"
+            n = self._counter.count(entry)
+            if used + n > RAG_MAX_TOKENS:
+                break
+            entries.append(entry)
+            ids.append(q)
+            used += n
+        if not entries:
+            return "", [], best
+        return RAG_HEADER + "\n".join(entries), ids, best
 
-        # 4) Ép nhẹ xưng hô
-        answer = (
-            answer.replace("Mình ", "Tôi ")
-                  .replace("mình ", "tôi ")
-                  .replace("Tớ ", "Tôi ")
-                  .replace("tớ ", "tôi ")
-        )
+    def _generate(
+        self,
+        prompt: List[int],
+        history: List[Dict[str, str]],
+        cancel: Optional[threading.Event],
+        turn,
+        transcript: PromptTranscript,
+        key: Tuple,
+    ) -> Generator[str, None, str]:
+        reused = transcript.measure(prompt)
+        if turn.enabled:
+            turn.set(
+                prompt_tokens=len(prompt),
+                prefix_reused_tokens=reused,
+                prefix_new_tokens=len(prompt) - reused,
+                transcript=transcript.last_mode,
+            )
+            llama_perf_reset(self.llm)
 
-        self.history.append({"role": "assistant", "content": answer})
+        t_start = time.perf_counter() if turn.enabled else 0.0
+        params = dict(SAMPLING_PARAMS)
+        if cancel is not None:
+            # llama-cpp gọi hook này sau mỗi token được sample
+            params["stopping_criteria"] = lambda input_ids, logits: cancel.is_set()
+        stream = self.llm(prompt, stop=STOP_TOKENS, stream=True, **params)
+
+        # 5) + 6) Cắt marker / ép xưng hô trên luồng token
+        cutter = StreamCutter(CUT_MARKERS, PERSONA_REPLACEMENTS)
+        parts: List[str] = []
+        raw: List[str] = []     # text model sinh ra, trước khi ép xưng hô (cho transcript)
+        n_chunks = 0
+        try:
+            for chunk in stream:
+                if n_chunks == 0 and turn.enabled:
+                    turn.mark_first_token()
+                    turn.add_stage("prefill", time.perf_counter() - t_start)
+                n_chunks += 1
+                raw.append(chunk["choices"][0]["text"] or "")
+                text, done = cutter.feed(raw[-1])
+                if text:
+                    parts.append(text)
+                    yield text
+                if done or (cancel is not None and cancel.is_set()):
+                    break
+            tail = cutter.finish()
+            if tail:
+                parts.append(tail)
+                yield tail
+            if not parts:
+                parts.append(EMPTY_ANSWER)
+                yield EMPTY_ANSWER
+        finally:
+            stream.close()
+            answer = "".join(parts).strip()
+            history.append({"role": "assistant", "content": answer})
+            transcript.commit(prompt, cut_raw("".join(raw)), key + (len(history),))
+            if turn.enabled:
+                turn.add_stage("generate", time.perf_counter() - t_start)
+                turn.set(completion_tokens=n_chunks, **llama_perf(self.llm), **memory_stats(self.llm))
         return answer
 
+    def _summarize(self, prev_summary: str, messages: List[Dict[str, str]]) -> str:
+        # Chạy ở thread nền; giữ nguyên KV cache của hội thoại chính
+        with self._llm_lock:
+            state = self.llm.save_state()
+            try:
+                out = self.llm(
+                    build_summary_prompt(prev_summary, messages),
+                    max_tokens=SUMMARY_MAX_TOKENS,
+                    temperature=0.2,
+                    top_p=0.9,
+                    stop=STOP_TOKENS,
+                )
+            finally:
+                self.llm.load_state(state)
+        return (out["choices"][0]["text"] or "").strip()
+
+    def close(self):
+        # Giải phóng model/context (gọi khi pool evict engine)
+        with self._llm_lock:
+            close = getattr(self.llm, "close", None)
+            if callable(close):
+                close()
+
     def reset(self):
         self.history = []
+        self.window.reset()
+        self.transcript().reset()
+        restore_prefix(self.llm, self._prefix_state)
 
     def export_text(self) -> str:
         lines = []
@@ -153,3 +559,4 @@ class RaspDbotEngine:
                 for m in hist
                 if isinstance(m, dict)
             ]
+            self.window.reset()
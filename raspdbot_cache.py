@@ -0,0 +1,57 @@
+import hashlib
+import os
+from pathlib import Path
+
+# =========================
+# Thư mục cache dùng chung (index, snapshot, ...)
+# =========================
+CACHE_DIR = Path(
+    os.environ.get("RASPDBOT_CACHE_DIR")
+    or Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "raspdbot"
+)
+
+# Log / dữ liệu vận hành (metrics, ...)
+STATE_DIR = Path(
+    os.environ.get("RASPDBOT_STATE_DIR")
+    or Path(os.environ.get("XDG_STATE_HOME") or Path.home() / ".local" / "state") / "raspdbot"
+)
+
+
+def cache_path(*parts: str) -> Path:
+    path = CACHE_DIR.joinpath(*parts)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_signature(path: str) -> dict:
+    # Kiểm tra nhanh (không đọc nội dung): size + mtime
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def short_hash(*parts: str) -> str:
+    return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    # Ghi file tạm rồi rename: tiến trình khác đang mmap file cũ vẫn an toàn
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# =========================
+# Đếm token (cache theo nội dung message)
+# =========================
+class TokenCounter:
+    def __init__(self, llm, max_entries: int = 4096):
+        self.llm = llm
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            n = self._cache.get(text)
+            if n is not None:
+                self._cache.move_to_end(text)
+                return n
+        n = len(self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+        with self._lock:
+            self._cache[text] = n
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return n
+
+
+# =========================
+# Cửa sổ hội thoại theo ngân sách token
+# =========================
+# summarizer(tóm tắt trước đó, các message cũ cần gộp) -> tóm tắt mới
+Summarizer = Callable[[str, List[Dict[str, str]]], str]
+
+
+def render_message(m: Dict[str, str]) -> str:
+    # Phải khớp cách build_prompt() ghép từng message
+    role = "User" if m["role"] == "user" else "Assistant"
+    return f"### {role}:\n" + m["content"].strip() + "\n"
+
+
+def extractive_summary(prev: str, messages: List[Dict[str, str]]) -> str:
+    # Tóm tắt tạm (không cần LLM): giữ tóm tắt cũ + liệt kê các câu hỏi đã bỏ ra
+    items = [prev] if prev else []
+    for m in messages:
+        if m["role"] == "user" and m["content"].strip():
+            items.append("- Bạn đã hỏi: " + m["content"].strip().splitlines()[0][:120])
+    return "\n".join(items)
+
+
+class ConversationWindow:
+    """
+    Chọn các lượt mới nhất vừa `budget` token; các lượt cũ hơn được gộp
+    vào một bản tóm tắt nằm ngay sau system prompt (tối đa summary_max_tokens).
+
+    Khi tràn, cửa sổ cắt xuống còn `low_water * budget` rồi giữ nguyên điểm
+    cắt tới lần tràn sau -> prefix prompt ít đổi, KV cache dùng lại được.
+    Tóm tắt bằng LLM chạy ở thread nền (summarize_async) sau khi trả lời
+    xong; trong lúc chờ dùng extractive_summary().
+    """
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        budget: int,
+        summarizer: Optional[Summarizer] = None,
+        low_water: float = 0.6,
+        summary_max_tokens: int = 160,
+    ):
+        self.counter = counter
+        self.budget = max(64, budget)
+        self.summarizer = summarizer
+        self.low_water = low_water
+        self.summary_max_tokens = summary_max_tokens
+
+        self.start = 0                # history[start:] nằm trong prompt
+        self.summary = ""             # tóm tắt của history[:start]
+        self.llm_summary = ""         # tóm tắt LLM của history[:llm_summary_upto]
+        self.llm_summary_upto = 0
+        self._summary_key = (0, 0)
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def reset(self):
+        with self._lock:
+            self._reset_locked()
+
+    def _reset_locked(self):
+        self.start = 0
+        self.summary = ""
+        self.llm_summary = ""
+        self.llm_summary_upto = 0
+        self._summary_key = (0, 0)
+        self._epoch += 1
+
+    def tokens(self, history: List[Dict[str, str]], start: int = 0) -> int:
+        return sum(self.counter.count(render_message(m)) for m in history[start:])
+
+    def _fit_summary(self, text: str) -> str:
+        # Giữ phần mới nhất của tóm tắt trong giới hạn token
+        while text and self.counter.count(text) > self.summary_max_tokens:
+            cut = text.find("\n", len(text) // 4)
+            text = text[cut + 1:] if cut != -1 else text[len(text) // 4:]
+        return text
+
+    def select(self, history: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
+        with self._lock:
+            if self.start > len(history) or self.llm_summary_upto > len(history):
+                # history bị thay (load/reset) -> tính lại từ đầu
+                self._reset_locked()
+
+            if self.tokens(history, self.start) > self.budget:
+                target = int(self.budget * self.low_water)
+                used = 0
+                start = len(history) - 1
+                for i in range(len(history) - 1, self.start - 1, -1):
+                    used += self.counter.count(render_message(history[i]))
+                    if used > target:
+                        break
+                    start = i
+                # cửa sổ bắt đầu bằng lượt của user
+                while start < len(history) - 1 and history[start]["role"] != "user":
+                    start += 1
+                self.start = max(self.start, start)
+
+            key = (self.llm_summary_upto, self.start)
+            if key != self._summary_key:
+                fresh = history[self.llm_summary_upto:self.start]
+                self.summary = self._fit_summary(extractive_summary(self.llm_summary, fresh))
+                self._summary_key = key
+            return self.summary, history[self.start:]
+
+    def summarize_async(self, history: List[Dict[str, str]]):
+        # Gọi sau khi đã trả lời xong lượt hiện tại (ngoài critical path)
+        with self._lock:
+            if self.summarizer is None or self.llm_summary_upto >= self.start:
+                return
+            if self._worker is not None and self._worker.is_alive():
+                return
+            epoch, prev, upto = self._epoch, self.llm_summary, self.start
+            chunk = [dict(m) for m in history[self.llm_summary_upto:upto]]
+
+        def run():
+            try:
+                text = self._fit_summary(self.summarizer(prev, chunk).strip())
+            except Exception:
+                return
+            with self._lock:
+                if text and epoch == self._epoch:
+                    self.llm_summary = text
+                    self.llm_summary_upto = upto
+
+        self._worker = threading.Thread(target=run, daemon=True)
+        self._worker.start()
@@ -0,0 +1,600 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from raspdbot_cache import atomic_write_bytes, cache_path, file_signature, sha256_file, short_hash
+from raspdbot_dedup import ANSWER_THRESHOLD, DEDUP_ENABLED, QUESTION_THRESHOLD, find_clusters
+from raspdbot_retrieval import BM25Index, BM25Scorer, length_norm, normalize, tokenize_query
+
+# =========================
+# Đọc JSONL
+# =========================
+def iter_jsonl(path: str) -> Iterator[Tuple[int, Dict]]:
+    # Trả về (byte offset của dòng, record) để build bảng offset
+    with open(path, "rb") as f:
+        yield from parse_jsonl_lines(f)
+
+
+def parse_jsonl_lines(lines: Iterable[bytes], offset: int = 0, line_no: int = 1) -> Iterator[Tuple[int, Dict]]:
+    # offset / line_no: vị trí của dòng đầu tiên trong file (đọc tiếp phần ghi thêm)
+    for i, raw in enumerate(lines, start=line_no):
+        line_offset = offset
+        offset += len(raw)
+        line = raw.strip()
+        if not line:
+            continue
+        try:
+            yield line_offset, json.loads(line.decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print(f"[WARN] Dòng {i} không phải JSON hợp lệ, bỏ qua.")
+
+
+def load_jsonl(path: str) -> List[Dict]:
+    """
+    Hỗ trợ JSONL format phổ biến:
+    1) {"prompt": "...", "completion": "..."}
+    2) {"question": "...", "answer": "..."}
+    3) {"messages":[{"role":"user","content":"..."},{"role":"assistant","content":"..."}]}
+    4) Fallback: {"instruction": "...", "response": "..."} hoặc {"input": "...", "output": "..."}
+    """
+    return [item for _, item in iter_jsonl(path)]
+
+
+def extract_qa(item: Dict) -> Tuple[str, str]:
+    if "prompt" in item and "completion" in item:
+        return str(item["prompt"]).strip(), str(item["completion"]).strip()
+
+    if "question" in item and "answer" in item:
+        return str(item["question"]).strip(), str(item["answer"]).strip()
+
+    if "instruction" in item and "response" in item:
+        return str(item["instruction"]).strip(), str(item["response"]).strip()
+
+    if "input" in item and "output" in item:
+        return str(item["input"]).strip(), str(item["output"]).strip()
+
+    if "messages" in item and isinstance(item["messages"], list):
+        user_parts, assistant_parts = [], []
+        for m in item["messages"]:
+            if not isinstance(m, dict):
+                continue
+            role = m.get("role", "")
+            content = str(m.get("content", "")).strip()
+            if role == "user":
+                user_parts.append(content)
+            elif role == "assistant":
+                assistant_parts.append(content)
+        return "\n".join(user_parts).strip(), "\n".join(assistant_parts).strip()
+
+    return "", ""
+
+
+# Facet một giá trị / nhiều giá trị trong "metadata" của record
+FACETS = ("domain", "difficulty", "language", "safety")
+MULTI_FACETS = ("tags",)
+
+
+def extract_metadata(item: Dict) -> Dict:
+    meta = item.get("metadata")
+    if not isinstance(meta, dict):
+        meta = {}
+    out = {f: str(meta.get(f) or "").strip().lower() for f in FACETS}
+    for f in MULTI_FACETS:
+        values = meta.get(f) or []
+        if not isinstance(values, list):
+            values = [values]
+        out[f] = sorted({str(v).strip().lower() for v in values if str(v).strip()})
+    return out
+
+
+# =========================
+# Compiled corpus (file nhị phân, mmap khi khởi động)
+# =========================
+# Layout:
+#   MAGIC | version (u32) | header_len (u32) | header JSON | sections...
+# Mỗi section căn lề 8 byte, vị trí ghi trong header["sections"]:
+#   name -> [offset, nbytes, typecode]
+# Sections:
+#   src_off           Q[N]    byte offset của record trong file JSONL nguồn
+#   q_*, a_*, nq_*    bảng chuỗi (câu hỏi / trả lời / câu hỏi đã normalize):
+#                     *_off Q[N+1] + *_blob (utf-8)
+#   doc_len / norm    I[N] / d[N]  độ dài tài liệu + hệ số BM25 tính sẵn
+#   term_off/_blob    vocab đã sort theo byte utf-8 (tra bằng binary search)
+#   post_off          Q[V+1]  postings của term i = post_doc/post_tf[off[i]:off[i+1]]
+#   facet_<f>         I[N]    id giá trị facet (domain/difficulty/...), 0 = không có;
+#                             bảng giá trị nằm trong header["facets"][f]
+#   tag_off / tag_doc Q[T+1] / I[..]  doc id (đã sort) của từng tag
+#   term_domain       I[V]    domain chiếm đa số trong postings của term (0 = không có)
+#   term_purity       f[V]    tỉ lệ tài liệu của term thuộc domain đó
+#   dup_rep           I[N]    doc id đại diện cụm Q/A gần trùng (raspdbot_dedup);
+#                             chỉ đại diện có postings, avgdl và N của idf tính trên header["n_indexed"]
+# Tài liệu được xếp theo domain: mỗi domain là một dải doc id liên tục
+# (header["partitions"]["domain"]), postings đã sort theo doc id nên chấm điểm
+# trong một domain chỉ cần bisect đúng đoạn postings của dải đó.
+MAGIC = b"RDBIDX\0\0"
+FORMAT_VERSION = 3
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def compiled_path_for(jsonl_path: str) -> Path:
+    src = os.path.abspath(jsonl_path)
+    stem = Path(src).stem
+    return cache_path("corpus", f"{stem}-{short_hash(src)}.rdbidx")
+
+
+def read_qa_records(jsonl_path: str) -> Tuple[List[int], List[Tuple[str, str]], List[Dict]]:
+    return qa_records(iter_jsonl(jsonl_path))
+
+
+def qa_records(records: Iterable[Tuple[int, Dict]]) -> Tuple[List[int], List[Tuple[str, str]], List[Dict]]:
+    offsets, pairs, metas = [], [], []
+    for off, item in records:
+        q, a = extract_qa(item)
+        if q and a:
+            offsets.append(off)
+            pairs.append((q, a))
+            metas.append(extract_metadata(item))
+    return offsets, pairs, metas
+
+
+def _string_table(strings: Sequence[str]) -> Tuple[array, bytes]:
+    offs = array("Q", [0])
+    blob = bytearray()
+    for s in strings:
+        blob += s.encode("utf-8")
+        offs.append(len(blob))
+    return offs, bytes(blob)
+
+
+def dedup_settings(enabled: bool = DEDUP_ENABLED) -> Dict:
+    return {"answer": ANSWER_THRESHOLD, "question": QUESTION_THRESHOLD} if enabled else {}
+
+
+def compile_corpus(jsonl_path: str, out_path: Optional[Path] = None, dedup: bool = DEDUP_ENABLED) -> Path:
+    out_path = Path(out_path or compiled_path_for(jsonl_path))
+    sig = file_signature(jsonl_path)
+    digest = sha256_file(jsonl_path)
+    offsets, pairs, metas = read_qa_records(jsonl_path)
+
+    # Xếp tài liệu theo domain (ổn định: giữ thứ tự file trong cùng domain)
+    facets = {f: [""] + sorted({m[f] for m in metas} - {""}) for f in FACETS}
+    facet_ids = {f: {v: i for i, v in enumerate(values)} for f, values in facets.items()}
+    order = sorted(range(len(pairs)), key=lambda i: facet_ids["domain"][metas[i]["domain"]])
+    offsets = [offsets[i] for i in order]
+    pairs = [pairs[i] for i in order]
+    metas = [metas[i] for i in order]
+
+    domain_of = [facet_ids["domain"][m["domain"]] for m in metas]
+    partitions: Dict[str, List[int]] = {}
+    for doc, dom in enumerate(domain_of):
+        if dom:
+            rng = partitions.setdefault(facets["domain"][dom], [doc, doc + 1])
+            rng[1] = doc + 1
+
+    # Cụm Q/A gần trùng: thành viên không vào index (không chiếm chỗ trong top-k)
+    settings = dedup_settings(dedup)
+    rep_of = find_clusters(pairs, settings["answer"], settings["question"]) if settings else list(range(len(pairs)))
+    n_indexed = sum(1 for i, r in enumerate(rep_of) if r == i)
+
+    index = BM25Index(q if rep_of[i] == i else "" for i, (q, _) in enumerate(pairs))
+    terms = sorted(index.postings, key=lambda t: t.encode("utf-8"))
+    post_off = array("Q", [0])
+    post_doc = array("I")
+    post_tf = array("I")
+    term_domain = array("I")
+    term_purity = array("f")
+    for t in terms:
+        docs, tfs = index.postings[t]
+        post_doc.extend(docs)
+        post_tf.extend(tfs)
+        post_off.append(len(post_doc))
+        counts: Dict[int, int] = {}
+        for d in docs:
+            counts[domain_of[d]] = counts.get(domain_of[d], 0) + 1
+        dom, n = max(counts.items(), key=lambda x: x[1])
+        term_domain.append(dom)
+        term_purity.append(n / len(docs) if dom else 0.0)
+
+    tags = sorted({t for m in metas for t in m["tags"]})
+    tag_off = array("Q", [0])
+    tag_doc = array("I")
+    for tag in tags:
+        tag_doc.extend(d for d, m in enumerate(metas) if tag in m["tags"])
+        tag_off.append(len(tag_doc))
+
+    sections: Dict[str, Tuple[str, bytes]] = {}
+    sections["src_off"] = ("Q", array("Q", offsets).tobytes())
+    for name, strings in (
+        ("q", [q for q, _ in pairs]),
+        ("a", [a for _, a in pairs]),
+        ("nq", [normalize(q) for q, _ in pairs]),
+        ("term", terms),
+    ):
+        offs, blob = _string_table(strings)
+        sections[f"{name}_off"] = ("Q", offs.tobytes())
+        sections[f"{name}_blob"] = ("B", blob)
+    sections["doc_len"] = ("I", array("I", index.doc_len).tobytes())
+    sections["norm"] = ("d", array("d", length_norm(index.doc_len, index.total_len, index.k1, index.b, n_indexed)).tobytes())
+    sections["post_off"] = ("Q", post_off.tobytes())
+    sections["post_doc"] = ("I", post_doc.tobytes())
+    sections["post_tf"] = ("I", post_tf.tobytes())
+    for f in FACETS:
+        sections[f"facet_{f}"] = ("I", array("I", [facet_ids[f][m[f]] for m in metas]).tobytes())
+    sections["tag_off"] = ("Q", tag_off.tobytes())
+    sections["tag_doc"] = ("I", tag_doc.tobytes())
+    sections["term_domain"] = ("I", term_domain.tobytes())
+    sections["term_purity"] = ("f", term_purity.tobytes())
+    sections["dup_rep"] = ("I", array("I", rep_of).tobytes())
+
+    header = {
+        "source": os.path.abspath(jsonl_path),
+        "source_size": sig["size"],
+        "source_mtime_ns": sig["mtime_ns"],
+        "source_sha256": digest,
+        "byteorder": sys.byteorder,
+        "n_docs": len(pairs),
+        "n_terms": len(terms),
+        "n_indexed": n_indexed,
+        "total_len": index.total_len,
+        "k1": index.k1,
+        "b": index.b,
+        "facets": facets,
+        "tags": tags,
+        "partitions": {"domain": partitions},
+        "dedup": dict(settings, clusters=len({r for i, r in enumerate(rep_of) if r != i}), duplicates=len(pairs) - n_indexed),
+        "compiled_at": time.time(),
+        "sections": {},
+    }
+
+    # Tính offset các section: cần biết độ dài header trước -> lặp tới khi ổn định
+    header_len = 0
+    while True:
+        pos = _align(_PREAMBLE.size + header_len)
+        for name, (tc, data) in sections.items():
+            header["sections"][name] = [pos, len(data), tc]
+            pos = _align(pos + len(data))
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        if len(header_bytes) == header_len:
+            break
+        header_len = len(header_bytes)
+
+    out = bytearray(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, header_len))
+    out += header_bytes
+    for name, (_, data) in sections.items():
+        out += b"\0" * (header["sections"][name][0] - len(out))
+        out += data
+    atomic_write_bytes(out_path, bytes(out))
+    return out_path
+
+
+def _align(n: int, to: int = 8) -> int:
+    return (n + to - 1) // to * to
+
+
+class StringTable(Sequence):
+    def __init__(self, mm: mmap.mmap, offs: memoryview, base: int):
+        self._mm = mm
+        self._offs = offs
+        self._base = base
+
+    def __len__(self) -> int:
+        return len(self._offs) - 1
+
+    def raw(self, i: int) -> bytes:
+        return self._mm[self._base + self._offs[i]:self._base + self._offs[i + 1]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.raw(i).decode("utf-8")
+
+
+class QAPairs(Sequence):
+    # qa_pairs[i] -> (question, answer), giải mã khi truy cập
+    def __init__(self, questions: Sequence[str], answers: Sequence[str]):
+        self.questions = questions
+        self.answers = answers
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.questions[i], self.answers[i]
+
+
+FIND_CACHE_SIZE = 8192
+
+
+class CompiledBM25Index(BM25Scorer):
+    def __init__(self, corpus: "CompiledCorpus"):
+        h = corpus.header
+        self.k1 = h["k1"]
+        self.b = h["b"]
+        self._terms = corpus._table("term")
+        self._post_off = corpus._section("post_off")
+        self._post_doc = corpus._section("post_doc")
+        self._post_tf = corpus._section("post_tf")
+        self._norm = corpus._section("norm")
+        self._term_domain = corpus._section("term_domain")
+        self._term_purity = corpus._section("term_purity")
+        self._n_docs = h["n_docs"]
+        self._n_indexed = h.get("n_indexed", self._n_docs)
+        # Đoán domain rồi chấm BM25 tra cùng các term -> nhớ kết quả tra vocab
+        self._find = lru_cache(maxsize=FIND_CACHE_SIZE)(self._find_term)
+
+    @property
+    def n_docs(self) -> int:
+        return self._n_docs
+
+    @property
+    def n_indexed(self) -> int:
+        return self._n_indexed
+
+    def _find_term(self, term: str) -> int:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self._terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._terms.raw(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._terms) and self._terms.raw(lo) == key:
+            return lo
+        return -1
+
+    def _lookup(self, term: str) -> Optional[Tuple[memoryview, memoryview]]:
+        i = self._find(term)
+        if i < 0:
+            return None
+        a, b = self._post_off[i], self._post_off[i + 1]
+        return self._post_doc[a:b], self._post_tf[a:b]
+
+    def _length_norm(self) -> memoryview:
+        return self._norm
+
+    def term_domains(self, query: str) -> List[Tuple[int, float, float]]:
+        # (domain id, purity, idf) của từng term trong câu hỏi có trong vocab
+        out = []
+        for term in set(tokenize_query(query)):
+            i = self._find(term)
+            if i < 0:
+                continue
+            df = self._post_off[i + 1] - self._post_off[i]
+            out.append((self._term_domain[i], self._term_purity[i], self.idf(df)))
+        return out
+
+
+class CompiledCorpus:
+    """
+    Corpus đã compile, mmap read-only: khởi động gần như không tốn thời gian
+    và nhiều tiến trình bot trên cùng máy dùng chung page cache.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Không phải compiled corpus: {self.path}")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Compiled corpus version {version} != {FORMAT_VERSION}")
+        start = _PREAMBLE.size
+        self.header = json.loads(self._mm[start:start + header_len].decode("utf-8"))
+        if self.header.get("byteorder") != sys.byteorder:
+            raise ValueError("Compiled corpus khác byteorder")
+
+        self.questions = self._table("q")
+        self.answers = self._table("a")
+        self.normalized_questions = self._table("nq")
+        self.source_offsets = self._section("src_off")
+        self.qa_pairs = QAPairs(self.questions, self.answers)
+        self.index = CompiledBM25Index(self)
+        self.facets: Dict[str, List[str]] = self.header.get("facets", {})
+        self.tags: List[str] = self.header.get("tags", [])
+        self.domain_ranges: Dict[str, range] = {
+            d: range(lo, hi) for d, (lo, hi) in self.header.get("partitions", {}).get("domain", {}).items()
+        }
+        self._dup_rep = self._section("dup_rep")
+        self._clusters: Optional[Dict[int, List[int]]] = None
+
+    def __len__(self) -> int:
+        return self.header["n_docs"]
+
+    def _section(self, name: str) -> memoryview:
+        off, nbytes, tc = self.header["sections"][name]
+        return self._view[off:off + nbytes].cast(tc)
+
+    def _table(self, name: str) -> StringTable:
+        base = self.header["sections"][f"{name}_blob"][0]
+        return StringTable(self._mm, self._section(f"{name}_off"), base)
+
+    @property
+    def source_sha256(self) -> str:
+        return self.header["source_sha256"]
+
+    @property
+    def doc_key(self) -> str:
+        # Định danh nội dung + thứ tự doc id (index phụ như embedding dùng làm key)
+        return short_hash(self.source_sha256, f"v{FORMAT_VERSION}")
+
+    def facet(self, name: str, doc: int) -> str:
+        return self.facets[name][self._section(f"facet_{name}")[doc]]
+
+    def docs_with_tag(self, tag: str) -> memoryview:
+        try:
+            i = self.tags.index(tag)
+        except ValueError:
+            return memoryview(b"").cast("I")
+        off = self._section("tag_off")
+        return self._section("tag_doc")[off[i]:off[i + 1]]
+
+    def representative(self, doc: int) -> int:
+        return self._dup_rep[doc]
+
+    def indexed_docs(self) -> List[int]:
+        # Doc id của các đại diện cụm (tài liệu được index), tăng dần
+        return [i for i, r in enumerate(self._dup_rep) if r == i]
+
+    def cluster(self, doc: int) -> List[int]:
+        # [đại diện, thành viên...] của cụm chứa doc ([doc] nếu không trùng record nào)
+        if self._clusters is None:
+            clusters: Dict[int, List[int]] = {}
+            for i, r in enumerate(self._dup_rep):
+                if r != i:
+                    clusters.setdefault(r, [r]).append(i)
+            self._clusters = clusters
+        return self._clusters.get(self._dup_rep[doc], [doc])
+
+    def metadata(self, doc: int) -> Dict:
+        meta: Dict = {f: self.facet(f, doc) for f in self.facets}
+        meta["tags"] = [t for t in self.tags if _contains(self.docs_with_tag(t), doc)]
+        return meta
+
+    def is_fresh(self, jsonl_path: str) -> bool:
+        sig = file_signature(jsonl_path)
+        h = self.header
+        return (
+            h.get("source") == os.path.abspath(jsonl_path)
+            and h.get("source_size") == sig["size"]
+            and h.get("source_mtime_ns") == sig["mtime_ns"]
+            and {k: v for k, v in h.get("dedup", {}).items() if k in ("answer", "question")} == dedup_settings()
+        )
+
+
+def _contains(sorted_docs: Sequence[int], doc: int) -> bool:
+    i = bisect_left(sorted_docs, doc)
+    return i < len(sorted_docs) and sorted_docs[i] == doc
+
+
+# =========================
+# Retrieval theo domain (facet) + fallback toàn corpus
+# =========================
+DOMAIN_MIN_PURITY = 0.8     # term "thuộc" một domain khi >= 80% tài liệu chứa nó ở domain đó
+DOMAIN_MIN_SHARE = 0.4      # domain phải chiếm >= 40% tổng idf của các term khớp
+DOMAIN_FALLBACK_SCORE = 0.60
+
+
+class FacetedRetriever:
+    """
+    BM25 chỉ chấm trong domain của câu hỏi (đoán từ các term đặc trưng, hoặc
+    domain của session truyền vào). Không đoán được / điểm tốt nhất trong domain
+    thấp hơn fallback_score -> chấm lại trên toàn corpus.
+    """
+
+    def __init__(
+        self,
+        corpus: "CompiledCorpus",
+        min_purity: float = DOMAIN_MIN_PURITY,
+        min_share: float = DOMAIN_MIN_SHARE,
+        fallback_score: float = DOMAIN_FALLBACK_SCORE,
+        index: Optional[BM25Scorer] = None,
+        domain_docs: Optional[Dict[str, List[range]]] = None,
+    ):
+        # index / domain_docs: corpus ghép thêm Q/A mới (raspdbot_reload), mặc định là corpus gốc
+        self.corpus = corpus
+        self.index = index or corpus.index
+        self.domain_docs = domain_docs or {d: [r] for d, r in corpus.domain_ranges.items()}
+        self.min_purity = min_purity
+        self.min_share = min_share
+        self.fallback_score = fallback_score
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def detect_domain(self, query: str) -> str:
+        votes: Dict[int, float] = {}
+        total = 0.0
+        for dom, purity, idf in self.index.term_domains(query):
+            total += idf
+            if dom and purity >= self.min_purity:
+                votes[dom] = votes.get(dom, 0.0) + idf
+        if not votes or total <= 0.0:
+            return ""
+        dom, v = max(votes.items(), key=lambda x: x[1])
+        if v / total < self.min_share:
+            return ""
+        return self.corpus.facets["domain"][dom]
+
+    def search_domain(self, query: str, k: int = 5, domain: str = "") -> Tuple[List[Tuple[float, int]], str]:
+        # -> (kết quả, domain thực sự dùng; "" = toàn corpus)
+        docs = self.domain_docs.get(domain) if domain else None
+        if docs is not None:
+            hits = self.index.search(query, k, docs=docs)
+            if hits and hits[0][0] >= self.fallback_score:
+                return hits, domain
+        return self.index.search(query, k), ""
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, int]]:
+        return self.search_domain(query, k, self.detect_domain(query))[0]
+
+
+def load_corpus(jsonl_path: str, compiled_path: Optional[Path] = None) -> CompiledCorpus:
+    # Dùng file compile sẵn nếu còn mới; nguồn đổi (mtime/size) -> compile lại
+    path = Path(compiled_path or compiled_path_for(jsonl_path))
+    if path.exists():
+        try:
+            corpus = CompiledCorpus(path)
+            if corpus.is_fresh(jsonl_path):
+                return corpus
+        except (OSError, ValueError, KeyError, struct.error):
+            pass
+    compile_corpus(jsonl_path, path)
+    return CompiledCorpus(path)
+
+
+# =========================
+# CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Compile JSONL Q/A thành index nhị phân (mmap).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_compile = sub.add_parser("compile", help="compile (hoặc build lại) file JSONL")
+    p_compile.add_argument("jsonl", nargs="+")
+    p_info = sub.add_parser("info", help="xem thông tin file đã compile")
+    p_info.add_argument("jsonl", nargs="+")
+    args = ap.parse_args()
+
+    for src in args.jsonl:
+        if args.cmd == "compile":
+            t0 = time.perf_counter()
+            out = compile_corpus(src)
+            print(f"{src} -> {out} ({time.perf_counter() - t0:.3f}s)")
+        else:
+            t0 = time.perf_counter()
+            corpus = load_corpus(src)
+            h = corpus.header
+            print(
+                f"{src}: {corpus.path} | docs={h['n_docs']} terms={h['n_terms']} "
+                f"sha256={h['source_sha256'][:12]} load={1000 * (time.perf_counter() - t0):.2f}ms"
+            )
+            for dom, r in corpus.domain_ranges.items():
+                print(f"  domain {dom}: docs {r.start}..{r.stop - 1} ({len(r)})")
+            if corpus.tags:
+                print(f"  tags: {len(corpus.tags)}")
+            dedup = h.get("dedup", {})
+            if dedup.get("duplicates"):
+                print(
+                    f"  gần trùng: {dedup['clusters']} cụm, {dedup['duplicates']} record không index "
+                    f"(index {h['n_indexed']}/{h['n_docs']})"
+                )
+
+
+if __name__ == "__main__":
+    main()
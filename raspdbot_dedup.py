@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import random
+import time
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+try:
+    import numpy as np     # có numpy (đi kèm llama-cpp-python) thì băm vector hoá, nhanh ~20 lần
+except ImportError:
+    np = None
+
+from raspdbot_retrieval import fold_diacritics, normalize, syllables
+
+# =========================
+# Phát hiện Q/A gần trùng (MinHash + LSH)
+# =========================
+# Shingle = âm tiết đã bỏ dấu + cặp âm tiết liền nhau, của câu hỏi ("q:") và
+# câu trả lời ("a:"). Chữ ký MinHash NUM_PERM hàm băm, LSH chia BANDS dải x
+# ROWS hàng: hai record thành ứng viên khi trùng trọn một dải (Jaccard ~0.5
+# trở lên gần như chắc chắn gặp nhau). Ứng viên được kiểm lại bằng Jaccard
+# thật: câu trả lời >= ANSWER_THRESHOLD và câu hỏi >= QUESTION_THRESHOLD
+# (câu hỏi giống nhau nhưng trả lời khác, vd "biển báo" / "đèn giao thông",
+# KHÔNG bị gộp). Record trùng y hệt (sau normalize) gộp trước, không cần băm.
+# Đại diện của cụm = doc id nhỏ nhất; compile_corpus chỉ đưa đại diện vào
+# index BM25, các thành viên vẫn nằm trong corpus (tra bằng cluster()).
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+ANSWER_THRESHOLD = float(os.environ.get("RASPDBOT_DEDUP_ANSWER", "0.8"))
+QUESTION_THRESHOLD = float(os.environ.get("RASPDBOT_DEDUP_QUESTION", "0.5"))
+DEDUP_ENABLED = os.environ.get("RASPDBOT_DEDUP", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# h(x) = (a*x + b) mod p, p = 2^31 - 1: tích < 2^62 nên numpy uint64 không tràn
+_PRIME = (1 << 31) - 1
+_rng = random.Random(0x5EED)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+if np is not None:
+    _A = np.array([a for a, _ in _PERMS], dtype=np.uint64)[:, None]
+    _B = np.array([b for _, b in _PERMS], dtype=np.uint64)[:, None]
+
+
+def shingles(text: str, prefix: str = "") -> Set[str]:
+    syl = [fold_diacritics(s) for s in syllables(text)]
+    out = {prefix + s for s in syl}
+    out.update(f"{prefix}{a}_{b}" for a, b in zip(syl, syl[1:]))
+    return out
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(items: Iterable[str]) -> Tuple[int, ...]:
+    xs = [zlib.crc32(s.encode("utf-8")) & _PRIME for s in items]
+    if not xs:
+        return (0,) * NUM_PERM
+    if np is not None:
+        h = (_A * np.array(xs, dtype=np.uint64)[None, :] + _B) % _PRIME
+        return tuple(h.min(axis=1).tolist())
+    return tuple(min([(a * x + b) % _PRIME for x in xs]) for a, b in _PERMS)
+
+
+def lsh_candidates(signatures: Sequence[Tuple[int, ...]]) -> Set[Tuple[int, int]]:
+    # Cặp (i, j), i < j, trùng ít nhất một dải
+    pairs: Set[Tuple[int, int]] = set()
+    for band in range(BANDS):
+        buckets: Dict[Tuple[int, ...], List[int]] = defaultdict(list)
+        lo = band * ROWS
+        for i, sig in enumerate(signatures):
+            buckets[sig[lo:lo + ROWS]].append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    return pairs
+
+
+def find_clusters(
+    pairs: Sequence[Tuple[str, str]],
+    answer_threshold: float = ANSWER_THRESHOLD,
+    question_threshold: float = QUESTION_THRESHOLD,
+) -> List[int]:
+    """
+    pairs[i] = (câu hỏi, câu trả lời) -> rep_of[i] = doc id đại diện cụm của i
+    (rep_of[i] == i: i là đại diện / không trùng record nào).
+    """
+    parent = list(range(len(pairs)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i: int, j: int):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)   # gốc luôn là doc id nhỏ nhất
+
+    # 1) Trùng y hệt sau normalize
+    first: Dict[Tuple[str, str], int] = {}
+    uniq: List[int] = []
+    for i, (q, a) in enumerate(pairs):
+        key = (normalize(q), normalize(a))
+        j = first.setdefault(key, i)
+        if j != i:
+            union(j, i)
+        else:
+            uniq.append(i)
+
+    # 2) Gần trùng: LSH trên các record còn lại, kiểm lại bằng Jaccard thật
+    q_sh = [shingles(pairs[i][0]) for i in uniq]
+    a_sh = [shingles(pairs[i][1]) for i in uniq]
+    sigs = [minhash({"q:" + s for s in qs} | {"a:" + s for s in as_}) for qs, as_ in zip(q_sh, a_sh)]
+    for x, y in lsh_candidates(sigs):
+        if jaccard(a_sh[x], a_sh[y]) >= answer_threshold and jaccard(q_sh[x], q_sh[y]) >= question_threshold:
+            union(uniq[x], uniq[y])
+
+    return [find(i) for i in range(len(pairs))]
+
+
+def group_clusters(rep_of: Sequence[int]) -> Dict[int, List[int]]:
+    # Chỉ các cụm có từ 2 record: đại diện -> [đại diện, thành viên...]
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i, r in enumerate(rep_of):
+        groups[r].append(i)
+    return {r: m for r, m in groups.items() if len(m) > 1}
+
+
+# =========================
+# CLI: báo cáo / ghi corpus đã khử trùng
+# =========================
+def _redundant_slots(pairs: Sequence[Tuple[str, str]], rep_of: Sequence[int], k: int = 5, sample: int = 200) -> Tuple[float, float]:
+    # Số slot top-k trùng cụm với slot trước đó (trung bình / câu hỏi), trước và sau khi khử trùng
+    from raspdbot_retrieval import BM25Index
+
+    full = BM25Index(q for q, _ in pairs)
+    reps = BM25Index(q if rep_of[i] == i else "" for i, (q, _) in enumerate(pairs))
+    step = max(1, len(pairs) // sample)
+    queries = [pairs[i][0] for i in range(0, len(pairs), step)]
+    out = []
+    for index in (full, reps):
+        total = 0
+        for q in queries:
+            seen = set()
+            for _, doc in index.search(q, k):
+                total += rep_of[doc] in seen
+                seen.add(rep_of[doc])
+        out.append(total / max(1, len(queries)))
+    return out[0], out[1]
+
+
+def main():
+    from raspdbot_corpus import extract_qa
+
+    ap = argparse.ArgumentParser(description="Tìm Q/A gần trùng (MinHash/LSH) trong JSONL, ghi bản đã khử trùng.")
+    ap.add_argument("jsonl")
+    ap.add_argument("--answer-threshold", type=float, default=ANSWER_THRESHOLD)
+    ap.add_argument("--question-threshold", type=float, default=QUESTION_THRESHOLD)
+    ap.add_argument("--show", type=int, default=5, help="in N cụm lớn nhất")
+    ap.add_argument(
+        "--write", default="",
+        help="ghi JSONL chỉ giữ đại diện; thành viên ghi vào metadata.near_duplicates của đại diện",
+    )
+    args = ap.parse_args()
+
+    with open(args.jsonl, "rb") as f:
+        lines = f.readlines()
+    records: List[Tuple[int, Dict]] = []     # (số dòng, record) của các dòng có Q/A
+    pairs: List[Tuple[str, str]] = []
+    for line_no, raw in enumerate(lines, start=1):
+        try:
+            item = json.loads(raw.decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+        q, a = extract_qa(item) if isinstance(item, dict) else ("", "")
+        if q and a:
+            records.append((line_no, item))
+            pairs.append((q, a))
+
+    t0 = time.perf_counter()
+    rep_of = find_clusters(pairs, args.answer_threshold, args.question_threshold)
+    dt = time.perf_counter() - t0
+    clusters = group_clusters(rep_of)
+    n_dup = sum(len(m) - 1 for m in clusters.values())
+    print(
+        f"{args.jsonl}: {len(pairs)} Q/A, {len(clusters)} cụm gần trùng, "
+        f"{n_dup} record thừa -> còn {len(pairs) - n_dup} ({1000 * dt:.1f} ms)"
+    )
+    before, after = _redundant_slots(pairs, rep_of)
+    print(f"  slot top-5 trùng cụm / câu hỏi: {before:.2f} -> {after:.2f}")
+    for rep, members in sorted(clusters.items(), key=lambda x: -len(x[1]))[: args.show]:
+        print(f"  [{len(members)}] dòng {', '.join(str(records[m][0]) for m in members)}")
+        for m in members[:3]:
+            print(f"      {pairs[m][0][:80]}")
+
+    if args.write:
+        with open(args.write, "wb") as out:
+            dropped = {records[i][0] for i, r in enumerate(rep_of) if r != i}
+            by_line = {records[r][0]: members for r, members in clusters.items()}
+            for line_no, raw in enumerate(lines, start=1):
+                if line_no in dropped:
+                    continue
+                if line_no in by_line:
+                    item = dict(records[by_line[line_no][0]][1])
+                    meta = dict(item.get("metadata") or {})
+                    meta["near_duplicates"] = [
+                        {"line": records[m][0], "question": pairs[m][0]} for m in by_line[line_no][1:]
+                    ]
+                    item["metadata"] = meta
+                    raw = json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n"
+                out.write(raw)
+        print(f"Đã ghi: {args.write}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import io
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from raspdbot_cache import atomic_write_bytes, cache_path, file_signature, short_hash
+from raspdbot_llm import create_llm
+from raspdbot_retrieval import Retriever
+
+# =========================
+# Dense retrieval (embedding câu hỏi trong dataset)
+# =========================
+# Ma trận embedding đã normalize lưu dưới dạng .npy (float16 hoặc int8 + scale
+# theo từng dòng) trong ~/.cache/raspdbot/embed, key theo sha256 của dataset
+# và file model embedding. Khi chạy chỉ np.load(mmap_mode="r").
+EMBED_DTYPES = ("float16", "int8")
+
+
+def create_embedder(model_path: str, n_ctx: int = 512, n_threads: Optional[int] = None):
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Không tìm thấy model embedding: {model_path}")
+    return create_llm(model_path, n_ctx=n_ctx, n_threads=n_threads, embedding=True)
+
+
+def embed_texts(embedder, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+    rows: List[List[float]] = []
+    for i in range(0, len(texts), batch_size):
+        rows.extend(embedder.embed(list(texts[i:i + batch_size]), normalize=False, truncate=True))
+    mat = np.asarray(rows, dtype=np.float32)
+    if mat.ndim == 1:
+        mat = mat.reshape(len(texts), -1)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def _quantize(mat: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    if dtype == "float16":
+        return mat.astype(np.float16), None
+    # int8 đối xứng, scale riêng từng dòng
+    scale = np.abs(mat).max(axis=1)
+    scale[scale == 0] = 1.0
+    q = np.round(mat / scale[:, None] * 127.0).astype(np.int8)
+    return q, (scale / 127.0).astype(np.float32)
+
+
+class EmbeddingIndex:
+    """
+    search(query, k) -> [(score, doc_id)]: một phép nhân ma trận-vector
+    rồi np.argpartition lấy top-k. Score = cosine (kẹp về [0, 1]).
+    doc_ids[row] = doc id của dòng `row` (chỉ embed một phần corpus, vd đại
+    diện cụm gần trùng); None -> dòng thứ i là doc i.
+    """
+
+    def __init__(
+        self,
+        embedder,
+        matrix: np.ndarray,
+        scale: Optional[np.ndarray] = None,
+        doc_ids: Optional[Sequence[int]] = None,
+    ):
+        self.embedder = embedder
+        self.matrix = matrix
+        self.scale = scale
+        self.doc_ids = None if doc_ids is None else np.asarray(doc_ids, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return int(self.matrix.shape[0])
+
+    @classmethod
+    def build_or_load(
+        cls,
+        embedder,
+        embed_model_path: str,
+        dataset_sha256: str,
+        questions: Sequence[str],
+        dtype: str = "float16",
+        doc_ids: Optional[Sequence[int]] = None,
+        settings: Optional[Dict] = None,
+    ) -> "EmbeddingIndex":
+        # settings: tham số quyết định tập tài liệu được embed (vd ngưỡng dedup) -> vào key cache
+        if dtype not in EMBED_DTYPES:
+            raise ValueError(f"dtype phải là một trong {EMBED_DTYPES}")
+        if doc_ids is not None and len(doc_ids) != len(questions):
+            raise ValueError("doc_ids và questions phải cùng độ dài")
+        sig = file_signature(embed_model_path)
+        key = short_hash(
+            os.path.abspath(embed_model_path),
+            str(sig["size"]),
+            str(sig["mtime_ns"]),
+            dtype,
+            json.dumps(settings or {}, sort_keys=True),
+        )
+        docs = short_hash(",".join(map(str, doc_ids))) if doc_ids is not None else ""
+        base = cache_path("embed", f"{dataset_sha256[:16]}-{key}")
+        mat_path = base.with_suffix(".npy")
+        scale_path = base.with_suffix(".scale.npy")
+        meta_path = base.with_suffix(".json")
+
+        if mat_path.exists() and meta_path.exists():
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+                matrix = np.load(mat_path, mmap_mode="r")
+                scale = np.load(scale_path, mmap_mode="r") if dtype == "int8" else None
+                if (
+                    meta.get("n_docs") == len(questions)
+                    and meta.get("docs", "") == docs
+                    and matrix.shape[0] == len(questions)
+                ):
+                    return cls(embedder, matrix, scale, doc_ids)
+            except (OSError, ValueError):
+                pass
+
+        matrix, scale = _quantize(embed_texts(embedder, questions), dtype)
+        _save_npy(mat_path, matrix)
+        if scale is not None:
+            _save_npy(scale_path, scale)
+        meta = {
+            "embed_model": os.path.abspath(embed_model_path),
+            "dataset_sha256": dataset_sha256,
+            "n_docs": len(questions),
+            "docs": docs,
+            "settings": settings or {},
+            "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+            "dtype": dtype,
+        }
+        atomic_write_bytes(meta_path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        return cls(embedder, np.load(mat_path, mmap_mode="r"),
+                   np.load(scale_path, mmap_mode="r") if scale is not None else None, doc_ids)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return embed_texts(self.embedder, [query])[0]
+
+    def scores(self, qvec: np.ndarray) -> np.ndarray:
+        s = self.matrix @ qvec.astype(np.float32)
+        if self.scale is not None:
+            s = s * self.scale
+        return np.asarray(s, dtype=np.float32)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, int]]:
+        n = len(self)
+        if not n or k <= 0:
+            return []
+        s = self.scores(self.embed_query(query))
+        k = min(k, n)
+        idx = np.argpartition(-s, k - 1)[:k]
+        idx = idx[np.argsort(-s[idx])]
+        ids = idx if self.doc_ids is None else self.doc_ids[idx]
+        return [(float(max(0.0, min(1.0, s[i]))), int(d)) for i, d in zip(idx, ids)]
+
+
+def _save_npy(path: Path, arr: np.ndarray):
+    buf = io.BytesIO()
+    np.save(buf, arr)
+    atomic_write_bytes(path, buf.getvalue())
+
+
+# =========================
+# Hybrid: trộn điểm lexical (BM25) và dense
+# =========================
+class HybridRetriever:
+    # score = alpha * dense + (1 - alpha) * lexical trên hợp các ứng viên top-`pool`
+    def __init__(self, lexical: Retriever, dense: Retriever, alpha: float = 0.5, pool: int = 20):
+        self.lexical = lexical
+        self.dense = dense
+        self.alpha = alpha
+        self.pool = pool
+
+    def __len__(self) -> int:
+        return len(self.lexical)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, int]]:
+        pool = max(k, self.pool)
+        fused: Dict[int, float] = {}
+        for s, doc in self.lexical.search(query, pool):
+            fused[doc] = fused.get(doc, 0.0) + (1.0 - self.alpha) * s
+        for s, doc in self.dense.search(query, pool):
+            fused[doc] = fused.get(doc, 0.0) + self.alpha * s
+        top = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [(s, doc) for doc, s in top]
@@ -0,0 +1,482 @@
+import argparse
+import importlib
+import json
+import random
+import re
+import time
+import tracemalloc
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import RaspDbot_jsonl_chatbot as jsonl_bot
+from raspdbot_bench import DEFAULT_DATASETS, percentile
+from raspdbot_corpus import load_corpus
+from raspdbot_retrieval import FOLD_PREFIX, STOPWORDS, BM25Index, fold_diacritics, normalize, syllables
+
+# =========================
+# Đánh giá retrieval: chất lượng vs latency
+# =========================
+# Câu hỏi "held-out" (không có nguyên văn trong corpus): sinh từ câu hỏi của
+# dataset (bỏ dấu, gõ sai, thay cụm hỏi) + bộ diễn đạt lại viết tay
+# (HANDWRITTEN_PATH: đổi từ vựng / cấu trúc, không phải sửa mẫu câu gốc nên
+# phân biệt được các backend). "exact" (câu gốc nguyên văn) chỉ để kiểm tra,
+# không tính vào recall / MRR / độ chính xác tier tổng. Mỗi backend chạy qua
+# jsonl_bot.top_k_context() như bot thật; câu đúng = record có câu hỏi gốc
+# hoặc cùng cụm gần trùng với nó (so sau normalize; thành viên cụm không nằm
+# trong index BM25, đại diện trả lời thay).
+# Đo recall@1 / recall@k, MRR@k, tỉ lệ should_clarify() sai (mọi câu đều có
+# đáp án trong corpus nên hỏi lại là sai), latency từng câu, bộ nhớ build +
+# đỉnh cấp phát Python mỗi câu. Bảng cuối đánh dấu backend Pareto
+# (không backend nào vừa recall@k cao hơn vừa p50 nhanh hơn).
+# Thêm bộ câu hỏi ngoài corpus (NEGATIVE_QUERIES) để đo độ chính xác của
+# choose_tier(): tầng direct / rewrite đúng khi top-1 là câu đúng; với câu
+# ngoài corpus mọi lần direct / rewrite đều sai.
+VARIANTS = ["exact", "nodiacritics", "typo", "paraphrase", "handwritten"]
+SANITY_VARIANTS = ("exact",)    # báo riêng, không vào số tổng
+HANDWRITTEN_PATH = Path(__file__).with_name("raspdbot_eval_paraphrases.jsonl")
+BUILTIN_BACKENDS = ["sequencematcher", "bm25-nofold", "bm25-flat", "bm25", "dense", "hybrid"]
+MEM_SAMPLE = 50     # số câu đo tracemalloc (pass riêng, không tính vào latency)
+SKIP_TIERS = ("direct", "rewrite")      # tầng không để LLM tổng hợp từ top-k
+
+# Không có đáp án trong cả 2 dataset. "offtopic": chủ đề khác (một số dùng từ
+# gần domain: xe máy, pin điện thoại); "vague": một hai từ khoá chung, khớp
+# BM25 ~1.0 với nhiều câu nhưng không đủ để chọn một câu trả lời.
+NEGATIVE_QUERIES: Dict[str, List[str]] = {
+    "offtopic": [
+        "Hôm nay thời tiết thế nào?",
+        "Cách nấu phở bò ngon?",
+        "Tỷ số trận bóng tối qua là bao nhiêu?",
+        "Giá vàng hôm nay bao nhiêu?",
+        "Làm sao để học tiếng Anh nhanh?",
+        "Thủ đô của Pháp là gì?",
+        "Xe máy của tôi bị thủng lốp thì làm sao?",
+        "Pin điện thoại nhanh hết phải làm gì?",
+        "Robot hút bụi nào tốt nhất?",
+        "Mua ô tô điện loại nào rẻ?",
+    ],
+    "vague": [
+        "xe", "pin", "robot", "lidar bị lỗi", "cảm biến",
+        "sạc", "động cơ", "lỗi", "tốc độ", "camera",
+    ],
+}
+
+# Cụm hỏi thường gặp -> cách nói khác (thay tối đa 2 cụm mỗi câu)
+PARAPHRASES: List[Tuple[str, List[str]]] = [
+    ("như thế nào", ["ra sao", "thế nào"]),
+    ("ra sao", ["như thế nào"]),
+    ("là gì", ["là cái gì", "nghĩa là gì"]),
+    ("tại sao", ["vì sao", "lý do gì mà"]),
+    ("vì sao", ["tại sao"]),
+    ("làm sao để", ["làm thế nào để", "cách nào để"]),
+    ("làm thế nào", ["làm sao"]),
+    ("bao nhiêu", ["mấy"]),
+    ("khi nào", ["lúc nào"]),
+    ("ở đâu", ["chỗ nào"]),
+    ("có thể", ["có khả năng"]),
+    ("cần", ["phải"]),
+    ("dùng", ["sử dụng"]),
+    ("kiểm tra", ["check"]),
+]
+PREFIXES = ["cho mình hỏi ", "bạn ơi, ", "xin hỏi ", "mình muốn biết "]
+SUFFIXES = ["", " vậy", " nhỉ", " thế"]
+KEYBOARD_NEIGHBORS = {
+    "a": "sqw", "s": "adw", "d": "sfe", "e": "wrd", "i": "uok", "o": "ipl",
+    "n": "bmh", "m": "nj", "t": "ryg", "h": "gjn", "c": "xvd", "u": "yij",
+    "g": "fht", "r": "etf", "l": "kop", "p": "ol", "b": "vnh", "v": "cbg",
+}
+
+
+# =========================
+# Sinh câu hỏi
+# =========================
+def _rng(seed: int, text: str, variant: str) -> random.Random:
+    # Tất định theo (seed, câu hỏi, kiểu biến thể)
+    return random.Random(seed * 1000003 + zlib.crc32(f"{variant}\0{text}".encode("utf-8")))
+
+
+def make_typo(text: str, rng: random.Random) -> str:
+    words = text.split(" ")
+    candidates = [i for i, w in enumerate(words) if len(w) >= 3 and w.isalpha()]
+    if not candidates:
+        return text
+    for i in rng.sample(candidates, min(len(candidates), 1 if len(words) <= 6 else 2)):
+        w = words[i]
+        j = rng.randrange(len(w) - 1)
+        op = rng.choice(["swap", "drop", "double", "neighbor"])
+        if op == "swap":
+            w = w[:j] + w[j + 1] + w[j] + w[j + 2:]
+        elif op == "drop":
+            w = w[:j] + w[j + 1:]
+        elif op == "double":
+            w = w[:j] + w[j] + w[j:]
+        else:
+            base = fold_diacritics(w[j]).lower()
+            w = w[:j] + rng.choice(KEYBOARD_NEIGHBORS.get(base, base)) + w[j + 1:]
+        words[i] = w
+    return " ".join(words)
+
+
+def make_paraphrase(text: str, rng: random.Random) -> str:
+    out = text.rstrip(" ?!.")
+    lower = out.lower()
+    changed = 0
+    for phrase, alts in PARAPHRASES:
+        if changed >= 2:
+            break
+        m = re.search(rf"(?<!\w){re.escape(phrase)}(?!\w)", lower)
+        if m:
+            alt = rng.choice(alts)
+            out = out[:m.start()] + alt + out[m.end():]
+            lower = out.lower()
+            changed += 1
+    prefix = rng.choice(PREFIXES) if not changed or rng.random() < 0.5 else ""
+    if prefix:
+        out = out[:1].lower() + out[1:]
+    return f"{prefix}{out}{rng.choice(SUFFIXES)}?"
+
+
+def make_variant(question: str, variant: str, seed: int = 0) -> str:
+    rng = _rng(seed, question, variant)
+    if variant == "exact":
+        return question
+    if variant == "nodiacritics":
+        return fold_diacritics(question)
+    if variant == "typo":
+        return make_typo(question, rng)
+    if variant == "paraphrase":
+        return make_paraphrase(question, rng)
+    raise ValueError(f"biến thể không hợp lệ: {variant}")
+
+
+def _cluster_golds(qa_pairs, docs, corpus=None) -> List[str]:
+    # Câu hỏi (đã normalize) của mọi record cùng cụm gần trùng với các doc này
+    members = set(docs)
+    if corpus is not None:
+        for doc in docs:
+            members.update(corpus.cluster(doc))
+    return sorted({normalize(qa_pairs[m][0]) for m in members})
+
+
+def build_queries(
+    qa_pairs, variants: List[str], limit: Optional[int] = None, seed: int = 0, corpus=None
+) -> List[Dict]:
+    # [{"query", "gold", "variant"}]; gold = các câu hỏi (đã normalize) của cụm
+    # chứa câu gốc — corpus (CompiledCorpus) cho biết cụm, không có thì chỉ câu gốc
+    seen = set()
+    questions = []
+    golds: Dict[str, List[str]] = {}
+    for doc, (q, a) in enumerate(qa_pairs):
+        key = normalize(q)
+        if q and a and key not in seen:
+            seen.add(key)
+            questions.append(q)
+            golds[key] = _cluster_golds(qa_pairs, [doc], corpus)
+    if limit and len(questions) > limit:
+        step = len(questions) / limit
+        questions = [questions[int(i * step)] for i in range(limit)]
+    out = []
+    generated = [v for v in variants if v != "handwritten"]
+    for q in questions:
+        for v in generated:
+            query = make_variant(q, v, seed)
+            if v != "exact" and normalize(query) == normalize(q):
+                continue    # biến thể trùng câu gốc (vd câu không dấu sẵn) -> không phải held-out
+            out.append({"query": query, "gold": golds[normalize(q)], "variant": v})
+    return out
+
+
+def load_handwritten(dataset: str, qa_pairs, corpus=None, path: Path = HANDWRITTEN_PATH) -> List[Dict]:
+    # Dòng {"dataset": stem của JSONL, "query", "gold": [câu hỏi gốc...]}; câu gốc
+    # không còn trong dataset -> báo lỗi (bộ câu hỏi phải sửa theo dataset)
+    if not path.exists():
+        return []
+    docs_by_q: Dict[str, List[int]] = {}
+    for doc, (q, _) in enumerate(qa_pairs):
+        docs_by_q.setdefault(normalize(q), []).append(doc)
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if rec["dataset"] != dataset:
+                continue
+            docs = []
+            for q in rec["gold"]:
+                if normalize(q) not in docs_by_q:
+                    raise ValueError(f"{path.name}:{line_no}: không có câu hỏi {q!r} trong {dataset}")
+                docs += docs_by_q[normalize(q)]
+            out.append({"query": rec["query"], "gold": _cluster_golds(qa_pairs, docs, corpus), "variant": "handwritten"})
+    return out
+
+
+def build_negative_queries() -> List[Dict]:
+    # gold rỗng: không record nào đúng
+    return [
+        {"query": q, "gold": [], "variant": variant}
+        for variant, queries in NEGATIVE_QUERIES.items()
+        for q in queries
+    ]
+
+
+# =========================
+# Backend
+# =========================
+def rss_mb() -> float:
+    # RSS hiện tại (không phải đỉnh như ru_maxrss)
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * 4096 / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def exact_terms(text: str) -> List[str]:
+    # Âm tiết giữ nguyên dấu, trừ stopword; âm tiết vốn không dấu mang tiền tố như tokenize_query
+    return [s if s != fold_diacritics(s) else FOLD_PREFIX + s for s in syllables(text) if s not in STOPWORDS]
+
+
+class NoFoldBM25(BM25Index):
+    # Mốc yếu: BM25 không có nhánh bỏ dấu và bigram -> câu gõ không dấu chỉ khớp từ vốn không dấu
+    def _doc_terms(self, text: str) -> List[str]:
+        return exact_terms(text)
+
+    def _query_terms(self, query: str) -> Set[str]:
+        return set(exact_terms(query))
+
+
+def load_backend(name: str, corpus) -> Optional[object]:
+    # -> index cho top_k_context (None = quét SequenceMatcher tuyến tính)
+    if name == "sequencematcher":
+        return None
+    if name == "bm25-nofold":
+        # Như index compile sẵn: chỉ đại diện cụm gần trùng có postings
+        return NoFoldBM25(q if corpus.representative(i) == i else "" for i, (q, _) in enumerate(corpus.qa_pairs))
+    if name == "bm25-flat":
+        return corpus.index
+    if name in ("bm25", "dense", "hybrid"):
+        return jsonl_bot.build_retriever(corpus, name)
+    # "module:factory" -> factory(corpus) trả về object có search(query, k)
+    module, _, attr = name.partition(":")
+    if not attr:
+        raise ValueError(f"backend không hợp lệ: {name} (dùng {', '.join(BUILTIN_BACKENDS)} hoặc module:factory)")
+    return getattr(importlib.import_module(module), attr)(corpus)
+
+
+def evaluate(
+    index,
+    qa_pairs,
+    queries: List[Dict[str, str]],
+    k: int = 5,
+    clarify_threshold: float = jsonl_bot.CLARIFY_THRESHOLD,
+    on_miss: Optional[Callable[[Dict, List], None]] = None,
+) -> Dict:
+    per_variant: Dict[str, Dict[str, float]] = {}
+    latencies: List[float] = []
+    for item in queries:
+        t0 = time.perf_counter()
+        top = jsonl_bot.top_k_context(item["query"], qa_pairs, k=k, index=index)
+        latencies.append(time.perf_counter() - t0)
+
+        rank = next((i + 1 for i, (_, q, _) in enumerate(top) if normalize(q) in item["gold"]), 0)
+        best = top[0][0] if top else 0.0
+        st = per_variant.setdefault(item["variant"], {"n": 0, "hit1": 0, "hitk": 0, "rr": 0.0, "clarify": 0})
+        st["n"] += 1
+        st["hit1"] += rank == 1
+        st["hitk"] += rank > 0
+        st["rr"] += 1.0 / rank if rank else 0.0
+        st["clarify"] += jsonl_bot.should_clarify(best, clarify_threshold)
+        if rank != 1 and on_miss is not None:
+            on_miss(item, top)
+
+    def rates(st: Dict[str, float]) -> Dict[str, float]:
+        n = max(1, st["n"])
+        return {
+            "n": int(st["n"]),
+            "recall@1": st["hit1"] / n,
+            f"recall@{k}": st["hitk"] / n,
+            "mrr": st["rr"] / n,
+            "false_clarify": st["clarify"] / n,
+        }
+
+    # Số tổng = trung bình các biến thể (trừ SANITY_VARIANTS), mỗi biến thể cùng trọng số:
+    # bộ viết tay chỉ vài chục câu, cộng dồn thì bị các biến thể sinh tự động lấn át
+    variants = {v: rates(st) for v, st in per_variant.items()}
+    counted = [r for v, r in variants.items() if v not in SANITY_VARIANTS]
+    total = {key: sum(r[key] for r in counted) / max(1, len(counted)) for key in ("recall@1", f"recall@{k}", "mrr", "false_clarify")}
+    total["n"] = sum(r["n"] for r in counted)
+    ms = [1000 * x for x in latencies]
+    return {
+        **total,
+        "variants": variants,
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+    }
+
+
+def evaluate_tiers(index, qa_pairs, queries: List[Dict], negatives: List[Dict], k: int = 5) -> Dict:
+    # Độ chính xác của choose_tier() (ngưỡng score + coverage hiện hành) trên câu có đáp án
+    # + câu ngoài corpus; "negative_skipped" = tỉ lệ câu ngoài corpus bị trả thẳng / viết lại
+    tiers = {t: {"n": 0, "correct": 0} for t in SKIP_TIERS}
+    skipped: Dict[str, int] = {}
+    for item in list(queries) + list(negatives):
+        if item["variant"] in SANITY_VARIANTS:
+            continue
+        top = jsonl_bot.top_k_context(item["query"], qa_pairs, k=k, index=index)
+        tier = jsonl_bot.choose_tier(item["query"], top)
+        if tier not in tiers:
+            continue
+        tiers[tier]["n"] += 1
+        tiers[tier]["correct"] += bool(top) and normalize(top[0][1]) in item["gold"]
+        if not item["gold"]:
+            skipped[item["variant"]] = skipped.get(item["variant"], 0) + 1
+    out: Dict = {}
+    for t, st in tiers.items():
+        out[f"{t}_n"] = st["n"]
+        out[f"{t}_precision"] = st["correct"] / st["n"] if st["n"] else 1.0
+    out["negative_n"] = len(negatives)
+    out["negative_skipped"] = sum(skipped.values()) / len(negatives) if negatives else 0.0
+    out["negative_skipped_by_variant"] = skipped
+    return out
+
+
+def query_peak_kb(index, qa_pairs, queries: List[Dict[str, str]], k: int) -> float:
+    # Đỉnh cấp phát Python của một câu (tracemalloc làm chậm -> pass riêng)
+    peak = 0
+    tracemalloc.start()
+    try:
+        for item in queries[:MEM_SAMPLE]:
+            tracemalloc.reset_peak()
+            jsonl_bot.top_k_context(item["query"], qa_pairs, k=k, index=index)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    return peak / 1024.0
+
+
+def pareto(rows: List[Dict], quality: str, cost: str = "p50_ms") -> List[Dict]:
+    # Đánh dấu "pareto": không row nào tốt hơn hoặc bằng ở cả hai và tốt hơn hẳn ở một
+    for r in rows:
+        r["pareto"] = not any(
+            o is not r
+            and o[quality] >= r[quality]
+            and o[cost] <= r[cost]
+            and (o[quality] > r[quality] or o[cost] < r[cost])
+            for o in rows
+        )
+    return rows
+
+
+# =========================
+# CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Đánh giá retrieval (recall@k, MRR, hỏi lại sai) vs latency / bộ nhớ.")
+    ap.add_argument("--dataset", action="append", help="JSONL (mặc định: cả 2 dataset đi kèm)")
+    ap.add_argument(
+        "--backend", action="append",
+        help=f"{', '.join(BUILTIN_BACKENDS)} hoặc module:factory (mặc định: sequencematcher, bm25-nofold, bm25-flat, bm25)",
+    )
+    ap.add_argument("--variants", default=",".join(VARIANTS))
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--limit", type=int, default=0, help="số câu hỏi gốc mỗi dataset (0 = tất cả)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--clarify-threshold", type=float, default=jsonl_bot.CLARIFY_THRESHOLD)
+    ap.add_argument("--show-misses", type=int, default=0, help="in N câu top-1 sai mỗi backend")
+    ap.add_argument("--no-negatives", action="store_true", help="không chạy bộ câu hỏi ngoài corpus")
+    ap.add_argument("--dump-queries", default="", help="ghi bộ câu hỏi sinh ra (JSONL)")
+    ap.add_argument("--out", default="", help="ghi kết quả JSON")
+    args = ap.parse_args()
+
+    variants = [v.strip() for v in args.variants.split(",") if v.strip()]
+    backends = args.backend or ["sequencematcher", "bm25-nofold", "bm25-flat", "bm25"]
+    recall_k = f"recall@{args.k}"
+    rows: List[Dict] = []
+    dump = open(args.dump_queries, "w", encoding="utf-8") if args.dump_queries else None
+    negatives = [] if args.no_negatives else build_negative_queries()
+
+    for dataset in args.dataset or DEFAULT_DATASETS:
+        name = Path(dataset).stem
+        rss0, t0 = rss_mb(), time.perf_counter()
+        corpus = load_corpus(dataset)     # index BM25 nằm sẵn trong corpus compile -> build/mem của backend là phần thêm
+        load_ms, load_mb = 1000 * (time.perf_counter() - t0), max(0.0, rss_mb() - rss0)
+        qa_pairs = corpus.qa_pairs
+        queries = build_queries(qa_pairs, variants, args.limit or None, args.seed, corpus)
+        if "handwritten" in variants:
+            queries += load_handwritten(name, qa_pairs, corpus)
+        if dump:
+            for item in queries + negatives:
+                dump.write(json.dumps({"dataset": name, **item}, ensure_ascii=False) + "\n")
+        print(
+            f"== {name}: {len(qa_pairs)} Q/A (nạp corpus {load_ms:.1f} ms, +{load_mb:.1f} MB), "
+            f"{len(queries)} câu hỏi ({', '.join(variants)}) + {len(negatives)} câu ngoài corpus"
+        )
+
+        for backend in backends:
+            rss0 = rss_mb()
+            t0 = time.perf_counter()
+            try:
+                index = load_backend(backend, corpus)
+            except Exception as e:     # vd dense/hybrid chưa có model embedding
+                print(f"  {backend}: bỏ qua ({e})")
+                continue
+            build_ms = 1000 * (time.perf_counter() - t0)
+
+            misses: List[Tuple[Dict, List]] = []
+            res = evaluate(
+                index, qa_pairs, queries, args.k, args.clarify_threshold,
+                on_miss=(lambda item, top: misses.append((item, top))) if args.show_misses else None,
+            )
+            res.update(
+                dataset=name,
+                backend=backend,
+                build_ms=build_ms,
+                mem_mb=max(0.0, rss_mb() - rss0),
+                query_peak_kb=query_peak_kb(index, qa_pairs, queries, args.k),
+            )
+            res.update(evaluate_tiers(index, qa_pairs, queries, negatives, args.k))
+            rows.append(res)
+
+            per_var = "  ".join(f"{v} {st['recall@1']:.2f}" for v, st in res["variants"].items())
+            print(f"  {backend:16s} recall@1 theo biến thể: {per_var}")
+            neg = f"{res['negative_skipped']:.0%}"
+            if res["negative_skipped_by_variant"]:
+                neg += " (" + ", ".join(f"{v} {n}" for v, n in res["negative_skipped_by_variant"].items()) + ")"
+            print(
+                f"  {'':16s} tier: direct {res['direct_n']} (precision {res['direct_precision']:.3f}), "
+                f"rewrite {res['rewrite_n']} (precision {res['rewrite_precision']:.3f}); "
+                f"câu ngoài corpus bỏ qua LLM {neg}"
+            )
+            for item, top in misses[: args.show_misses]:
+                got = top[0][1] if top else "-"
+                print(f"      [{item['variant']}] {item['query'][:60]!r} -> {got[:50]!r}")
+    if dump:
+        dump.close()
+
+    header = (
+        f"{'dataset':28s} {'backend':16s} {'R@1':>6s} {'R@' + str(args.k):>6s} {'MRR':>6s} {'clarify':>8s} "
+        f"{'dir P':>6s} {'rw P':>6s} {'neg':>6s} "
+        f"{'p50 ms':>8s} {'p95 ms':>8s} {'build ms':>9s} {'mem MB':>7s} {'q KB':>7s}  pareto"
+    )
+    print("\n" + header)
+    print("-" * len(header))
+    for name in dict.fromkeys(r["dataset"] for r in rows):
+        group = pareto([r for r in rows if r["dataset"] == name], recall_k)
+        for r in sorted(group, key=lambda r: r["p50_ms"]):
+            print(
+                f"{r['dataset']:28s} {r['backend']:16s} {r['recall@1']:6.3f} {r[recall_k]:6.3f} {r['mrr']:6.3f} "
+                f"{r['false_clarify']:8.3f} {r['direct_precision']:6.3f} {r['rewrite_precision']:6.3f} "
+                f"{r['negative_skipped']:6.3f} {r['p50_ms']:8.3f} {r['p95_ms']:8.3f} {r['build_ms']:9.1f} "
+                f"{r['mem_mb']:7.1f} {r['query_peak_kb']:7.1f}  {'*' if r['pareto'] else ''}"
+            )
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(rows, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Đã lưu: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
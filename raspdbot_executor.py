@@ -0,0 +1,101 @@
+import threading
+from collections import deque
+from typing import Callable, Deque, Optional
+
+# =========================
+# Một thread suy luận duy nhất cho app desktop
+# =========================
+# Mọi việc đụng tới engine (load model, hỏi, reset, nạp history) đi qua một
+# hàng đợi FIFO và chạy lần lượt trên cùng một thread:
+#   - gõ tiếp khi bot đang trả lời -> câu hỏi được xếp hàng (type-ahead)
+#   - đổi model giữa chừng -> load chạy sau câu trả lời hiện tại, không tranh engine
+#   - cancel_current() -> job đang chạy thấy job.cancel trong vòng một token
+
+
+class Job:
+    def __init__(self, kind: str, fn: Callable[["Job"], object]):
+        self.kind = kind
+        self.fn = fn
+        self.cancel = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class InferenceExecutor:
+    def __init__(self, name: str = "raspdbot-infer"):
+        self._pending: Deque[Job] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.current: Optional[Job] = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, kind: str, fn: Callable[[Job], object]) -> Job:
+        job = Job(kind, fn)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("executor đã đóng")
+            self._pending.append(job)
+            self._cond.notify()
+        return job
+
+    def pending(self, kind: Optional[str] = None) -> int:
+        with self._cond:
+            return sum(1 for j in self._pending if kind is None or j.kind == kind)
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None
+
+    def cancel_current(self, kind: Optional[str] = None) -> bool:
+        job = self.current
+        if job is None or (kind is not None and job.kind != kind):
+            return False
+        job.cancel.set()
+        return True
+
+    def cancel_pending(self, kind: Optional[str] = None) -> int:
+        # Bỏ job chưa chạy (vd các lần đổi model cũ, chỉ giữ lần mới nhất)
+        with self._cond:
+            keep: Deque[Job] = deque()
+            dropped = []
+            for j in self._pending:
+                (dropped if kind is None or j.kind == kind else keep).append(j)
+            self._pending = keep
+        for j in dropped:
+            j.cancel.set()
+            j.done.set()
+        return len(dropped)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                job = self._pending.popleft()
+                self.current = job
+            try:
+                if not job.cancel.is_set():
+                    job.result = job.fn(job)
+            except BaseException as e:
+                job.error = e
+            finally:
+                self.current = None
+                job.done.set()
+
+    def shutdown(self, cancel: bool = True, timeout: Optional[float] = None) -> bool:
+        # -> True nếu thread đã dừng; False = job hiện tại vẫn chạy sau `timeout` giây
+        if cancel:
+            self.cancel_pending()
+            self.cancel_current()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        return self.join(timeout)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from raspdbot_cache import atomic_write_bytes
+
+# =========================
+# Lưu history dạng journal (append-only) + snapshot
+# =========================
+# history-<model>.json     snapshot: {"model_path", "history", "seq"} (ghi file tạm rồi rename)
+# history-<model>.journal  mỗi dòng một record JSON, seq tăng dần:
+#   {"seq": 7, "op": "add", "m": {"role": "user", "content": "..."}}
+#   {"seq": 8, "op": "replace", "history": [...]}      (reset / load history)
+# Đọc = snapshot rồi replay các record có seq > snapshot["seq"]; dòng cuối bị
+# ghi dở (mất điện) thì bỏ qua, và bị cắt khỏi file trước khi ghi tiếp.
+# File history-*.json cũ đọc như snapshot seq 0.
+# Ghi / fsync / compact chạy trên một thread nền: mỗi lượt chat chỉ tốn một
+# lần đưa record vào hàng đợi, không ghi lại cả file.
+JOURNAL_SUFFIX = ".journal"
+FSYNC_INTERVAL = 1.0        # gom các record trong 1s rồi fsync một lần
+COMPACT_RECORDS = 500       # journal dài hơn -> gộp vào snapshot
+
+
+def journal_path_for(snapshot_path: Path) -> Path:
+    return Path(snapshot_path).with_suffix(JOURNAL_SUFFIX)
+
+
+def _clean(m: Dict) -> Dict[str, str]:
+    return {"role": str(m.get("role", "")), "content": str(m.get("content", ""))}
+
+
+def _apply(history: List[Dict[str, str]], rec: Dict) -> List[Dict[str, str]]:
+    op = rec.get("op")
+    if op == "add" and isinstance(rec.get("m"), dict):
+        history.append(_clean(rec["m"]))
+    elif op == "replace" and isinstance(rec.get("history"), list):
+        history = [_clean(m) for m in rec["history"] if isinstance(m, dict)]
+    return history
+
+
+def replay(snapshot_path: Path) -> Tuple[Dict, int]:
+    # -> (data giống engine.to_json() + "seq", số record journal còn hiệu lực)
+    snapshot_path = Path(snapshot_path)
+    data: Dict = {}
+    if snapshot_path.exists():
+        data = json.loads(snapshot_path.read_text(encoding="utf-8"))
+    seq = int(data.get("seq", 0) or 0)
+    hist = data.get("history", [])
+    history = [_clean(m) for m in hist if isinstance(m, dict)] if isinstance(hist, list) else []
+
+    n_records = 0
+    journal = journal_path_for(snapshot_path)
+    if journal.exists():
+        with open(journal, "rb") as f:
+            for raw in f:
+                try:
+                    rec = json.loads(raw.decode("utf-8"))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                if not isinstance(rec, dict) or int(rec.get("seq", 0)) <= seq:
+                    continue     # đã nằm trong snapshot (crash giữa rename và truncate)
+                history = _apply(history, rec)
+                seq = int(rec["seq"])
+                n_records += 1
+
+    data["history"] = history
+    data["seq"] = seq
+    return data, n_records
+
+
+def trim_torn_tail(journal: Path, chunk: int = 4096) -> int:
+    """
+    Cắt dòng cuối ghi dở (không có "\n") trước khi append tiếp: nếu không,
+    record mới nối vào cùng dòng đó và replay bỏ luôn cả record mới.
+    -> số byte đã cắt.
+    """
+    try:
+        f = open(journal, "r+b")
+    except FileNotFoundError:
+        return 0
+    with f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - chunk)
+            f.seek(start)
+            buf = f.read(end - start)
+            if end == size and buf.endswith(b"\n"):
+                return 0
+            nl = buf.rfind(b"\n")
+            if nl >= 0:
+                end = start + nl + 1
+                break
+            end = start
+        f.truncate(end)
+        f.flush()
+        os.fsync(f.fileno())
+        return size - end
+
+
+class HistoryJournal:
+    """
+    sync(engine.history) sau mỗi lượt: chỉ ghi các message mới; list history
+    bị thay (reset / load_json) -> ghi một record "replace".
+    flush() chờ tới khi mọi record đã fsync; close() flush rồi dừng thread.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        model_path: str = "",
+        fsync_interval: float = FSYNC_INTERVAL,
+        compact_records: int = COMPACT_RECORDS,
+    ):
+        self.path = Path(path)
+        self.journal_path = journal_path_for(self.path)
+        self.fsync_interval = fsync_interval
+        self.compact_records = compact_records
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        data, self._n_records = replay(self.path)
+        self.model_path = model_path or str(data.get("model_path", ""))
+        self._history: List[Dict[str, str]] = data["history"]   # trạng thái đã ghi (thread nền)
+        self._seq = data["seq"]           # seq đã cấp
+        self._durable_seq = self._seq     # seq đã fsync
+        self._pending: List[Dict] = []
+        self._flush_waiters = 0
+        self._compact_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # list history của engine đang được theo dõi + số message đã ghi
+        self._ref: Optional[List[Dict[str, str]]] = None
+        self._ref_len = 0
+
+        trim_torn_tail(self.journal_path)
+        self._f = open(self.journal_path, "ab")
+        self._thread = threading.Thread(target=self._run, name="raspdbot-history", daemon=True)
+        self._thread.start()
+
+    # ---- phía caller (main thread GTK) ----
+    def load(self) -> Dict:
+        # Dữ liệu dạng engine.to_json() (để engine.load_json)
+        self.flush()
+        with self._cond:
+            return {"model_path": self.model_path, "history": [dict(m) for m in self._history]}
+
+    def attach(self, history: List[Dict[str, str]]):
+        # history vừa nạp từ journal -> coi như đã ghi
+        self._ref = history
+        self._ref_len = len(history)
+
+    def sync(self, history: List[Dict[str, str]]):
+        if history is not self._ref or len(history) < self._ref_len:
+            self.replace(history)
+            return
+        for m in history[self._ref_len:]:
+            self._put({"op": "add", "m": _clean(m)})
+        self._ref_len = len(history)
+
+    def replace(self, history: List[Dict[str, str]]):
+        self._put({"op": "replace", "history": [_clean(m) for m in history]})
+        self.attach(history)
+
+    def _put(self, rec: Dict):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("history journal đã đóng")
+            self._seq += 1
+            rec["seq"] = self._seq
+            self._pending.append(rec)
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            target = self._seq
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: self._durable_seq >= target or self._closed, timeout)
+            finally:
+                self._flush_waiters -= 1
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._f.close()
+
+    def compact(self):
+        # Gộp journal vào snapshot ngay (thread nền làm, hàm này chờ xong)
+        with self._cond:
+            self._compact_requested = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: not self._compact_requested or self._closed)
+
+    # ---- thread nền ----
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._compact_requested or self._closed)
+                if not self._pending and not self._compact_requested:
+                    return
+                if self._pending:
+                    # Gom thêm record tới fsync_interval (group commit), trừ khi có flush()
+                    self._cond.wait_for(
+                        lambda: self._flush_waiters or self._compact_requested or self._closed,
+                        self.fsync_interval,
+                    )
+                batch, self._pending = self._pending, []
+
+            if batch:
+                data = b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in batch)
+                self._f.write(data)
+                self._f.flush()
+                os.fsync(self._f.fileno())
+
+            with self._cond:
+                for rec in batch:
+                    self._history = _apply(self._history, rec)
+                self._n_records += len(batch)
+                if batch:
+                    self._durable_seq = batch[-1]["seq"]
+                compact = self._compact_requested or self._n_records >= self.compact_records
+                snap = {"model_path": self.model_path, "history": list(self._history), "seq": self._durable_seq}
+                self._cond.notify_all()
+
+            if compact:
+                # Chỉ thread này ghi file nên không cần giữ lock khi ghi snapshot
+                self._compact(snap)
+                with self._cond:
+                    self._n_records = 0
+                    self._compact_requested = False
+                    self._cond.notify_all()
+
+    def _compact(self, snap: Dict):
+        # Snapshot mới (rename nguyên tử) rồi mới cắt journal; crash ở giữa thì
+        # replay bỏ qua record có seq <= seq của snapshot
+        atomic_write_bytes(self.path, json.dumps(snap, ensure_ascii=False, indent=2).encode("utf-8"))
+        self._f.truncate(0)
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+
+# =========================
+# CLI: xem / gộp journal
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Xem hoặc gộp journal history của app GTK.")
+    ap.add_argument("cmd", choices=["info", "compact"])
+    ap.add_argument("snapshot", nargs="+", help="file history-<model>.json")
+    args = ap.parse_args()
+
+    for path in args.snapshot:
+        if args.cmd == "compact":
+            journal = HistoryJournal(Path(path))
+            journal.compact()
+            journal.close()
+        data, n_records = replay(Path(path))
+        journal = journal_path_for(Path(path))
+        size = journal.stat().st_size if journal.exists() else 0
+        print(
+            f"{path}: {len(data['history'])} message, seq={data['seq']}, "
+            f"journal {n_records} record ({size} bytes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from raspdbot_retrieval import fold_diacritics
+
+# =========================
+# Router intent (chào hỏi / xác nhận / cần dữ liệu realtime / thoát)
+# =========================
+# Mọi keyword của mọi intent nằm trong MỘT automaton Aho-Corasick, build một lần;
+# mỗi câu của user chỉ quét một lượt. Automaton chạy trên dãy từ (không phải
+# từng ký tự) nên match luôn trọn từ ("pin" không khớp "pinout", "log" không
+# khớp "catalog") và số bước = số từ của câu. Keyword được thêm cả dạng bỏ dấu:
+# user gõ không dấu ("vi tri") vẫn khớp "vị trí", còn câu có dấu thì phải
+# khớp đúng dấu ("tóc đỏ" không khớp "tốc độ").
+EXIT_WORDS = ["exit", "quit", "q"]
+INTENTS_ENV = "RASPDBOT_INTENTS"   # file JSON {"intent": ["keyword", ...]} ghi đè mặc định
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def words(text: str) -> List[str]:
+    return _WORD_RE.findall(unicodedata.normalize("NFC", text or "").lower())
+
+
+class AhoCorasick:
+    # Pattern là dãy ký hiệu bất kỳ (ở đây: tuple các từ)
+    def __init__(self, patterns: Iterable[Tuple[str, ...]]):
+        self.patterns: List[Tuple[str, ...]] = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[int]] = [[]]
+        for p in patterns:
+            self._add(p)
+        self._build()
+
+    def _add(self, pattern: Tuple[str, ...]):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            node = nxt
+        self.out[node].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build(self):
+        # BFS: fail link = trạng thái của hậu tố dài nhất cũng là tiền tố của một pattern
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def iter_matches(self, seq: List[str]) -> Iterator[Tuple[int, int, int]]:
+        # (start, end, pattern_id), end không tính
+        goto, fail, out, patterns = self.goto, self.fail, self.out, self.patterns
+        node = 0
+        for i, ch in enumerate(seq):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pid in out[node]:
+                yield i + 1 - len(patterns[pid]), i + 1, pid
+
+
+class IntentRouter:
+    """
+    intents: {"greeting": [...], "need_data": [...]}.
+    exact: các intent chỉ tính khi keyword phủ cả câu (bỏ qua dấu câu),
+    vd "xin chào!" là greeting nhưng "xin chào, pin còn bao nhiêu?" thì không.
+    """
+
+    def __init__(self, intents: Dict[str, Iterable[str]], exact: Iterable[str] = ()):
+        self.exact: Set[str] = set(exact)
+        self.intent_names = list(intents)
+        patterns: List[Tuple[str, ...]] = []
+        self._labels: List[Tuple[str, str]] = []
+        seen = set()
+        for intent, keywords in intents.items():
+            for keyword in keywords:
+                w = words(keyword)
+                if not w:
+                    continue
+                kw = " ".join(w)
+                for form in (tuple(w), tuple(words(fold_diacritics(kw)))):
+                    if (intent, form) in seen:
+                        continue
+                    seen.add((intent, form))
+                    patterns.append(form)
+                    self._labels.append((intent, kw))
+        self.automaton = AhoCorasick(patterns)
+
+    def classify(self, text: str) -> Dict[str, List[str]]:
+        seq = words(text)
+        found: Dict[str, List[str]] = {}
+        for start, end, pid in self.automaton.iter_matches(seq):
+            intent, kw = self._labels[pid]
+            if intent in self.exact and (start != 0 or end != len(seq)):
+                continue
+            hits = found.setdefault(intent, [])
+            if kw not in hits:
+                hits.append(kw)
+        return found
+
+    def intents(self, text: str) -> Set[str]:
+        return set(self.classify(text))
+
+    def matches(self, text: str, intent: str) -> bool:
+        return intent in self.classify(text)
+
+
+def load_intents(defaults: Dict[str, Iterable[str]], path: Optional[str] = None) -> Dict[str, List[str]]:
+    # File cấu hình (RASPDBOT_INTENTS) thay thế danh sách của intent có trong file
+    intents = {k: list(v) for k, v in defaults.items()}
+    path = path or os.environ.get(INTENTS_ENV)
+    if path:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        for intent, keywords in data.items():
+            if isinstance(keywords, list):
+                intents[intent] = [str(k) for k in keywords]
+    return intents
+
+
+# =========================
+# Benchmark: router vs vòng lặp substring cũ trên câu hỏi của dataset
+# =========================
+def _legacy_classify(text: str, intents: Dict[str, List[str]], exact: Set[str]) -> Set[str]:
+    t = " ".join(text.lower().split())
+    found = set()
+    for intent, keywords in intents.items():
+        if intent in exact:
+            if t in keywords:
+                found.add(intent)
+        elif any(k in t for k in keywords):
+            found.add(intent)
+    return found
+
+
+def main():
+    import RaspDbot_jsonl_chatbot as jsonl_bot
+    import raspdbot_bot
+    from raspdbot_bench import DEFAULT_DATASETS, user_turns
+
+    ap = argparse.ArgumentParser(description="Benchmark router intent trên câu hỏi của dataset.")
+    ap.add_argument("--dataset", action="append", help="JSONL (mặc định: cả 2 dataset đi kèm)")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--show", type=int, default=10, help="số câu khác kết quả in ra")
+    args = ap.parse_args()
+
+    turns: List[str] = []
+    for path in args.dataset or DEFAULT_DATASETS:
+        turns += user_turns(path)
+
+    configs = {
+        "engine": (raspdbot_bot.INTENTS, raspdbot_bot.ROUTER),
+        "jsonl": (jsonl_bot.INTENTS, jsonl_bot.ROUTER),
+    }
+    for name, (intents, router) in configs.items():
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            legacy = [_legacy_classify(t, intents, router.exact) for t in turns]
+        t1 = time.perf_counter()
+        for _ in range(args.repeat):
+            new = [router.intents(t) for t in turns]
+        t2 = time.perf_counter()
+
+        n = len(turns) * args.repeat
+        diffs = [(t, a, b) for t, a, b in zip(turns, legacy, new) if a != b]
+        counts = {i: sum(1 for s in new if i in s) for i in router.intent_names}
+        print(f"== {name}: {len(turns)} câu, {len(router.automaton.goto)} trạng thái automaton")
+        print(f"  substring cũ : {1e6 * (t1 - t0) / n:7.2f} µs/câu")
+        print(f"  router       : {1e6 * (t2 - t1) / n:7.2f} µs/câu")
+        print(f"  intent       : {counts}")
+        print(f"  khác kết quả : {len(diffs)}")
+        for t, a, b in diffs[: args.show]:
+            print(f"    {sorted(a)} -> {sorted(b)}  {t[:70]!r}")
+
+
+if __name__ == "__main__":
+    main()
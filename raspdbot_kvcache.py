@@ -0,0 +1,183 @@
+import inspect
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from raspdbot_cache import atomic_write_bytes, cache_path, file_signature, short_hash
+from raspdbot_memory import llm_kv_type
+
+# =========================
+# Snapshot KV-state của phần system prompt cố định
+# =========================
+# Prefill SYSTEM_PROMPT một lần, lưu llama.save_state() ra đĩa
+# (~/.cache/raspdbot/kv). Lần sau chỉ load_state(): prompt mới có cùng
+# prefix token -> llama-cpp bỏ qua đoạn đã có trong KV cache.
+# Layout file (không pickle: file cache hỏng / bị sửa chỉ là dữ liệu sai, không chạy code):
+#   MAGIC | version (u32) | header_len (u32) | header JSON | sections...
+# header["fields"]: tên field của LlamaState ->
+#   {"int": giá trị} | {"bytes": [offset, nbytes]} | {"array": [offset, nbytes], "dtype", "shape"}
+KV_MAGIC = b"RDBKV\0\0\0"
+KV_FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+_ARRAY_KINDS = "iuf"      # chỉ mảng số (input_ids / scores)
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def encode_state(state) -> bytes:
+    import numpy as np
+
+    fields: Dict[str, Dict] = {}
+    blobs: List[bytes] = []
+    pos = 0
+    for name, value in vars(state).items():
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, bytes, bytearray, list, np.ndarray)):
+            raise SnapshotError(f"field {name} kiểu {type(value).__name__} không lưu được")
+        if isinstance(value, int):
+            fields[name] = {"int": value}
+            continue
+        if isinstance(value, (bytes, bytearray)):
+            data, entry = bytes(value), {}
+        else:
+            arr = np.ascontiguousarray(value)
+            if arr.dtype.kind not in _ARRAY_KINDS:
+                raise SnapshotError(f"field {name} dtype {arr.dtype} không lưu được")
+            data, entry = arr.tobytes(), {"dtype": arr.dtype.str, "shape": list(arr.shape), "list": isinstance(value, list)}
+        entry["array" if "dtype" in entry else "bytes"] = [pos, len(data)]
+        fields[name] = entry
+        blobs.append(data)
+        pos += len(data)
+    header = json.dumps({"byteorder": sys.byteorder, "fields": fields}).encode("utf-8")
+    return _PREAMBLE.pack(KV_MAGIC, KV_FORMAT_VERSION, len(header)) + header + b"".join(blobs)
+
+
+def decode_state(data: bytes) -> Dict[str, object]:
+    # -> field của state (caller dựng lại đúng lớp state của llm)
+    import numpy as np
+
+    if len(data) < _PREAMBLE.size:
+        raise SnapshotError("file snapshot cụt")
+    magic, version, header_len = _PREAMBLE.unpack_from(data, 0)
+    if magic != KV_MAGIC:
+        raise SnapshotError("không phải snapshot KV")
+    if version != KV_FORMAT_VERSION:
+        raise SnapshotError(f"snapshot KV version {version} != {KV_FORMAT_VERSION}")
+    start = _PREAMBLE.size + header_len
+    header = json.loads(data[_PREAMBLE.size:start].decode("utf-8"))
+    if header.get("byteorder") != sys.byteorder:
+        raise SnapshotError("snapshot KV khác byteorder")
+    body = memoryview(data)[start:]
+
+    def section(span) -> memoryview:
+        off, n = (int(x) for x in span)
+        if off < 0 or n < 0 or off + n > len(body):
+            raise SnapshotError("section nằm ngoài file (file ghi dở?)")
+        return body[off:off + n]
+
+    out: Dict[str, object] = {}
+    for name, entry in header["fields"].items():
+        if "int" in entry:
+            out[name] = int(entry["int"])
+        elif "bytes" in entry:
+            out[name] = bytes(section(entry["bytes"]))
+        else:
+            dtype = np.dtype(entry["dtype"])
+            if dtype.kind not in _ARRAY_KINDS:
+                raise SnapshotError(f"dtype {dtype} không hợp lệ")
+            arr = np.frombuffer(section(entry["array"]), dtype=dtype).reshape(entry["shape"]).copy()
+            out[name] = arr.tolist() if entry.get("list") else arr
+    return out
+
+
+def _new_state(llm, fields: Dict[str, object]):
+    # Dựng lại state cùng lớp với llm.save_state() (StubState cho StubLlama, LlamaState cho llama-cpp)
+    from raspdbot_llm import StubLlama, StubState
+
+    if isinstance(llm, StubLlama):
+        return StubState(fields["input_ids"], fields.get("scores"))
+    from llama_cpp import LlamaState
+
+    params = inspect.signature(LlamaState).parameters
+    missing = [p for p in params if p not in fields and params[p].default is inspect.Parameter.empty]
+    if missing:
+        raise SnapshotError(f"snapshot thiếu field {', '.join(missing)}")
+    return LlamaState(**{k: v for k, v in fields.items() if k in params})
+
+
+def stable_prefix_tokens(llm, prefix: str, continuations: Sequence[str]) -> List[int]:
+    # Token ở ranh giới prefix có thể bị gộp với phần theo sau (vd "\n" + "\n###"),
+    # nên chỉ lấy phần token chung của prefix + mọi continuation thực tế.
+    seqs = [llm.tokenize((prefix + c).encode("utf-8"), special=True) for c in continuations]
+    common = list(seqs[0])
+    for seq in seqs[1:]:
+        n = 0
+        for a, b in zip(common, seq):
+            if a != b:
+                break
+            n += 1
+        common = common[:n]
+    return common
+
+
+def prefix_state_path(model_path: str, n_ctx: int, tokens: Sequence[int], kv_type: str = "f16"):
+    # kv_type: snapshot KV f16 không nạp được vào context q8_0 (chế độ ngân sách RAM đổi kiểu KV theo RAM trống)
+    sig = file_signature(model_path)
+    parts = [os.path.abspath(model_path), str(sig["size"]), str(sig["mtime_ns"]), str(n_ctx)]
+    if kv_type != "f16":
+        parts.append(kv_type)
+    key = short_hash(*parts, ",".join(map(str, tokens)))
+    return cache_path("kv", f"{os.path.basename(model_path)}-{key}.rdbkv")
+
+
+def prime_prefix(llm, model_path: str, prefix: str, continuations: Sequence[str]):
+    """
+    Đưa KV cache của `llm` về trạng thái "đã prefill prefix" và trả về LlamaState
+    để load lại sau reset(). Ưu tiên snapshot trên đĩa; không có thì eval rồi lưu.
+    """
+    tokens = stable_prefix_tokens(llm, prefix, continuations)
+    if not tokens:
+        return None
+    path = prefix_state_path(model_path, llm.n_ctx(), tokens, llm_kv_type(llm))
+
+    if path.exists():
+        state = load_prefix_state(llm, path)
+        if state is not None:
+            return state
+
+    llm.reset()
+    llm.eval(tokens)
+    state = llm.save_state()
+    # Chỉ giữ logits của token cuối: load_state() broadcast lại cho cả mảng,
+    # tránh file snapshot nặng n_tokens * n_vocab * 4 byte.
+    if getattr(state.scores, "ndim", 0) == 2:
+        state.scores = state.scores[-1:, :].copy()
+    try:
+        atomic_write_bytes(path, encode_state(state))
+    except (OSError, SnapshotError) as e:
+        print(f"[WARN] Không lưu được snapshot KV {path.name}: {e}")
+    return state
+
+
+def load_prefix_state(llm, path: Path):
+    # Snapshot hỏng / khác phiên bản / llama từ chối -> None (caller prefill lại và ghi đè)
+    try:
+        state = _new_state(llm, decode_state(path.read_bytes()))
+        llm.load_state(state)
+        return state
+    except (OSError, ValueError, KeyError, TypeError, struct.error, RuntimeError) as e:
+        print(f"[WARN] Bỏ qua snapshot KV {path.name} ({e}), prefill lại system prompt.")
+        return None
+
+
+def restore_prefix(llm, state: Optional[object]) -> bool:
+    if state is None:
+        return False
+    llm.load_state(state)
+    return True
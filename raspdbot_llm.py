@@ -0,0 +1,343 @@
+import os
+import re
+import time
+import zlib
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+try:
+    from llama_cpp import Llama
+except ImportError:  # cho phép chạy stub / benchmark khi chưa cài llama-cpp-python
+    Llama = None
+try:
+    import numpy as np     # llama-cpp-python kéo theo numpy; draft model phải trả về ndarray
+except ImportError:
+    np = None
+
+from raspdbot_memory import MIN_CTX, memory_budget, plan_kwargs, plan_memory
+from raspdbot_tune import llama_kwargs, load_profile
+
+# =========================
+# Tạo Llama dùng chung cho engine / CLI / benchmark
+# =========================
+def create_llm(
+    model_path: str,
+    n_ctx: int = 2048,
+    n_threads: Optional[int] = None,
+    n_gpu_layers: int = 0,
+    lookup_tokens: Optional[int] = None,
+    profile: bool = True,
+    memory_budget_bytes: Optional[int] = None,
+    min_ctx: Optional[int] = None,
+    **kwargs,
+):
+    # lookup_tokens > 0 -> bật prompt-lookup decoding (None = theo RASPDBOT_LOOKUP_TOKENS)
+    # profile: nạp params đã tune cho model + máy này (raspdbot_tune.py); tham số truyền vào được ưu tiên
+    # memory_budget_bytes: ngân sách RAM (None = theo RASPDBOT_MEM_BUDGET_MB, 0 = tắt) -> n_ctx tối đa
+    #   là `n_ctx`, kiểu KV cache và mmap/mlock do raspdbot_memory.plan_memory chọn cho vừa
+    # min_ctx: n_ctx nhỏ nhất caller chấp nhận khi plan giảm context (prompt dài nhất + max_tokens)
+    if Llama is None:
+        raise RuntimeError("Chưa cài llama-cpp-python (pip install -r requirements.txt)")
+    params = load_profile(model_path) if profile else {}
+    budget = memory_budget() if memory_budget_bytes is None else memory_budget_bytes
+    plan = None
+    if budget and not kwargs.get("embedding"):
+        try:
+            n_batch = int(kwargs.get("n_batch") or params.get("n_batch") or 512)
+            plan = plan_memory(
+                model_path, budget, n_ctx, n_batch=n_batch,
+                min_ctx=min(min_ctx or MIN_CTX, n_ctx), shrink_batch="n_batch" not in kwargs,
+            )
+        except (OSError, ValueError):
+            plan = None     # không đọc được metadata -> nạp như cũ
+    if plan is not None:
+        n_ctx = plan["n_ctx"]
+        params = plan_kwargs(plan, params)
+    tuned = llama_kwargs(params)
+    if kwargs.get("embedding"):
+        # Embedding cần n_batch >= độ dài input; KV cache không dùng tới -> chỉ lấy số thread
+        tuned = {k: v for k, v in tuned.items() if k in ("n_threads", "n_threads_batch")}
+    for key, value in tuned.items():
+        if key != "n_threads":
+            kwargs.setdefault(key, value)
+    draft = make_lookup_draft(lookup_tokens)
+    if draft is not None:
+        kwargs.setdefault("draft_model", draft)
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=n_ctx,
+        n_threads=n_threads or tuned.get("n_threads") or (os.cpu_count() or 4),
+        n_gpu_layers=n_gpu_layers,
+        verbose=False,
+        **kwargs,
+    )
+    llm.memory_plan = plan      # raspdbot_memory.memory_stats / UI hiển thị cấu hình đã chọn
+    return llm
+
+
+# =========================
+# Prompt-lookup decoding (draft n-gram, không cần model phụ)
+# =========================
+# Câu trả lời thường chép lại đoạn "Đáp:" trong context: lấy n-gram cuối của
+# dãy token, tìm lần xuất hiện gần nhất trong LOOKUP_WINDOW token trước đó và
+# đề xuất các token đi sau nó làm nháp. Llama kiểm tra cả nháp trong một lần
+# eval và giữ phần khớp, nên đoán trúng thì nhiều token chỉ tốn một bước decode.
+LOOKUP_TOKENS = int(os.environ.get("RASPDBOT_LOOKUP_TOKENS", "0"))    # số token nháp mỗi bước; 0 = tắt
+LOOKUP_NGRAM = int(os.environ.get("RASPDBOT_LOOKUP_NGRAM", "3"))      # n-gram dài nhất dùng để tìm
+LOOKUP_WINDOW = int(os.environ.get("RASPDBOT_LOOKUP_WINDOW", "1024"))  # chỉ tìm trong N token cuối
+
+
+class PromptLookupDraft:
+    """
+    Draft model cho Llama(draft_model=...): __call__(input_ids) -> token nháp.
+    Tự đếm số token đã đề xuất / được chấp nhận (so nháp lần trước với các
+    token thật ở lần gọi sau); stats() để ghi metrics, reset_stats() mỗi lượt.
+    """
+
+    def __init__(self, num_pred_tokens: int = 8, max_ngram_size: int = LOOKUP_NGRAM, window: int = LOOKUP_WINDOW):
+        self.num_pred_tokens = num_pred_tokens
+        self.max_ngram_size = max(1, max_ngram_size)
+        self.window = window
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.steps = 0
+        self.proposed = 0
+        self.accepted = 0
+        self._last_pos = -1
+        self._last_draft: List[int] = []
+
+    def stats(self) -> Dict[str, float]:
+        if not self.steps:
+            return {}
+        return {
+            "lookup_steps": self.steps,
+            "lookup_proposed": self.proposed,
+            "lookup_accepted": self.accepted,
+            "lookup_accept_rate": round(self.accepted / self.proposed, 4) if self.proposed else 0.0,
+        }
+
+    def draft(self, ids: List[int]) -> List[int]:
+        n = len(ids)
+        for size in range(min(self.max_ngram_size, n - 1), 0, -1):
+            tail = ids[n - size:]
+            first = tail[0]
+            # Lần xuất hiện gần nhất (trước chính nó) còn token đi sau
+            for start in range(n - size - 1, -1, -1):
+                if ids[start] == first and ids[start:start + size] == tail:
+                    end = start + size
+                    return ids[end:min(end + self.num_pred_tokens, n)]
+        return []
+
+    def __call__(self, input_ids, **kwargs):
+        n = len(input_ids)
+        # Nháp của lần trước: đếm phần đầu khớp với token thật vừa sinh
+        if self._last_draft and n > self._last_pos:
+            for a, b in zip(self._last_draft, input_ids[self._last_pos:]):
+                if a != int(b):
+                    break
+                self.accepted += 1
+        lo = max(0, n - self.window) if self.window > 0 else 0
+        out = self.draft([int(t) for t in input_ids[lo:]])
+        self.steps += 1
+        self.proposed += len(out)
+        self._last_pos, self._last_draft = n, out
+        return np.array(out, dtype=np.intc) if np is not None else out
+
+
+def make_lookup_draft(
+    lookup_tokens: Optional[int] = None,
+    ngram: int = LOOKUP_NGRAM,
+    window: int = LOOKUP_WINDOW,
+) -> Optional[PromptLookupDraft]:
+    n = LOOKUP_TOKENS if lookup_tokens is None else lookup_tokens
+    return PromptLookupDraft(n, ngram, window) if n > 0 else None
+
+
+def lookup_stats(llm, reset: bool = False) -> Dict[str, float]:
+    draft = getattr(llm, "draft_model", None)
+    if not isinstance(draft, PromptLookupDraft):
+        return {}
+    out = draft.stats()
+    if reset:
+        draft.reset_stats()
+    return out
+
+
+# =========================
+# Stub Llama: tất định, không cần model (CI / benchmark)
+# =========================
+_PIECE_RE = re.compile(r"\s+|[^\s]+", re.UNICODE)
+_ANSWER_RE = re.compile(r"Đáp: (.+)")
+
+
+class StubState:
+    def __init__(self, input_ids: List[int], scores=None):
+        self.input_ids = list(input_ids)
+        self.n_tokens = len(self.input_ids)
+        self.scores = scores
+
+
+class StubLlama:
+    """
+    Giả lập API llama-cpp đủ cho engine / JSONL bot / benchmark:
+    tokenize, detokenize, eval, save/load_state, __call__ (có stream), embed.
+    draft_model (vd PromptLookupDraft): token nháp khớp không tốn thêm bước decode.
+    Câu trả lời = câu "Đáp:" đầu tiên trong prompt (nếu có) hoặc câu mẫu
+    theo hash câu hỏi. Thời gian prefill/decode giả lập theo token/s và
+    chỉ tính cho phần token không trùng prefix với lần gọi trước (như KV cache thật).
+    """
+
+    def __init__(
+        self,
+        n_ctx: int = 2048,
+        prefill_tps: float = 0.0,
+        decode_tps: float = 0.0,
+        vocab_size: int = 32000,
+        embedding_dim: int = 64,
+        draft_model=None,
+    ):
+        self._n_ctx = n_ctx
+        self.draft_model = draft_model
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+        self.vocab_size = vocab_size
+        self.embedding_dim = embedding_dim
+        self._pieces: Dict[int, str] = {}
+        self.input_ids: List[int] = []
+        self.last_reused_tokens = 0
+
+    # ---- tokenizer ----
+    def _piece_id(self, piece: str) -> int:
+        tid = 1 + zlib.crc32(piece.encode("utf-8")) % (self.vocab_size - 1)
+        self._pieces.setdefault(tid, piece)
+        return tid
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        ids = [self._piece_id(p) for p in _PIECE_RE.findall(text.decode("utf-8", errors="ignore"))]
+        return ([0] if add_bos else []) + ids
+
+    def detokenize(self, tokens: Sequence[int], prev_tokens=None, special: bool = False) -> bytes:
+        return "".join(self._pieces.get(t, "") for t in tokens).encode("utf-8")
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.input_ids)
+
+    # ---- KV state ----
+    def reset(self):
+        self.input_ids = []
+
+    def eval(self, tokens: Sequence[int]):
+        self._prefill(list(self.input_ids) + list(tokens))
+
+    def save_state(self) -> StubState:
+        return StubState(self.input_ids)
+
+    def load_state(self, state: StubState):
+        self.input_ids = list(state.input_ids)
+
+    def close(self):
+        self.input_ids = []
+
+    def _prefill(self, tokens: List[int]):
+        n = 0
+        for a, b in zip(self.input_ids, tokens[:-1]):
+            if a != b:
+                break
+            n += 1
+        self.last_reused_tokens = n
+        if self.prefill_tps > 0:
+            time.sleep((len(tokens) - n) / self.prefill_tps)
+        self.input_ids = list(tokens)
+
+    # ---- generate ----
+    def _answer_for(self, prompt: str) -> str:
+        # Chỉ xét lượt hiện tại (sau câu trả lời trước) khi prompt là cả hội thoại
+        turns = prompt.split("### Assistant:\n")
+        if len(turns) > 2:
+            prompt = turns[-2]
+        m = _ANSWER_RE.search(prompt)
+        if m:
+            return m.group(1).strip()
+        users = prompt.split("### User:\n")
+        question = users[-1].split("\n")[0] if len(users) > 1 else prompt[-80:]
+        seed = zlib.crc32(question.encode("utf-8"))
+        return (
+            f"Tôi trả lời mẫu số {seed % 97} cho câu hỏi này: hãy kiểm tra cấu hình, "
+            "nguồn điện và log của RaspDbot trước khi thử lại."
+        )
+
+    def create_completion(
+        self,
+        prompt: Union[str, List[int]],
+        max_tokens: int = 16,
+        stop: Optional[Union[str, List[str]]] = None,
+        stream: bool = False,
+        **kwargs,
+    ):
+        if isinstance(prompt, str):
+            prompt_tokens = self.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+            prompt_text = prompt
+        else:
+            prompt_tokens = list(prompt)
+            prompt_text = self.detokenize(prompt_tokens).decode("utf-8")
+        pieces = _PIECE_RE.findall(self._answer_for(prompt_text))[: max_tokens or None]
+        stops = [stop] if isinstance(stop, str) else list(stop or [])
+        gen = self._stream(prompt_tokens, pieces, stops, kwargs.get("stopping_criteria"))
+        if stream:
+            return gen
+        text = "".join(c["choices"][0]["text"] for c in gen)
+        return {
+            "choices": [{"text": text, "index": 0, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": len(prompt_tokens),
+                "completion_tokens": len(_PIECE_RE.findall(text)),
+                "total_tokens": len(prompt_tokens) + len(_PIECE_RE.findall(text)),
+            },
+        }
+
+    __call__ = create_completion
+
+    def _stream(self, prompt_tokens: List[int], pieces: List[str], stops: List[str], stopping_criteria=None) -> Iterator[Dict]:
+        self._prefill(prompt_tokens)
+        text = ""
+        free = 0     # số token nháp đã được chấp nhận, chưa phát ra
+        for i, piece in enumerate(pieces):
+            if free:
+                free -= 1
+            else:
+                # Một bước decode; có draft_model thì phần nháp khớp đi kèm miễn phí
+                if self.draft_model is not None:
+                    upcoming = [self._piece_id(p) for p in pieces[i + 1:]]
+                    for a, b in zip(self.draft_model(self.input_ids + [self._piece_id(piece)]), upcoming):
+                        if int(a) != b:
+                            break
+                        free += 1
+                if self.decode_tps > 0:
+                    time.sleep(1.0 / self.decode_tps)
+            text += piece
+            if any(s in text for s in stops):
+                break
+            self.input_ids.append(self._piece_id(piece))
+            yield {"choices": [{"text": piece, "index": 0, "finish_reason": None}]}
+            # Như llama-cpp: hook được gọi sau mỗi token
+            if stopping_criteria is not None and stopping_criteria(self.input_ids, None):
+                break
+
+    # ---- embedding ----
+    def embed(self, input: Union[str, List[str]], normalize: bool = True, truncate: bool = True):
+        texts = [input] if isinstance(input, str) else list(input)
+        out = []
+        for t in texts:
+            v = [0.0] * self.embedding_dim
+            for p in _PIECE_RE.findall(t.lower()):
+                if p.strip():
+                    v[zlib.crc32(p.encode("utf-8")) % self.embedding_dim] += 1.0
+            if normalize:
+                norm = sum(x * x for x in v) ** 0.5 or 1.0
+                v = [x / norm for x in v]
+            out.append(v)
+        return out[0] if isinstance(input, str) else out
@@ -0,0 +1,404 @@
+import argparse
+import ctypes
+import gc
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from raspdbot_cache import file_signature
+
+# =========================
+# Ngân sách RAM: ước lượng footprint từ metadata GGUF trước khi nạp
+# =========================
+# RAM của một engine ~ trọng số (file GGUF, mmap) + KV cache + compute buffer:
+#   KV     = n_ctx * n_layer * n_head_kv * (key_length + value_length) * byte/phần tử
+#   compute ~ n_batch * 4 * (max(n_vocab, n_ctx * n_head) + 4 * n_embd) + COMPUTE_BASE_BYTES
+#            (logits hoặc ma trận KQ, cái nào lớn hơn; KQ không có khi bật flash attention)
+# RASPDBOT_MEM_BUDGET_MB=<MB> | auto (MemAvailable lúc nạp trừ AUTO_RESERVE_BYTES)
+# bật chế độ ngân sách: create_llm chọn n_ctx (giảm dần một nửa tới MIN_CTX),
+# n_batch (một nửa, tới MIN_BATCH: buffer compute tỉ lệ với n_batch, prefill trên
+# CPU gần như không chậm đi) và kiểu KV (f16 -> q8_0, hết cách mới q4_0) vừa
+# ngân sách; trọng số luôn mmap
+# (trang sạch, kernel thu hồi được thay vì đẩy ra swap), mlock chỉ khi còn dư
+# và RLIMIT_MEMLOCK cho phép. Không đặt -> giữ nguyên cấu hình như trước.
+MEM_BUDGET_ENV = "RASPDBOT_MEM_BUDGET_MB"
+MIB = 1024 * 1024
+MIN_CTX = 512
+DEFAULT_N_CTX = 2048
+DEFAULT_N_BATCH = 512
+MIN_BATCH = 128
+COMPUTE_BASE_BYTES = 32 * MIB
+AUTO_RESERVE_BYTES = 384 * MIB     # GTK + Python + page cache tối thiểu
+MLOCK_HEADROOM = 0.8               # chỉ mlock khi tổng <= 80% ngân sách
+# Byte / phần tử của KV cache theo kiểu ggml (q8_0: 34 byte / 32 phần tử, q4_0: 18 / 32)
+KV_BYTES = {"f32": 4.0, "f16": 2.0, "bf16": 2.0, "q8_0": 34 / 32, "q4_0": 18 / 32}
+GGML_TYPE_NAMES = {0: "f32", 1: "f16", 2: "q4_0", 8: "q8_0", 30: "bf16"}
+
+
+# =========================
+# Đọc metadata GGUF (chỉ header, không nạp tensor)
+# =========================
+GGUF_MAGIC = b"GGUF"
+_SCALARS = {
+    0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i",
+    6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d",
+}
+_STRING, _ARRAY = 8, 9
+_META_CACHE: Dict[Tuple[str, int, int], Dict] = {}
+
+
+class _Reader:
+    def __init__(self, buf, pos: int = 0):
+        self.buf = buf
+        self.pos = pos
+
+    def scalar(self, fmt: str):
+        v = struct.unpack_from(fmt, self.buf, self.pos)[0]
+        self.pos += struct.calcsize(fmt)
+        return v
+
+    def string(self) -> str:
+        n = self.scalar("<Q")
+        s = bytes(self.buf[self.pos:self.pos + n]).decode("utf-8", errors="replace")
+        self.pos += n
+        return s
+
+    def value(self, vtype: int, keep_array: bool):
+        if vtype in _SCALARS:
+            return self.scalar(_SCALARS[vtype])
+        if vtype == _STRING:
+            return self.string()
+        if vtype == _ARRAY:
+            etype, n = self.scalar("<I"), self.scalar("<Q")
+            if not keep_array:
+                self.skip_array(etype, n)
+                return n          # mảng lớn (vocab, merges): chỉ cần số phần tử
+            return [self.value(etype, True) for _ in range(n)]
+        raise ValueError(f"GGUF: kiểu giá trị không hỗ trợ {vtype}")
+
+    def skip_array(self, etype: int, n: int):
+        if etype in _SCALARS:
+            self.pos += struct.calcsize(_SCALARS[etype]) * n
+        elif etype == _STRING:
+            for _ in range(n):
+                self.pos += 8 + struct.unpack_from("<Q", self.buf, self.pos)[0]
+        else:
+            for _ in range(n):
+                self.value(etype, False)
+
+
+def gguf_metadata(model_path: str) -> Dict:
+    """
+    Các khoá metadata cần cho ước lượng bộ nhớ (general.*, <arch>.*), mảng
+    tokenizer chỉ lấy độ dài. Dừng đọc khi đã đủ khoá của kiến trúc.
+    """
+    path = os.path.abspath(model_path)
+    sig = file_signature(path)
+    key = (path, sig["size"], sig["mtime_ns"])
+    cached = _META_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        meta = _read_metadata(mm)
+    except (struct.error, ValueError) as e:
+        raise ValueError(f"Không đọc được metadata GGUF: {model_path} ({e})") from e
+    finally:
+        mm.close()
+    _META_CACHE[key] = meta
+    return meta
+
+
+def _read_metadata(mm) -> Dict:
+    r = _Reader(mm)
+    if bytes(mm[:4]) != GGUF_MAGIC:
+        raise ValueError("thiếu magic GGUF")
+    version = r.scalar("<xxxxI")
+    if version < 2:
+        raise ValueError(f"GGUF v{version} quá cũ")
+    n_tensors, n_kv = r.scalar("<Q"), r.scalar("<Q")
+    meta: Dict = {"gguf.version": version, "gguf.tensor_count": n_tensors}
+    for _ in range(n_kv):
+        k = r.string()
+        vtype = r.scalar("<I")
+        # head_count / head_count_kv có thể là mảng theo từng layer -> giữ nguyên
+        meta[k] = r.value(vtype, keep_array=k.endswith("head_count_kv") or k.endswith("head_count"))
+        arch = meta.get("general.architecture")
+        if arch and f"{arch}.block_count" in meta and "tokenizer.ggml.tokens" in meta:
+            break       # phần còn lại (merges, scores...) không cần cho ước lượng
+    return meta
+
+
+def _per_layer(value, n_layer: int) -> List[int]:
+    if isinstance(value, list):
+        return [int(v) for v in value] or [0] * n_layer
+    return [int(value)] * n_layer
+
+
+def model_shape(meta: Dict) -> Dict[str, int]:
+    arch = meta.get("general.architecture", "llama")
+    g = lambda name, default=None: meta.get(f"{arch}.{name}", default)
+    n_layer = int(g("block_count", 0))
+    n_embd = int(g("embedding_length", 0))
+    heads = _per_layer(g("attention.head_count", 1), n_layer)
+    heads_kv = _per_layer(g("attention.head_count_kv", g("attention.head_count", 1)), n_layer)
+    head_dim = n_embd // max(1, max(heads))
+    return {
+        "n_layer": n_layer,
+        "n_embd": n_embd,
+        "n_head": max(heads),
+        "kv_heads_total": sum(heads_kv),          # tổng head KV qua mọi layer
+        "key_length": int(g("attention.key_length", head_dim)),
+        "value_length": int(g("attention.value_length", head_dim)),
+        "n_ctx_train": int(g("context_length", 0)),
+        "n_vocab": int(g("vocab_size", meta.get("tokenizer.ggml.tokens", 32000))),
+    }
+
+
+def kv_bytes_per_token(shape: Dict[str, int], kv_type: str = "f16") -> float:
+    per = KV_BYTES.get(kv_type, 2.0)
+    return shape["kv_heads_total"] * (shape["key_length"] + shape["value_length"]) * per
+
+
+def compute_bytes(shape: Dict[str, int], n_ctx: int, n_batch: int = DEFAULT_N_BATCH, flash_attn: bool = False) -> int:
+    # Bộ cấp phát graph dùng lại buffer: chỉ tensor lớn nhất (logits hoặc KQ) tính một lần
+    widest = shape["n_vocab"] if flash_attn else max(shape["n_vocab"], n_ctx * shape["n_head"])
+    return int(4 * n_batch * (widest + 4 * shape["n_embd"]) + COMPUTE_BASE_BYTES)
+
+
+def estimate(
+    model_path: str, n_ctx: int = DEFAULT_N_CTX, kv_type: str = "f16", n_batch: int = DEFAULT_N_BATCH
+) -> Dict:
+    # -> {"weights", "kv", "compute", "total"} (byte)
+    shape = model_shape(gguf_metadata(model_path))
+    n_ctx = min(n_ctx, shape["n_ctx_train"]) if shape["n_ctx_train"] else n_ctx
+    weights = os.path.getsize(model_path)
+    kv = int(kv_bytes_per_token(shape, kv_type) * n_ctx)
+    compute = compute_bytes(shape, n_ctx, n_batch, flash_attn=kv_type != "f16")
+    return {
+        "n_ctx": n_ctx, "kv_type": kv_type,
+        "weights": weights, "kv": kv, "compute": compute, "total": weights + kv + compute,
+    }
+
+
+# =========================
+# Ngân sách + chọn cấu hình
+# =========================
+def meminfo() -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                parts = rest.split()
+                if parts:
+                    out[key] = int(parts[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return out
+
+
+def memory_budget() -> int:
+    # Byte; 0 = không bật chế độ ngân sách
+    env = os.environ.get(MEM_BUDGET_ENV, "").strip().lower()
+    if not env or env in ("0", "off", "no", "false"):
+        return 0
+    if env == "auto":
+        avail = meminfo().get("MemAvailable", 0)
+        return max(0, avail - AUTO_RESERVE_BYTES)
+    return int(float(env) * MIB)
+
+
+def _mlock_allowed(nbytes: int) -> bool:
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    except (ImportError, ValueError, OSError):
+        return False
+    return soft == resource.RLIM_INFINITY or soft >= nbytes
+
+
+def _halvings(start: int, stop: int) -> List[int]:
+    # start, start/2, ... rồi đúng `stop` nếu bước chia đôi nhảy qua nó
+    out = []
+    while start >= stop:
+        out.append(start)
+        start //= 2
+    if not out or out[-1] > stop:
+        out.append(stop)
+    return out
+
+
+def plan_memory(
+    model_path: str,
+    budget: int,
+    n_ctx: int = DEFAULT_N_CTX,
+    n_batch: int = DEFAULT_N_BATCH,
+    min_ctx: int = MIN_CTX,
+    shrink_batch: bool = True,
+) -> Dict:
+    """
+    Cấu hình lớn nhất vừa `budget` byte: n_ctx giảm một nửa mỗi bước (tới
+    min_ctx); mỗi mức thử (n_batch, n_batch/2...) x KV (f16, q8_0); không mức
+    nào vừa thì thử q4_0. shrink_batch=False: giữ nguyên n_batch (caller chỉ định).
+    -> estimate() của cấu hình chọn + "n_batch", "fits", "budget", "use_mmap", "use_mlock".
+    Không cấu hình nào vừa (trọng số quá lớn) -> cấu hình nhỏ nhất, fits=False.
+    """
+    contexts = _halvings(n_ctx, min_ctx)
+    batches = _halvings(n_batch, min(MIN_BATCH, n_batch)) if shrink_batch else [n_batch]
+    candidates = [(c, b, kv) for c in contexts for b in batches for kv in ("f16", "q8_0")]
+    candidates += [(c, batches[-1], "q4_0") for c in contexts]
+
+    chosen = None
+    for c, b, kv in candidates:
+        est = estimate(model_path, c, kv, b)
+        if est["total"] <= budget:
+            chosen = dict(est, n_batch=b, fits=True)
+            break
+    if chosen is None:
+        c, b, kv = candidates[-1]
+        chosen = dict(estimate(model_path, c, kv, b), n_batch=b, fits=False)
+    chosen["budget"] = budget
+    chosen["use_mmap"] = True
+    chosen["use_mlock"] = bool(
+        chosen["fits"] and chosen["total"] <= budget * MLOCK_HEADROOM and _mlock_allowed(chosen["weights"])
+    )
+    return chosen
+
+
+def plan_kwargs(plan: Dict, profile: Optional[Dict] = None) -> Dict:
+    # Plan -> params dạng profile của raspdbot_tune (llama_kwargs() đổi kv_type ra type_k/type_v).
+    # Profile đã tune chọn KV nhỏ hơn plan (vì nhanh hơn) thì giữ: càng nhỏ càng vừa ngân sách.
+    kv = plan["kv_type"]
+    tuned_kv = (profile or {}).get("kv_type", "f16")
+    if KV_BYTES.get(tuned_kv, 2.0) < KV_BYTES.get(kv, 2.0):
+        kv = tuned_kv
+    out = dict(profile or {}, kv_type=kv, use_mmap=plan["use_mmap"], use_mlock=plan["use_mlock"])
+    out["n_batch"] = min(plan["n_batch"], out.get("n_batch", plan["n_batch"]))
+    return out
+
+
+def engine_bytes(model_path: str, n_ctx: int = DEFAULT_N_CTX) -> int:
+    # Cho EnginePool: theo plan khi bật ngân sách, không thì cấu hình mặc định (f16)
+    budget = memory_budget()
+    if budget:
+        return plan_memory(model_path, budget, n_ctx)["total"]
+    return estimate(model_path, n_ctx)["total"]
+
+
+# =========================
+# Đo khi đang chạy: RSS + KV cache
+# =========================
+def rss_bytes() -> int:
+    # RSS hiện tại (gồm trang mmap của model đã chạm tới)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def llm_kv_type(llm) -> str:
+    # Kiểu KV cache của context đang chạy ("f16", "q8_0", hoặc "q8_0/f16" khi K và V khác nhau)
+    params = getattr(llm, "context_params", None)
+    types = [getattr(params, attr, None) for attr in ("type_k", "type_v")]
+    names = [GGML_TYPE_NAMES.get(1 if t is None else int(t), "f16") for t in types]
+    return names[0] if names[0] == names[1] else "/".join(names)
+
+
+def memory_stats(llm) -> Dict:
+    # {"rss_mb"} + {"kv_mb", "kv_used_mb", "kv_type", "n_ctx"} nếu đọc được metadata của model
+    out: Dict = {"rss_mb": round(rss_bytes() / MIB, 1)}
+    plan = getattr(llm, "memory_plan", None)
+    if plan:
+        out["mem_budget_mb"] = round(plan["budget"] / MIB)
+        out["mem_plan_mb"] = round(plan["total"] / MIB)
+    path = getattr(llm, "model_path", None)
+    if not path or not os.path.exists(path):
+        return out
+    try:
+        shape = model_shape(gguf_metadata(path))
+    except (OSError, ValueError):
+        return out
+    kv_type = llm_kv_type(llm)
+    per = sum(kv_bytes_per_token(shape, t) for t in kv_type.split("/")) / len(kv_type.split("/"))
+    n_ctx = llm.n_ctx()
+    out.update({
+        "kv_type": kv_type,
+        "n_ctx": n_ctx,
+        "kv_mb": round(per * n_ctx / MIB, 1),
+        "kv_used_mb": round(per * getattr(llm, "n_tokens", 0) / MIB, 1),
+    })
+    return out
+
+
+def format_memory(stats: Dict) -> str:
+    # "RAM 1830 MB · KV 12/48 MB (q8_0, ctx 1536)"
+    parts = []
+    if stats.get("rss_mb"):
+        parts.append(f"RAM {stats['rss_mb']:.0f} MB")
+    if "kv_mb" in stats:
+        parts.append(f"KV {stats['kv_used_mb']:.0f}/{stats['kv_mb']:.0f} MB ({stats['kv_type']}, ctx {stats['n_ctx']})")
+    return " · ".join(parts)
+
+
+def format_plan(plan: Optional[Dict]) -> str:
+    # Thông báo khi nạp: "ctx 1536 · KV q8_0 · ước lượng 1790/2048 MB"
+    if not plan:
+        return ""
+    text = f"ctx {plan['n_ctx']} · batch {plan['n_batch']} · KV {plan['kv_type']} · ước lượng {plan['total'] / MIB:.0f}/{plan['budget'] / MIB:.0f} MB"
+    return text if plan["fits"] else text + " (vượt ngân sách)"
+
+
+def release_memory():
+    # Sau khi đóng engine: thu gom chu trình tham chiếu còn giữ model rồi trả heap trống về OS
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+# =========================
+# CLI: xem metadata / footprint / cấu hình chọn theo ngân sách
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Ước lượng RAM của model GGUF và cấu hình vừa ngân sách.")
+    ap.add_argument("models", nargs="+")
+    ap.add_argument("--budget-mb", default="", help=f"ngân sách (MB hoặc auto); mặc định ${MEM_BUDGET_ENV}")
+    ap.add_argument("--n-ctx", type=int, default=DEFAULT_N_CTX)
+    ap.add_argument("--n-batch", type=int, default=DEFAULT_N_BATCH)
+    args = ap.parse_args()
+
+    if args.budget_mb:
+        os.environ[MEM_BUDGET_ENV] = args.budget_mb
+    budget = memory_budget()
+    info = meminfo()
+    print(
+        f"RAM: tổng {info.get('MemTotal', 0) / MIB:.0f} MB, còn {info.get('MemAvailable', 0) / MIB:.0f} MB, "
+        f"ngân sách {budget / MIB:.0f} MB" if budget else "ngân sách: tắt"
+    )
+    for model in args.models:
+        shape = model_shape(gguf_metadata(model))
+        print(f"== {Path(model).name}: {shape}")
+        for kv in ("f16", "q8_0", "q4_0"):
+            e = estimate(model, args.n_ctx, kv, args.n_batch)
+            print(
+                f"  ctx {e['n_ctx']:5d} KV {kv:5s}: trọng số {e['weights'] / MIB:7.0f} + KV {e['kv'] / MIB:6.0f} "
+                f"+ compute {e['compute'] / MIB:5.0f} = {e['total'] / MIB:7.0f} MB"
+            )
+        if budget:
+            p = plan_memory(model, budget, args.n_ctx, args.n_batch)
+            state = "vừa" if p["fits"] else "KHÔNG vừa"
+            print(
+                f"  -> n_ctx {p['n_ctx']}, n_batch {p['n_batch']}, KV {p['kv_type']}, mmap={p['use_mmap']} mlock={p['use_mlock']}: "
+                f"{p['total'] / MIB:.0f}/{budget / MIB:.0f} MB ({state})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Dict, Optional
+
+from raspdbot_cache import STATE_DIR
+from raspdbot_llm import lookup_stats
+
+# =========================
+# Đo thời gian từng giai đoạn của một lượt hỏi
+# =========================
+DEFAULT_LOG_PATH = STATE_DIR / "metrics.jsonl"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+
+def metrics_enabled(default: bool = False, env_name: str = "RASPDBOT_METRICS") -> bool:
+    # RASPDBOT_METRICS=1/0 ghi đè mặc định của từng entry point
+    env = os.environ.get(env_name)
+    if env is None:
+        return default
+    return env.strip().lower() not in ("", "0", "false", "no", "off")
+
+
+class TurnMetrics:
+    """
+    Thời gian (time.perf_counter, monotonic) + số token của một lượt.
+    stage("retrieval") là context manager; mark_first_token() đánh dấu TTFT.
+    """
+
+    enabled = True
+
+    def __init__(self, source: str):
+        self.source = source
+        self.t0 = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.fields: Dict[str, object] = {}
+        self.t_first_token: Optional[float] = None
+        self.t_end: Optional[float] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def mark_first_token(self):
+        if self.t_first_token is None:
+            self.t_first_token = time.perf_counter()
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def finish(self) -> Dict:
+        if self.t_end is None:
+            self.t_end = time.perf_counter()
+        rec = {
+            "ts": time.time(),
+            "source": self.source,
+            "total_ms": round(1000 * (self.t_end - self.t0), 3),
+            "stages_ms": {k: round(1000 * v, 3) for k, v in self.stages.items()},
+        }
+        if self.t_first_token is not None:
+            rec["ttft_ms"] = round(1000 * (self.t_first_token - self.t0), 3)
+            decode_s = self.t_end - self.t_first_token
+            n = int(self.fields.get("completion_tokens", 0) or 0)
+            if decode_s > 0 and n > 1:
+                rec["decode_tok_s"] = round((n - 1) / decode_s, 2)
+        rec.update(self.fields)
+        return rec
+
+
+class NullTurnMetrics:
+    # Khi tắt metrics: mọi lời gọi đều là no-op, không gọi perf_counter
+    enabled = False
+    _null = nullcontext()
+
+    def stage(self, name: str):
+        return self._null
+
+    def add_stage(self, name: str, seconds: float):
+        pass
+
+    def mark_first_token(self):
+        pass
+
+    def set(self, **fields):
+        pass
+
+    def finish(self) -> Dict:
+        return {}
+
+
+NULL_TURN = NullTurnMetrics()
+
+
+class MetricsLogger:
+    """
+    start_turn() -> TurnMetrics (hoặc NULL_TURN khi tắt); log(turn) ghi một
+    dòng JSON vào file có rotation (RotatingFileHandler).
+    path=None -> chỉ giữ kết quả trong bộ nhớ (last), không ghi file.
+    """
+
+    def __init__(self, enabled: bool = True, path: Optional[Path] = DEFAULT_LOG_PATH):
+        self.enabled = enabled
+        self.path = Path(path) if path else None
+        self.last: Dict = {}
+        self._logger: Optional[logging.Logger] = None
+        if enabled and self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            logger = logging.getLogger(f"raspdbot.metrics.{self.path}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            if not logger.handlers:
+                handler = RotatingFileHandler(
+                    self.path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+            self._logger = logger
+
+    def start_turn(self, source: str):
+        return TurnMetrics(source) if self.enabled else NULL_TURN
+
+    def log(self, turn) -> Dict:
+        if not turn.enabled:
+            return {}
+        return self.write(turn.finish())
+
+    def write(self, rec: Dict) -> Dict:
+        # Ghi một bản ghi tuỳ ý (vd quyết định tier của JSONL bot)
+        if not self.enabled:
+            return {}
+        self.last = rec
+        if self._logger is not None:
+            self._logger.info(json.dumps(rec, ensure_ascii=False, default=str))
+        return rec
+
+
+DISABLED = MetricsLogger(enabled=False, path=None)
+
+
+def format_summary(rec: Dict) -> str:
+    # Dòng ngắn cho status bar: "TTFT 1.2s · 8.4 tok/s"
+    if not rec:
+        return ""
+    parts = []
+    if "ttft_ms" in rec:
+        parts.append(f"TTFT {rec['ttft_ms'] / 1000:.1f}s")
+    if "decode_tok_s" in rec:
+        parts.append(f"{rec['decode_tok_s']:.1f} tok/s")
+    if "lookup_accept_rate" in rec:
+        parts.append(f"lookup {rec['lookup_accept_rate']:.0%}")
+    if rec.get("prompt_tokens") and "prefix_reused_tokens" in rec:
+        parts.append(f"reuse {rec['prefix_reused_tokens']}/{rec['prompt_tokens']}")
+    if rec.get("rss_mb"):
+        parts.append(f"RAM {rec['rss_mb']:.0f} MB")
+    if "kv_mb" in rec:
+        parts.append(f"KV {rec['kv_used_mb']:.0f}/{rec['kv_mb']:.0f} MB")
+    route = rec.get("route")
+    if route and route != "llm":
+        parts.append(str(route))
+    if not parts:
+        parts.append(f"{rec.get('total_ms', 0) / 1000:.2f}s")
+    return " · ".join(parts)
+
+
+def llama_perf(llm) -> Dict[str, float]:
+    # Số liệu prefill/decode do llama.cpp tự đo (không có thì bỏ qua)
+    # + tỉ lệ chấp nhận token nháp khi bật prompt-lookup decoding
+    out = lookup_stats(llm)
+    try:
+        import llama_cpp
+
+        data = llama_cpp.llama_perf_context(llm._ctx.ctx)
+        out.update({
+            "prompt_eval_ms": round(data.t_p_eval_ms, 3),
+            "prompt_eval_tokens": int(data.n_p_eval),
+            "eval_ms": round(data.t_eval_ms, 3),
+            "eval_tokens": int(data.n_eval),
+        })
+    except Exception:
+        pass
+    return out
+
+
+def llama_perf_reset(llm):
+    lookup_stats(llm, reset=True)
+    try:
+        import llama_cpp
+
+        llama_cpp.llama_perf_context_reset(llm._ctx.ctx)
+    except Exception:
+        pass
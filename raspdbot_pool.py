@@ -0,0 +1,260 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from raspdbot_memory import engine_bytes, memory_budget, release_memory
+
+# =========================
+# Pool engine: giữ nhiều model "nóng" trong RAM, evict theo LRU
+# =========================
+DEFAULT_KV_BYTES = 256 * 1024 * 1024   # ước lượng thô cho KV cache + buffer (file không đọc được metadata)
+
+
+def total_ram_bytes() -> int:
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 4 * 1024 * 1024 * 1024
+
+
+def default_ram_budget() -> int:
+    # RASPDBOT_POOL_RAM_MB > ngân sách RAM (RASPDBOT_MEM_BUDGET_MB) > 60% RAM
+    env = os.environ.get("RASPDBOT_POOL_RAM_MB")
+    if env:
+        return int(float(env) * 1024 * 1024)
+    return memory_budget() or int(total_ram_bytes() * 0.6)
+
+
+def estimate_engine_bytes(model_path: str) -> int:
+    # Trọng số GGUF (mmap) + KV cache + compute buffer theo metadata của model
+    try:
+        return engine_bytes(model_path)
+    except (OSError, ValueError):
+        pass
+    try:
+        size = os.path.getsize(model_path)
+    except OSError:
+        size = 0
+    return size + DEFAULT_KV_BYTES
+
+
+class EnginePool:
+    """
+    get(model_path) trả engine đã nạp (nạp nếu chưa có), đánh dấu mới dùng.
+    Trước khi nạp model mới, đóng engine ít dùng nhất cho tới khi phần còn
+    lại + ước lượng của model mới vừa `ram_budget` (hai model không cùng
+    nằm trong RAM rồi mới evict); sau khi nạp vẫn kiểm lại ngân sách
+    (không bao giờ đóng engine vừa được get()). Nạp lỗi sau khi đã evict thì
+    nạp lại engine vừa bị đóng gần nhất để người dùng không bị mất model.
+    preload(model_path) nạp sẵn ở thread nền nếu còn đủ ngân sách; ước lượng
+    được giữ chỗ ngay khi nhận việc nên nhiều preload cùng lúc không vượt ngân sách.
+    on_evict(model_path, engine) chạy trước khi đóng engine bị evict (vd lưu history).
+    Mỗi engine giữ history riêng nên đổi model không lẫn lịch sử.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], object],
+        ram_budget: Optional[int] = None,
+        estimate: Callable[[str], int] = estimate_engine_bytes,
+        on_evict: Optional[Callable[[str, object], None]] = None,
+    ):
+        self.factory = factory
+        self.on_evict = on_evict
+        self.ram_budget = ram_budget if ram_budget is not None else default_ram_budget()
+        self.estimate = estimate
+        self._engines: "OrderedDict[str, object]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._reserved: Dict[str, int] = {}     # preload đã nhận nhưng chưa nạp xong
+        self._loading: Dict[str, threading.Event] = {}
+        self._usage: List[str] = []
+        self._lock = threading.Lock()
+
+    def __contains__(self, model_path: str) -> bool:
+        with self._lock:
+            return model_path in self._engines
+
+    def resident(self) -> List[str]:
+        with self._lock:
+            return list(self._engines)
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def peek(self, model_path: str) -> Optional[object]:
+        # Engine đang nạp sẵn (không nạp, không đánh dấu mới dùng)
+        with self._lock:
+            return self._engines.get(model_path)
+
+    def would_evict(self, model_path: str) -> List[str]:
+        # Các model mà get(model_path) sẽ phải đóng để lấy chỗ
+        with self._lock:
+            if model_path in self._engines:
+                return []
+            return self._victims(self.estimate(model_path))
+
+    def get(self, model_path: str) -> object:
+        engine = self._acquire(model_path)
+        with self._lock:
+            self._engines.move_to_end(model_path)
+            if model_path in self._usage:
+                self._usage.remove(model_path)
+            self._usage.append(model_path)
+        self._evict_to_budget(keep=model_path)
+        return engine
+
+    def preload(self, model_path: Optional[str]):
+        if not model_path:
+            return
+        with self._lock:
+            if model_path in self._engines or model_path in self._loading or model_path in self._reserved:
+                return
+            need = self.estimate(model_path)
+            if self._used() + need > self.ram_budget:
+                return
+            self._reserved[model_path] = need
+
+        def run():
+            try:
+                self._acquire(model_path, mru=False)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._reserved.pop(model_path, None)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def predict_next(self, current: str, candidates: Sequence[str]) -> Optional[str]:
+        # Ưu tiên model dùng gần nhất trước model hiện tại (hay chuyển qua lại),
+        # không có thì model kế tiếp trong danh sách.
+        with self._lock:
+            for path in reversed(self._usage):
+                if path != current and path in candidates:
+                    return path
+        if current in candidates and len(candidates) > 1:
+            return candidates[(list(candidates).index(current) + 1) % len(candidates)]
+        return None
+
+    def _acquire(self, model_path: str, mru: bool = True) -> object:
+        while True:
+            with self._lock:
+                engine = self._engines.get(model_path)
+                if engine is not None:
+                    return engine
+                event = self._loading.get(model_path)
+                if event is None:
+                    event = self._loading[model_path] = threading.Event()
+                    break
+            # Đang có thread khác nạp đúng model này -> đợi rồi thử lại
+            event.wait()
+
+        evicted = self._make_room(model_path) if mru else []
+        try:
+            engine = self.factory(model_path)
+        except Exception:
+            with self._lock:
+                self._loading.pop(model_path).set()
+            self._restore(evicted)
+            raise
+
+        with self._lock:
+            self._engines[model_path] = engine
+            if not mru:
+                self._engines.move_to_end(model_path, last=False)
+            self._sizes[model_path] = self.estimate(model_path)
+            self._reserved.pop(model_path, None)
+            self._loading.pop(model_path).set()
+        return engine
+
+    def _used(self) -> int:
+        # Gọi khi đang giữ lock: engine đã nạp + phần preload đang giữ chỗ
+        return sum(self._sizes.values()) + sum(self._reserved.values())
+
+    def _victims(self, need: int) -> List[str]:
+        # Gọi khi đang giữ lock: model LRU ít nhất cần đóng để `need` byte vừa ngân sách
+        used = self._used()
+        paths = []
+        for path in self._engines:
+            if used + need <= self.ram_budget:
+                break
+            paths.append(path)
+            used -= self._sizes.get(path, 0)
+        return paths
+
+    def _make_room(self, model_path: str) -> List[str]:
+        # Evict LRU trước khi nạp: trọng số + KV của engine cũ được trả lại trước khi model mới chiếm RAM
+        need = self.estimate(model_path)
+        with self._lock:
+            paths = self._victims(need)
+            victims = [(p, self._engines.pop(p)) for p in paths]
+            for path in paths:
+                self._sizes.pop(path, None)
+        self._close(victims)
+        return paths
+
+    def _restore(self, evicted: Sequence[str]):
+        # Model mới nạp lỗi: nạp lại model vừa bị đóng gần nhất (thường là model đang dùng)
+        if not evicted:
+            return
+        try:
+            self._acquire(evicted[-1])
+        except Exception:
+            pass
+
+    def _evict_to_budget(self, keep: str):
+        victims = []
+        with self._lock:
+            while sum(self._sizes.values()) > self.ram_budget and len(self._engines) > 1:
+                path = next(p for p in self._engines if p != keep)
+                victims.append((path, self._engines.pop(path)))
+                self._sizes.pop(path, None)
+        self._close(victims)
+
+    def discard(self, model_path: str):
+        with self._lock:
+            engine = self._engines.pop(model_path, None)
+            self._sizes.pop(model_path, None)
+        if engine is not None:
+            self._close([(model_path, engine)])
+
+    def close(self):
+        with self._lock:
+            engines = list(self._engines.items())
+            self._engines.clear()
+            self._sizes.clear()
+        self._close(engines)
+
+    def _close(self, victims: Sequence[Tuple[str, object]]):
+        # Lưu (on_evict) trước khi đóng: engine đã đóng thì history chỉ còn trong RAM
+        if self.on_evict is not None:
+            for path, engine in victims:
+                try:
+                    self.on_evict(path, engine)
+                except Exception:
+                    pass
+        close_engines([engine for _, engine in victims])
+
+
+def close_engine(engine: object):
+    close = getattr(engine, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def close_engines(engines: Sequence[object]):
+    # Đóng rồi mới thu gom: Llama giữ con trỏ C, chỉ giải phóng hẳn khi hết tham chiếu
+    if not engines:
+        return
+    for engine in engines:
+        close_engine(engine)
+    release_memory()
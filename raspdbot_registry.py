@@ -0,0 +1,260 @@
+import argparse
+import fnmatch
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from raspdbot_corpus import CompiledCorpus, load_corpus
+
+# =========================
+# Registry nhiều corpus JSONL + retrieval gộp
+# =========================
+# Mỗi nguồn: {"name", "path", "models": ["*star*"]} — model (tên file .gguf,
+# không đuôi) khớp pattern nào thì dùng nguồn đó; không nguồn nào khớp -> dùng
+# tất cả. Mặc định là 2 dataset đi kèm; RASPDBOT_CORPORA trỏ tới file JSON
+# (list các nguồn như trên) để thay.
+# Score BM25 của mỗi corpus đã chuẩn hoá về [0, 1] nên top-k các corpus gộp
+# thẳng được. Corpus lớn (>= PARALLEL_MIN_DOCS tài liệu) được chia shard theo
+# dải doc id (mỗi worker một shard) và chấm song song trên process pool: mỗi
+# worker tự mmap file compile sẵn (dùng chung page cache), chỉ câu hỏi và top-k
+# đi qua IPC. Máy 1 core thì không bật pool (IPC chỉ làm chậm thêm).
+PROJECT_DIR = Path(__file__).resolve().parent
+CORPORA_ENV = "RASPDBOT_CORPORA"
+DEFAULT_SOURCES = [
+    {"name": "star", "path": str(PROJECT_DIR / "raspDbot_star_training.jsonl"), "models": ["*star*"]},
+    {"name": "car", "path": str(PROJECT_DIR / "raspdbot_car_dataset_clean.jsonl"), "models": ["*car*"]},
+]
+PARALLEL_MIN_DOCS = int(os.environ.get("RASPDBOT_PARALLEL_MIN_DOCS", "20000"))
+MAX_WORKERS = min(4, len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1)
+
+
+def load_sources(path: Optional[str] = None) -> List[Dict]:
+    path = path or os.environ.get(CORPORA_ENV)
+    if not path:
+        return [dict(s) for s in DEFAULT_SOURCES]
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    base = Path(path).resolve().parent
+    sources = []
+    for i, s in enumerate(data):
+        src = Path(s["path"])
+        sources.append({
+            "name": str(s.get("name") or src.stem or i),
+            "path": str(src if src.is_absolute() else base / src),
+            "models": [str(p) for p in s.get("models", [])],
+        })
+    return sources
+
+
+# ---- chạy trong process worker ----
+_WORKER_CORPORA: Dict[str, CompiledCorpus] = {}
+
+
+def _score_shard(compiled_path: str, source_sha256: str, query: str, k: int, start: int, stop: int) -> List[Tuple[float, int]]:
+    # Worker chỉ chấm đúng bản corpus parent đang dùng (cùng sha256 của JSONL nguồn):
+    # file compile đã bị ghi đè bằng bản khác -> từ chối, doc id của hai bản không khớp nhau
+    corpus = _WORKER_CORPORA.get(compiled_path)
+    if corpus is None or corpus.source_sha256 != source_sha256:
+        corpus = CompiledCorpus(Path(compiled_path))
+        _WORKER_CORPORA[compiled_path] = corpus
+    if corpus.source_sha256 != source_sha256:
+        raise ValueError(f"{compiled_path}: corpus đã đổi (sha256 {corpus.source_sha256[:12]} != {source_sha256[:12]})")
+    return corpus.index.search(query, k, docs=[range(start, stop)])
+
+
+class MultiCorpusRetriever:
+    """
+    Gộp nhiều CompiledCorpus thành một retriever: doc id toàn cục = offset của
+    corpus + doc id trong corpus; qa_pairs / source_of() tra ngược lại.
+    """
+
+    def __init__(
+        self,
+        corpora: Sequence[Tuple[str, CompiledCorpus]],
+        parallel_min_docs: int = PARALLEL_MIN_DOCS,
+        pool: Optional[ProcessPoolExecutor] = None,
+        workers: int = MAX_WORKERS,
+    ):
+        self.names = [name for name, _ in corpora]
+        self.corpora = [c for _, c in corpora]
+        self.offsets = [0]
+        for c in self.corpora:
+            self.offsets.append(self.offsets[-1] + len(c))
+        self.parallel_min_docs = parallel_min_docs
+        self.workers = workers
+        self.pool = pool
+        self.qa_pairs = _ConcatPairs(self)
+
+    def __len__(self) -> int:
+        return self.offsets[-1]
+
+    @property
+    def parallel(self) -> bool:
+        return self.pool is not None and len(self) >= self.parallel_min_docs
+
+    def shards(self) -> List[Tuple[int, range]]:
+        # (corpus idx, dải doc id) — chỉ corpus đủ lớn mới bị chia nhỏ
+        out = []
+        for ci, c in enumerate(self.corpora):
+            n = len(c)
+            step = -(-n // self.workers) if n >= self.parallel_min_docs else max(n, 1)
+            out.extend((ci, range(lo, min(n, lo + step))) for lo in range(0, n, step))
+        return out
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, int]]:
+        hits: List[Tuple[float, int]] = []
+        if self.parallel:
+            futures = [
+                (ci, r, self.pool.submit(
+                    _score_shard, str(self.corpora[ci].path), self.corpora[ci].source_sha256, query, k, r.start, r.stop
+                ))
+                for ci, r in self.shards()
+            ]
+            for ci, r, fut in futures:
+                try:
+                    shard = fut.result()
+                except ValueError:
+                    # Worker không còn mở được đúng bản corpus -> chấm shard này trên mmap của parent
+                    shard = self.corpora[ci].index.search(query, k, docs=[r])
+                hits.extend((s, self.offsets[ci] + doc) for s, doc in shard)
+        else:
+            for ci, c in enumerate(self.corpora):
+                hits.extend((s, self.offsets[ci] + doc) for s, doc in c.index.search(query, k))
+        return heapq.nlargest(k, hits, key=lambda x: x[0])
+
+    def locate(self, doc: int) -> Tuple[int, int]:
+        # doc id toàn cục -> (corpus idx, doc id trong corpus)
+        lo, hi = 0, len(self.corpora)
+        while lo < hi - 1:
+            mid = (lo + hi) // 2
+            if self.offsets[mid] <= doc:
+                lo = mid
+            else:
+                hi = mid
+        return lo, doc - self.offsets[lo]
+
+    def source_of(self, doc: int) -> str:
+        return self.names[self.locate(doc)[0]]
+
+    def top_k(self, query: str, k: int = 5) -> List[Tuple[float, str, str, str]]:
+        # [(score, câu hỏi, câu trả lời, tên nguồn)]
+        out = []
+        for s, doc in self.search(query, k):
+            ci, local = self.locate(doc)
+            q, a = self.corpora[ci].qa_pairs[local]
+            out.append((s, q, a, self.names[ci]))
+        return out
+
+
+class _ConcatPairs(Sequence):
+    def __init__(self, retriever: MultiCorpusRetriever):
+        self.retriever = retriever
+
+    def __len__(self) -> int:
+        return len(self.retriever)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        ci, local = self.retriever.locate(i)
+        return self.retriever.corpora[ci].qa_pairs[local]
+
+
+class CorpusRegistry:
+    """
+    retriever_for(model_path) -> MultiCorpusRetriever của các nguồn ứng với
+    model (cache theo tập nguồn). Process pool chỉ tạo khi có corpus đủ lớn.
+    """
+
+    def __init__(self, sources: Optional[List[Dict]] = None, parallel_min_docs: int = PARALLEL_MIN_DOCS):
+        self.sources = sources if sources is not None else load_sources()
+        self.parallel_min_docs = parallel_min_docs
+        self._corpora: Dict[str, CompiledCorpus] = {}
+        self._retrievers: Dict[Tuple[str, ...], MultiCorpusRetriever] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()   # GTK tạo engine trên nhiều thread nền
+
+    def sources_for(self, model_path: str) -> List[Dict]:
+        stem = Path(model_path).stem.lower()
+        available = [s for s in self.sources if os.path.exists(s["path"])]
+        matched = [s for s in available if any(fnmatch.fnmatch(stem, p.lower()) for p in s["models"])]
+        return matched or available
+
+    def corpus(self, source: Dict) -> CompiledCorpus:
+        c = self._corpora.get(source["name"])
+        if c is None or not c.is_fresh(source["path"]):
+            c = load_corpus(source["path"])
+            self._corpora[source["name"]] = c
+        return c
+
+    def retriever_for(self, model_path: str) -> Optional[MultiCorpusRetriever]:
+        sources = self.sources_for(model_path)
+        if not sources:
+            return None
+        with self._lock:
+            corpora = [(s["name"], self.corpus(s)) for s in sources]
+            key = tuple(f"{name}:{c.source_sha256}" for name, c in corpora)
+            r = self._retrievers.get(key)
+            if r is None:
+                big = sum(len(c) for _, c in corpora) >= self.parallel_min_docs
+                pool = self._get_pool() if big and MAX_WORKERS > 1 else None
+                r = MultiCorpusRetriever(corpora, self.parallel_min_docs, pool=pool)
+                self._retrievers[key] = r
+            return r
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # forkserver: worker không kế thừa thread / model của process chính (GTK, llama)
+        if self._pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._pool = ProcessPoolExecutor(MAX_WORKERS, mp_context=multiprocessing.get_context(method))
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+# =========================
+# CLI: xem nguồn của một model / đo song song vs tuần tự
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Registry corpus: nguồn theo model, đo chấm điểm song song.")
+    ap.add_argument("--model", default="raspdbot.gguf", help="tên file model để chọn nguồn")
+    ap.add_argument("--query", action="append", help="câu hỏi thử (mặc định: câu hỏi trong dataset)")
+    ap.add_argument("--limit", type=int, default=200)
+    ap.add_argument("--parallel-min-docs", type=int, default=PARALLEL_MIN_DOCS)
+    args = ap.parse_args()
+
+    registry = CorpusRegistry(parallel_min_docs=args.parallel_min_docs)
+    try:
+        sources = registry.sources_for(args.model)
+        print(f"{args.model}: " + ", ".join(f"{s['name']} ({s['path']})" for s in sources))
+        r = registry.retriever_for(args.model)
+        if r is None:
+            return
+        print(f"{len(r)} Q/A, {len(r.shards())} shard, song song: {r.parallel}")
+        queries = args.query or [r.qa_pairs[i][0] for i in range(0, len(r), max(1, len(r) // args.limit))]
+        for mode in ("tuần tự", "song song"):
+            if mode == "song song" and not r.parallel:
+                break
+            pool, r.pool = r.pool, (r.pool if mode == "song song" else None)
+            r.search(queries[0])       # warm-up (mở mmap trong worker)
+            t0 = time.perf_counter()
+            top1 = sum(1 for q in queries for _, doc in r.search(q, 1) if r.qa_pairs[doc][0] == q)
+            dt = time.perf_counter() - t0
+            r.pool = pool
+            print(f"  {mode:9s}: {1000 * dt / len(queries):7.2f} ms/câu, top-1 đúng {top1}/{len(queries)}")
+        for s, q, a, name in r.top_k(queries[0], 3):
+            print(f"  {s:.2f} [{name}] {q[:70]}")
+    finally:
+        registry.close()
+
+
+if __name__ == "__main__":
+    main()
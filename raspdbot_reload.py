@@ -0,0 +1,336 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from raspdbot_cache import short_hash
+from raspdbot_corpus import (
+    CompiledCorpus,
+    FacetedRetriever,
+    compile_corpus,
+    compiled_path_for,
+    load_corpus,
+    parse_jsonl_lines,
+    qa_records,
+)
+from raspdbot_retrieval import BM25Scorer, Retriever, tokenize_document
+
+# =========================
+# Corpus "sống": theo dõi file JSONL, nạp thêm Q/A không cần restart
+# =========================
+# - Ghi thêm vào cuối file -> chỉ đọc phần byte mới từ offset đã đọc, index
+#   thêm vào một delta (postings append-only) xếp chồng lên corpus compile sẵn.
+# - File bị cắt ngắn / ghi lại (inode đổi, đoạn cuối đã đọc bị sửa) -> compile lại.
+# - Delta quá lớn -> compile lại trong thread theo dõi (gộp vào file mmap).
+# Mỗi lần nạp tạo một CorpusSnapshot mới rồi gán một phát (self.snapshot = ...):
+# lượt hỏi đang chạy giữ snapshot cũ, không bao giờ phải chờ lock.
+RELOAD_INTERVAL = float(os.environ.get("RASPDBOT_RELOAD_INTERVAL", "2.0"))  # 0 = tắt
+TAIL_CHECK_BYTES = 4096       # đoạn cuối đã đọc, dùng để phát hiện file bị ghi lại
+COMPACT_MIN_DOCS = 2000       # delta >= max(COMPACT_MIN_DOCS, COMPACT_RATIO * base) -> compile lại
+COMPACT_RATIO = 0.25
+
+
+class StackedBM25Index(BM25Scorer):
+    """
+    BM25 trên corpus compile sẵn + các Q/A ghi thêm (doc id nối tiếp sau base).
+    Postings / norm của delta là list dùng chung, chỉ append; mỗi snapshot
+    chỉ đọc doc id < n_docs của nó nên không cần copy.
+    """
+
+    def __init__(self, base: CompiledCorpus, postings: Dict[str, Tuple[List[int], List[int]]], norm: array, n_docs: int):
+        self.base = base.index
+        self.k1 = self.base.k1
+        self.b = self.base.b
+        self._n_base = len(base)
+        self._postings = postings
+        self._norm = norm
+        self._n_docs = n_docs
+
+    @property
+    def n_docs(self) -> int:
+        return self._n_docs
+
+    @property
+    def n_indexed(self) -> int:
+        # Q/A ghi thêm chưa qua dedup nên đều có postings
+        return self.base.n_indexed + self._n_docs - self._n_base
+
+    def _lookup(self, term: str):
+        # Chỉ dùng khi cần một danh sách liền (copy postings base); search() đi qua _segments()
+        segments = self._segments(term)
+        if len(segments) < 2:
+            return segments[0] if segments else None
+        return [d for docs, _ in segments for d in docs], [t for _, tfs in segments for t in tfs]
+
+    def _segments(self, term: str):
+        # Postings base (memoryview trên mmap) và delta chấm riêng từng đoạn, không copy base
+        plist = self.base._lookup(term)
+        segments = [plist] if plist else []
+        delta = self._postings.get(term)
+        if delta is not None:
+            docs, tfs = delta
+            hi = bisect_left(docs, self._n_docs)
+            if hi:
+                segments.append((docs[:hi], tfs[:hi]))
+        return segments
+
+    def _length_norm(self) -> Sequence[float]:
+        return self._norm
+
+    def term_domains(self, query: str):
+        # Đoán domain theo thống kê của corpus gốc
+        return self.base.term_domains(query)
+
+
+class StackedPairs(Sequence):
+    def __init__(self, base: Sequence[Tuple[str, str]], delta: List[Tuple[str, str]], n_delta: int):
+        self.base = base
+        self.delta = delta
+        self._n_base = len(base)
+        self._n = self._n_base + n_delta
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        if i < self._n_base:
+            return self.base[i]
+        return self.delta[i - self._n_base]
+
+
+class CorpusSnapshot:
+    # Bất biến sau khi tạo; fingerprint đổi mỗi khi nội dung đổi (bind answer cache)
+    def __init__(self, base: CompiledCorpus, qa_pairs: Sequence[Tuple[str, str]], retriever: Retriever, fingerprint: str, n_delta: int = 0):
+        self.base = base
+        self.qa_pairs = qa_pairs
+        self.retriever = retriever
+        self.fingerprint = fingerprint
+        self.n_delta = n_delta
+
+    def __len__(self) -> int:
+        return len(self.qa_pairs)
+
+
+class LiveCorpus:
+    """
+    build_retriever(corpus) -> retriever của corpus compile sẵn (bm25 / dense / hybrid).
+    incremental=False (dense / hybrid: delta chưa có embedding) -> mọi thay đổi đều compile lại.
+    on_reload(rec) nhận {"mode", "added", "n_docs", "ms", ...} sau mỗi lần nạp.
+    """
+
+    def __init__(
+        self,
+        jsonl_path: str,
+        build_retriever: Callable[[CompiledCorpus], Retriever],
+        incremental: bool = True,
+        on_reload: Optional[Callable[[Dict], None]] = None,
+    ):
+        self.jsonl_path = jsonl_path
+        self.build_retriever = build_retriever
+        self.incremental = incremental
+        self.on_reload = on_reload
+        self.last_reload: Dict = {}
+        self._lock = threading.Lock()    # chỉ để các lần poll() không chạy chồng nhau
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        with self._lock:
+            self._reset(load_corpus(jsonl_path))
+
+    # ---- trạng thái gốc (sau mỗi lần compile) ----
+    def _reset(self, base: CompiledCorpus):
+        h = base.header
+        self._base = base
+        self._base_retriever = self.build_retriever(base)
+        self._offset = h["source_size"]
+        self._sig = (h["source_size"], h["source_mtime_ns"])
+        self._inode = os.stat(self.jsonl_path).st_ino
+        self._tail = self._read(max(0, self._offset - TAIL_CHECK_BYTES), self._offset)
+        self._line_no = self._count_lines(self._offset)   # chỉ để cảnh báo đúng số dòng
+        self._delta_hash = hashlib.sha256()
+        self._pairs: List[Tuple[str, str]] = []
+        self._postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._norm = array("d")
+        self._norm.frombytes(base._section("norm").tobytes())
+        self._domain_docs: Dict[str, List[range]] = {d: [r] for d, r in base.domain_ranges.items()}
+        n_indexed = h.get("n_indexed", len(base))
+        avgdl = (h["total_len"] / n_indexed) if n_indexed else 1.0
+        self._avgdl = avgdl or 1.0
+        self.snapshot = CorpusSnapshot(base, base.qa_pairs, self._base_retriever, base.source_sha256)
+
+    def _count_lines(self, end: int) -> int:
+        n = 0
+        with open(self.jsonl_path, "rb") as f:
+            while f.tell() < end:
+                chunk = f.read(min(1 << 20, end - f.tell()))
+                if not chunk:
+                    break
+                n += chunk.count(b"\n")
+        return n
+
+    def _read(self, start: int, end: int) -> bytes:
+        with open(self.jsonl_path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    # ---- theo dõi file ----
+    def start(self, interval: float = RELOAD_INTERVAL):
+        if interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._watch, args=(interval,), name="raspdbot-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[WARN] Nạp lại {self.jsonl_path} lỗi: {e}")
+
+    def poll(self) -> Optional[Dict]:
+        # Một lần kiểm tra; None nếu file không đổi
+        with self._lock:
+            try:
+                st = os.stat(self.jsonl_path)
+            except FileNotFoundError:
+                return None        # file đang được thay -> giữ corpus hiện tại
+            if (st.st_size, st.st_mtime_ns) == self._sig:
+                return None
+            t0 = time.perf_counter()
+            if self._is_append(st):
+                rec = self._append(st)
+            else:
+                rec = self._rebuild("rewrite")
+            if rec is None:
+                return None
+            n_delta = len(self._pairs)
+            if n_delta and n_delta >= max(COMPACT_MIN_DOCS, COMPACT_RATIO * len(self._base)):
+                rec = self._rebuild("compact")
+            rec["ms"] = round(1000 * (time.perf_counter() - t0), 3)
+            self.last_reload = rec
+        if self.on_reload is not None:
+            self.on_reload(rec)
+        return rec
+
+    def _is_append(self, st: os.stat_result) -> bool:
+        if not self.incremental or st.st_ino != self._inode or st.st_size < self._offset:
+            return False
+        return self._read(max(0, self._offset - len(self._tail)), self._offset) == self._tail
+
+    def _append(self, st: os.stat_result) -> Optional[Dict]:
+        data = self._read(self._offset, st.st_size)
+        self._sig = (st.st_size, st.st_mtime_ns)
+        # Dòng cuối chưa có '\n' (đang ghi dở) -> để lần sau
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return None
+        data = data[:end]
+        lines = data.splitlines(keepends=True)
+        _, pairs, metas = qa_records(parse_jsonl_lines(lines, self._offset, self._line_no + 1))
+        self._offset += end
+        self._line_no += len(lines)
+        self._tail = (self._tail + data)[-TAIL_CHECK_BYTES:]
+        self._delta_hash.update(data)
+
+        # Không dedup ở đây: bản gần trùng với Q/A cũ vẫn vào index (và chiếm chỗ
+        # trong top-k) tới lần compile lại kế tiếp (rewrite / compact)
+        n_base = len(self._base)
+        k1, b = self._base.index.k1, self._base.index.b
+        for (q, a), meta in zip(pairs, metas):
+            doc = n_base + len(self._pairs)
+            counts = Counter(tokenize_document(q))
+            for term, tf in counts.items():
+                docs, tfs = self._postings.setdefault(term, ([], []))
+                docs.append(doc)
+                tfs.append(tf)
+            # Độ dài chuẩn hoá theo avgdl của base (đủ gần; compile lại sẽ tính chính xác)
+            self._norm.append(k1 * (1.0 - b + b * sum(counts.values()) / self._avgdl))
+            self._pairs.append((q, a))
+            dom = meta["domain"]
+            if dom:
+                ranges = self._domain_docs.setdefault(dom, [])
+                if ranges and ranges[-1].stop == doc:
+                    ranges[-1] = range(ranges[-1].start, doc + 1)
+                else:
+                    ranges.append(range(doc, doc + 1))
+        if pairs:
+            self._publish()
+        return {"ts": time.time(), "mode": "append", "added": len(pairs), "n_docs": len(self.snapshot), "offset": self._offset}
+
+    def _publish(self):
+        n_delta = len(self._pairs)
+        index = StackedBM25Index(self._base, self._postings, self._norm, len(self._base) + n_delta)
+        if isinstance(self._base_retriever, FacetedRetriever):
+            r = self._base_retriever
+            domain_docs = {d: list(rs) for d, rs in self._domain_docs.items()}
+            retriever = FacetedRetriever(
+                self._base, r.min_purity, r.min_share, r.fallback_score, index=index, domain_docs=domain_docs
+            )
+        else:
+            retriever = index
+        fingerprint = short_hash(self._base.source_sha256, self._delta_hash.hexdigest())
+        self.snapshot = CorpusSnapshot(
+            self._base, StackedPairs(self._base.qa_pairs, self._pairs, n_delta), retriever, fingerprint, n_delta
+        )
+
+    def _rebuild(self, reason: str) -> Dict:
+        before = len(self.snapshot)
+        path = compiled_path_for(self.jsonl_path)
+        compile_corpus(self.jsonl_path, path)
+        self._reset(CompiledCorpus(path))
+        n = len(self.snapshot)
+        return {"ts": time.time(), "mode": reason, "added": n - before, "n_docs": n, "offset": self._offset}
+
+
+def format_reload(rec: Dict) -> str:
+    return (
+        f"[Reload] {rec['mode']}: {rec['added']:+d} Q/A, tổng {rec['n_docs']} "
+        f"({rec.get('ms', 0.0):.1f} ms)"
+    )
+
+
+# =========================
+# CLI: theo dõi một file, in mỗi lần nạp (thử nghiệm / đo độ trễ)
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Theo dõi file JSONL và nạp thêm Q/A khi file đổi.")
+    ap.add_argument("jsonl")
+    ap.add_argument("--interval", type=float, default=1.0)
+    ap.add_argument("--query", help="câu hỏi thử sau mỗi lần nạp")
+    args = ap.parse_args()
+
+    def on_reload(rec: Dict):
+        print(format_reload(rec))
+        if args.query:
+            snap = live.snapshot
+            for s, i in snap.retriever.search(args.query, 3):
+                print(f"  {s:.2f}  {snap.qa_pairs[i][0][:70]}")
+
+    live = LiveCorpus(args.jsonl, lambda c: FacetedRetriever(c) if c.domain_ranges else c.index, on_reload=on_reload)
+    print(f"{args.jsonl}: {len(live.snapshot)} Q/A, theo dõi mỗi {args.interval}s (Ctrl+C để thoát)")
+    live.start(args.interval)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        live.stop()
+
+
+if __name__ == "__main__":
+    main()
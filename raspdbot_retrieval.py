@@ -0,0 +1,243 @@
+import heapq
+import math
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Protocol, Sequence, Set, Tuple
+
+# =========================
+# Chuẩn hoá / tokenizer tiếng Việt
+# =========================
+def normalize(text: str) -> str:
+    text = text.lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    return text
+
+
+# Tiếng Việt viết tách âm tiết bằng dấu cách, từ ghép = nhiều âm tiết
+# ("tốc độ", "cảm biến"). Vì vậy index gồm:
+# - âm tiết giữ nguyên dấu        -> khớp chính xác
+# - âm tiết đã bỏ dấu ("~toc")    -> khớp khi người dùng gõ không dấu
+# - cặp âm tiết liền nhau bỏ dấu  -> giữ thứ tự / từ ghép ("~toc_do")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = {
+    "là", "của", "và", "thì", "mà", "được", "những", "các", "một", "này",
+    "đó", "với", "cho", "ở", "khi", "nào", "gì", "không", "có", "bị",
+    "như", "thế", "bao", "nhiêu", "sao", "nên", "để", "làm",
+    "bạn", "mình", "tôi",
+    "the", "a", "an", "of", "to", "is", "in", "and",
+}
+
+FOLD_PREFIX = "~"
+
+
+def fold_diacritics(text: str) -> str:
+    # "tốc độ" -> "toc do"
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.replace("đ", "d").replace("Đ", "D")
+
+
+def syllables(text: str) -> List[str]:
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return _WORD_RE.findall(text)
+
+
+def _bigrams(folded: List[str]) -> List[str]:
+    return [f"{FOLD_PREFIX}{a}_{b}" for a, b in zip(folded, folded[1:])]
+
+
+def tokenize_document(text: str) -> List[str]:
+    syl = syllables(text)
+    folded = [fold_diacritics(s) for s in syl]
+    tokens = [s for s in syl if s not in STOPWORDS]
+    tokens += [FOLD_PREFIX + f for s, f in zip(syl, folded) if s not in STOPWORDS]
+    tokens += _bigrams(folded)
+    return tokens
+
+
+def tokenize_query(text: str) -> List[str]:
+    # Âm tiết có dấu -> khớp chính xác; âm tiết không dấu (có thể người dùng
+    # gõ thiếu dấu) -> tra trong nhánh đã bỏ dấu.
+    syl = syllables(text)
+    folded = [fold_diacritics(s) for s in syl]
+    tokens = []
+    for s, f in zip(syl, folded):
+        if s in STOPWORDS:
+            continue
+        tokens.append(s if s != f else FOLD_PREFIX + f)
+    tokens += _bigrams(folded)
+    return tokens
+
+
+_FOLDED_STOPWORDS = {fold_diacritics(s) for s in STOPWORDS}
+
+
+def content_terms(text: str) -> Set[str]:
+    # Âm tiết đã bỏ dấu, trừ stopword (so cả dạng không dấu: "khong" = "không")
+    return {f for f in (fold_diacritics(s) for s in syllables(text)) if f not in _FOLDED_STOPWORDS}
+
+
+def coverage(query: str, text: str) -> float:
+    """
+    Độ phủ hai chiều giữa câu hỏi và câu khớp: min(phần term của query có
+    trong text, phần term của text có trong query). Score BM25 đã calibrate
+    chỉ so với chính query, nên query một-hai từ ("xe", "pin") khớp đủ mọi
+    term của một câu dài bất kỳ vẫn ra ~1.0; coverage thấp lộ ra chuyện đó.
+    """
+    q, t = content_terms(query), content_terms(text)
+    if not q or not t:
+        return 0.0
+    common = len(q & t)
+    return min(common / len(q), common / len(t))
+
+
+# =========================
+# BM25
+# =========================
+class Retriever(Protocol):
+    # Mọi backend (BM25, dense, hybrid...) đều trả về [(score 0..1, doc_id)]
+    def search(self, query: str, k: int = 5) -> List[Tuple[float, int]]: ...
+
+
+def calibrate(score: float, ideal: float) -> float:
+    if ideal <= 0.0:
+        return 0.0
+    return math.sqrt(min(1.0, score / ideal))
+
+
+class BM25Scorer(ABC):
+    """
+    Phần chấm điểm BM25 dùng chung (lớp trừu tượng). Lớp con phải cung cấp:
+    - n_docs, k1, b
+    - _lookup(term) -> (doc_ids, tfs) hoặc None
+    - _length_norm() -> k1 * (1 - b + b * dl / avgdl) theo từng tài liệu
+    search() trả về [(score, doc_id)] với score đã chuẩn hoá về [0, 1]:
+    chia cho điểm "lý tưởng" của chính câu hỏi (mọi term khớp đúng 1 lần
+    trong một tài liệu dài trung bình) rồi lấy căn bậc hai, để phân bố
+    gần với SequenceMatcher.ratio() và vẫn dùng được ngưỡng should_clarify().
+    """
+
+    k1 = 1.5
+    b = 0.75
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    @property
+    @abstractmethod
+    def n_docs(self) -> int:
+        ...
+
+    @abstractmethod
+    def _lookup(self, term: str) -> Optional[Tuple[Sequence[int], Sequence[int]]]:
+        ...
+
+    @abstractmethod
+    def _length_norm(self) -> Sequence[float]:
+        ...
+
+    def _segments(self, term: str) -> List[Tuple[Sequence[int], Sequence[int]]]:
+        # Postings của term dưới dạng các đoạn nối tiếp theo doc id; lớp con ghép
+        # nhiều nguồn (vd base mmap + delta) trả từng đoạn thay vì copy để nối
+        plist = self._lookup(term)
+        return [plist] if plist else []
+
+    @property
+    def n_indexed(self) -> int:
+        # Số tài liệu có postings (N của idf); corpus đã dedup thì ít hơn n_docs
+        return self.n_docs
+
+    def idf(self, df: int) -> float:
+        n = self.n_indexed
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def _query_terms(self, query: str) -> Set[str]:
+        # Lớp con index bằng tokenizer khác thì tách query tương ứng
+        return set(tokenize_query(query))
+
+    def search(self, query: str, k: int = 5, docs: Optional[Sequence[range]] = None) -> List[Tuple[float, int]]:
+        # docs: chỉ chấm các tài liệu trong các dải doc id này (vd một domain);
+        # idf / điểm lý tưởng vẫn tính trên cả corpus để score so sánh được
+        if not self.n_docs:
+            return []
+        norm = self._length_norm()
+        k1p = self.k1 + 1.0
+
+        scores: Dict[int, float] = {}
+        ideal = 0.0
+        for term in self._query_terms(query):
+            segments = self._segments(term)
+            idf = self.idf(sum(len(doc_ids) for doc_ids, _ in segments))
+            ideal += idf
+            spans = []
+            for doc_ids, tfs in segments:
+                if docs is None:
+                    spans.append(zip(doc_ids, tfs))
+                    continue
+                # postings sort theo doc id -> bisect lấy đúng đoạn của từng dải
+                for r in docs:
+                    lo = bisect_left(doc_ids, r.start)
+                    hi = bisect_left(doc_ids, r.stop, lo)
+                    spans.append(zip(doc_ids[lo:hi], tfs[lo:hi]))
+            for doc, tf in chain.from_iterable(spans):
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * k1p / (tf + norm[doc])
+
+        if not scores or ideal <= 0.0:
+            return []
+        top = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+        return [(calibrate(s, ideal), doc) for doc, s in top]
+
+
+class BM25Index(BM25Scorer):
+    """Inverted index + BM25 trong bộ nhớ, build từ danh sách câu hỏi."""
+
+    def __init__(self, texts: Iterable[str] = (), k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.doc_len: List[int] = []
+        self.total_len = 0
+        self._norm: Optional[List[float]] = None
+        for text in texts:
+            self.add(text)
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    def _doc_terms(self, text: str) -> List[str]:
+        return tokenize_document(text)
+
+    def add(self, text: str) -> int:
+        doc_id = len(self.doc_len)
+        counts = Counter(self._doc_terms(text))
+        for term, tf in counts.items():
+            docs, tfs = self.postings.setdefault(term, ([], []))
+            docs.append(doc_id)
+            tfs.append(tf)
+        n = sum(counts.values())
+        self.doc_len.append(n)
+        self.total_len += n
+        self._norm = None
+        return doc_id
+
+    def _lookup(self, term: str) -> Optional[Tuple[List[int], List[int]]]:
+        return self.postings.get(term)
+
+    def _length_norm(self) -> List[float]:
+        # tính một lần cho mỗi tài liệu, reset khi add()
+        if self._norm is None:
+            self._norm = length_norm(self.doc_len, self.total_len, self.k1, self.b)
+        return self._norm
+
+
+def length_norm(doc_len: Sequence[int], total_len: int, k1: float, b: float, n_docs: Optional[int] = None) -> List[float]:
+    # n_docs: số tài liệu thật sự được index (bỏ qua doc rỗng của record trùng)
+    n = len(doc_len) if n_docs is None else n_docs
+    avgdl = (total_len / n) if n and total_len else 1.0
+    return [k1 * (1.0 - b + b * dl / avgdl) for dl in doc_len]
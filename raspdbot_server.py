@@ -0,0 +1,502 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from raspdbot_llm import StubLlama
+from raspdbot_metrics import MetricsLogger, metrics_enabled
+
+# =========================
+# Server chat nhiều session (asyncio, HTTP/1.1 tối giản, chỉ dùng stdlib)
+# =========================
+# Một model nạp một lần; mỗi console (session) có history / clarify riêng.
+# Request -> hàng đợi có giới hạn -> MỘT worker suy luận (llama không thread-safe).
+#   POST   /sessions           -> {"session_id": ...}
+#   DELETE /sessions/<id>
+#   POST   /chat               {"session_id"?, "message", "timeout"?} -> text stream (chunked)
+#   GET    /health
+# Hàng đợi đầy -> 503 (Retry-After); quá timeout trước token đầu -> 504.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 8
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_SESSION_TTL = 30 * 60
+DEFAULT_MAX_SESSIONS = 64
+MAX_BODY_BYTES = 64 * 1024
+TIMEOUT_NOTE = "\n[Hết thời gian chờ, câu trả lời bị cắt]"
+
+REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+    503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+
+# =========================
+# Responder: bọc engine / JSONL bot, state riêng cho từng session
+# =========================
+class EngineResponder:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def new_state(self) -> Dict:
+        return {"history": [], "window": self.engine.new_window()}
+
+    def ask_stream(self, text: str, state: Dict, cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        return self.engine.ask_stream(text, state["history"], state["window"], cancel=cancel)
+
+    def close(self):
+        self.engine.close()
+
+
+class JsonlResponder:
+    def __init__(self, chat):
+        self.chat = chat
+
+    def new_state(self) -> Dict:
+        from RaspDbot_jsonl_chatbot import new_clarify_state
+
+        return new_clarify_state()
+
+    def ask_stream(self, text: str, state: Dict, cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        return self.chat.ask_stream(text, state, cancel)
+
+    def close(self):
+        self.chat.close()
+
+
+# =========================
+# Session store (idle TTL + giới hạn số session, LRU)
+# =========================
+class Session:
+    def __init__(self, session_id: str, state: Dict):
+        self.session_id = session_id
+        self.state = state
+        self.created = time.monotonic()
+        self.last_seen = self.created
+        self.busy = False
+        self.turns = 0
+
+
+class SessionStore:
+    def __init__(self, new_state, idle_ttl: float = DEFAULT_SESSION_TTL, max_sessions: int = DEFAULT_MAX_SESSIONS):
+        self.new_state = new_state
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[Session]:
+        s = self._sessions.get(session_id)
+        if s is not None:
+            s.last_seen = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return s
+
+    def create(self, session_id: Optional[str] = None) -> Session:
+        session_id = session_id or uuid.uuid4().hex
+        s = Session(session_id, self.new_state())
+        self._sessions[session_id] = s
+        self._evict_overflow()
+        return s
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Session:
+        return (self.get(session_id) if session_id else None) or self.create(session_id)
+
+    def drop(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        expired = [
+            sid for sid, s in self._sessions.items()
+            if not s.busy and now - s.last_seen > self.idle_ttl
+        ]
+        for sid in expired:
+            del self._sessions[sid]
+        return len(expired)
+
+    def _evict_overflow(self):
+        # Quá số session -> bỏ session ít dùng nhất (không đụng session đang chạy)
+        for sid in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if not self._sessions[sid].busy:
+                del self._sessions[sid]
+
+
+# =========================
+# Hàng đợi + worker suy luận duy nhất
+# =========================
+class Job:
+    def __init__(self, session: Session, message: str, timeout: float):
+        self.session = session
+        self.message = message
+        self.deadline = time.monotonic() + timeout
+        self.out: asyncio.Queue = asyncio.Queue()
+        self.cancel = threading.Event()
+        self.started = False
+        self.finished = False
+
+
+_DONE = object()
+
+
+class InferenceWorker:
+    """
+    Một thread chạy generator của responder; chunk được đẩy về event loop qua
+    call_soon_threadsafe. Job bị huỷ (timeout / client ngắt) -> close generator
+    ngay sau chunk hiện tại, tức trong vòng một token.
+    """
+
+    def __init__(self, responder, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.responder = responder
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="raspdbot-infer")
+        self.running: Optional[Job] = None
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, job: Job):
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.cancel.is_set() or time.monotonic() >= job.deadline:
+                    job.out.put_nowait(_DONE)
+                    continue
+                # Đánh dấu trong event loop: handler thấy started thì chờ worker xong
+                job.started = True
+                self.running = job
+                await loop.run_in_executor(self._executor, self._run_job, job, loop)
+                self.completed += 1
+            finally:
+                self.running = None
+                self.queue.task_done()
+
+    def _run_job(self, job: Job, loop: asyncio.AbstractEventLoop):
+        if job.cancel.is_set():
+            loop.call_soon_threadsafe(job.out.put_nowait, _DONE)
+            return
+        gen = self.responder.ask_stream(job.message, job.session.state, job.cancel)
+        try:
+            for text in gen:
+                if job.cancel.is_set():
+                    break
+                loop.call_soon_threadsafe(job.out.put_nowait, text)
+        except Exception as e:
+            loop.call_soon_threadsafe(job.out.put_nowait, f"Lỗi khi chạy bot: {e}")
+        finally:
+            gen.close()
+            job.session.turns += 1
+            loop.call_soon_threadsafe(job.out.put_nowait, _DONE)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+# =========================
+# HTTP
+# =========================
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    line = (await reader.readline()).decode("latin-1").strip()
+    if not line:
+        raise ValueError("empty request")
+    method, target, _ = line.split(" ", 2)
+    headers: Dict[str, str] = {}
+    while True:
+        h = (await reader.readline()).decode("latin-1")
+        if h in ("\r\n", "\n", ""):
+            break
+        k, _, v = h.partition(":")
+        headers[k.strip().lower()] = v.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    if length > MAX_BODY_BYTES:
+        raise OverflowError(length)
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), urlsplit(target).path, headers, body
+
+
+def response_head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    lines += [f"{k}: {v}" for k, v in headers.items()]
+    lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, data=None, headers: Optional[Dict[str, str]] = None):
+    body = b"" if data is None else json.dumps(data, ensure_ascii=False).encode("utf-8")
+    h = {"Content-Length": str(len(body))}
+    if data is not None:
+        h["Content-Type"] = "application/json; charset=utf-8"
+    h.update(headers or {})
+    writer.write(response_head(status, h) + body)
+    await writer.drain()
+
+
+def chunk(data: bytes) -> bytes:
+    return f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n"
+
+
+class ChatServer:
+    def __init__(
+        self,
+        responder,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        timeout: float = DEFAULT_TIMEOUT,
+        session_ttl: float = DEFAULT_SESSION_TTL,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+    ):
+        self.responder = responder
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.sessions = SessionStore(responder.new_state, session_ttl, max_sessions)
+        self.worker: Optional[InferenceWorker] = None
+        self._tasks = []
+
+    async def start(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> asyncio.AbstractServer:
+        # Queue phải tạo trong event loop đang chạy
+        self.worker = InferenceWorker(self.responder, self.max_queue)
+        self._tasks = [
+            asyncio.create_task(self.worker.run()),
+            asyncio.create_task(self._sweep_sessions()),
+        ]
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.worker is not None:
+            if self.worker.running is not None:
+                self.worker.running.cancel.set()
+            await asyncio.get_running_loop().run_in_executor(None, self.worker.shutdown)
+
+    async def _sweep_sessions(self):
+        interval = max(1.0, min(60.0, self.sessions.idle_ttl / 4))
+        while True:
+            await asyncio.sleep(interval)
+            self.sessions.evict_idle()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, headers, body = await read_request(reader)
+            except OverflowError:
+                await send_json(writer, 413, {"error": "body quá lớn"})
+                return
+            except (ValueError, asyncio.IncompleteReadError):
+                await send_json(writer, 400, {"error": "request không hợp lệ"})
+                return
+            await self.route(method, path, body, reader, writer)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes, reader, writer):
+        parts = [p for p in path.split("/") if p]
+        if parts == ["health"] and method == "GET":
+            w = self.worker
+            await send_json(writer, 200, {
+                "sessions": len(self.sessions),
+                "queued": w.queue.qsize(),
+                "max_queue": self.max_queue,
+                "busy": w.running is not None,
+                "completed": w.completed,
+                "rejected": w.rejected,
+            })
+        elif parts == ["sessions"] and method == "POST":
+            s = self.sessions.create()
+            await send_json(writer, 201, {"session_id": s.session_id})
+        elif len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            s = self.sessions.get(parts[1])
+            if s is not None and s.busy:
+                await send_json(writer, 409, {"error": "session đang trả lời"})
+            elif self.sessions.drop(parts[1]):
+                await send_json(writer, 204)
+            else:
+                await send_json(writer, 404, {"error": "không có session"})
+        elif parts == ["chat"] and method == "POST":
+            await self.chat(body, reader, writer)
+        elif parts and parts[0] in ("health", "sessions", "chat"):
+            await send_json(writer, 405, {"error": "method không hỗ trợ"})
+        else:
+            await send_json(writer, 404, {"error": "không có endpoint"})
+
+    async def chat(self, body: bytes, reader, writer):
+        try:
+            req = json.loads(body.decode("utf-8") or "{}")
+            message = str(req.get("message", "")).strip()
+            timeout = float(req.get("timeout") or self.timeout)
+        except (ValueError, AttributeError):
+            await send_json(writer, 400, {"error": "body phải là JSON"})
+            return
+        if not message:
+            await send_json(writer, 400, {"error": "thiếu message"})
+            return
+
+        session_id = req.get("session_id") or None
+        session = self.sessions.get_or_create(session_id)
+        if session.busy:
+            # Hai request cùng session chạy xen kẽ sẽ làm rối history
+            await send_json(writer, 409, {"error": "session đang trả lời"})
+            return
+
+        job = Job(session, message, timeout)
+        try:
+            self.worker.submit(job)
+        except asyncio.QueueFull:
+            if session_id is None:
+                self.sessions.drop(session.session_id)
+            await send_json(writer, 503, {"error": "server bận"}, {"Retry-After": "1"})
+            return
+        session.busy = True
+
+        # Client ngắt kết nối -> huỷ job (đọc EOF trên socket)
+        disconnect = asyncio.create_task(reader.read())
+        try:
+            first = await self._next_chunk(job, disconnect)
+            if first is None:
+                job.cancel.set()
+                if not disconnect.done():
+                    await send_json(writer, 504, {"error": "hết thời gian chờ"})
+                return
+
+            writer.write(response_head(200, {
+                "Content-Type": "text/plain; charset=utf-8",
+                "Transfer-Encoding": "chunked",
+                "Cache-Control": "no-cache",
+                "X-Session-Id": session.session_id,
+            }))
+            text = first
+            while text is not _DONE:
+                writer.write(chunk(text.encode("utf-8")))
+                await writer.drain()
+                text = await self._next_chunk(job, disconnect)
+                if text is None:
+                    job.cancel.set()
+                    if disconnect.done():
+                        return
+                    writer.write(chunk(TIMEOUT_NOTE.encode("utf-8")))
+                    break
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            job.cancel.set()
+            disconnect.cancel()
+            # Chờ worker nhả session (tối đa một token sau khi huỷ)
+            while job.started and not job.finished:
+                job.finished = await job.out.get() is _DONE
+            session.busy = False
+            session.last_seen = time.monotonic()
+
+    async def _next_chunk(self, job: Job, disconnect: asyncio.Task):
+        # None = hết thời gian hoặc client đã ngắt; _DONE = xong
+        remaining = job.deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        get = asyncio.ensure_future(job.out.get())
+        done, _ = await asyncio.wait({get, disconnect}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        if get in done:
+            item = get.result()
+            job.finished = item is _DONE
+            return item
+        get.cancel()
+        return None
+
+
+# =========================
+# CLI
+# =========================
+def build_responder(args):
+    metrics = MetricsLogger(enabled=metrics_enabled(False))
+    if args.pipeline == "jsonl":
+        import RaspDbot_jsonl_chatbot as jsonl_bot
+
+        llm = StubLlama(n_ctx=4096, decode_tps=args.stub_decode_tps) if args.stub else None
+        chat = jsonl_bot.JsonlChat(
+            args.model or jsonl_bot.MODEL_PATH,
+            args.dataset or jsonl_bot.JSONL_PATH,
+            llm=llm,
+            metrics=metrics,
+        )
+        return JsonlResponder(chat)
+
+    from raspdbot_bot import RaspDbotEngine
+    from raspdbot_registry import CorpusRegistry
+
+    model = args.model or "stub.gguf"
+    retriever = None if args.no_rag else CorpusRegistry().retriever_for(model)
+    if args.stub:
+        engine = RaspDbotEngine(
+            model,
+            llm=StubLlama(decode_tps=args.stub_decode_tps),
+            prefix_cache=False,
+            metrics=metrics,
+            retriever=retriever,
+        )
+    else:
+        engine = RaspDbotEngine(args.model, n_ctx=args.n_ctx, metrics=metrics, retriever=retriever)
+    return EngineResponder(engine)
+
+
+async def serve(args):
+    server = ChatServer(
+        build_responder(args),
+        max_queue=args.max_queue,
+        timeout=args.timeout,
+        session_ttl=args.session_ttl,
+        max_sessions=args.max_sessions,
+    )
+    srv = await server.start(args.host, args.port)
+    print(f"RaspDbot server: http://{args.host}:{args.port} ({args.pipeline}{', stub' if args.stub else ''})")
+    try:
+        async with srv:
+            await srv.serve_forever()
+    finally:
+        await server.stop()
+        server.responder.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Server chat nhiều session cho RaspDbot (một model dùng chung).")
+    ap.add_argument("--host", default=DEFAULT_HOST)
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--pipeline", choices=["engine", "jsonl"], default="engine")
+    ap.add_argument("--model", default="", help="file GGUF")
+    ap.add_argument("--dataset", default="", help="JSONL cho --pipeline jsonl")
+    ap.add_argument("--n-ctx", type=int, default=2048)
+    ap.add_argument("--no-rag", action="store_true", help="engine: không thêm tài liệu từ dataset vào prompt")
+    ap.add_argument("--stub", action="store_true", help="dùng StubLlama (không cần GGUF)")
+    ap.add_argument("--stub-decode-tps", type=float, default=20.0)
+    ap.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE)
+    ap.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="giây cho mỗi request")
+    ap.add_argument("--session-ttl", type=float, default=DEFAULT_SESSION_TTL, help="giây không dùng thì xoá session")
+    ap.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS)
+    args = ap.parse_args()
+    if not args.stub and not args.model:
+        ap.error("cần --model (hoặc --stub)")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
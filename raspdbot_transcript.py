@@ -0,0 +1,125 @@
+import hashlib
+from typing import List, Optional, Sequence
+
+# =========================
+# Transcript token của một hội thoại (prompt ổn định prefix)
+# =========================
+# llama-cpp chỉ dùng lại KV cache cho phần token trùng đầu với lần gọi trước.
+# Ghép lại prompt từ text mỗi lượt dễ làm lệch prefix: câu trả lời đã qua
+# hậu xử lý (xưng hô, strip) khác với token model thật sự sinh ra, và token
+# hoá lại text ở ranh giới có thể ra token khác. Transcript giữ đúng dãy token
+# model đã thấy: prompt đã gửi + token câu trả lời thật; lượt sau chỉ token
+# hoá phần mới rồi nối vào, nên prefill chỉ tốn cho tin nhắn mới.
+
+
+def common_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if int(x) != int(y):
+            break
+        n += 1
+    return n
+
+
+def reused_prefix(llm, tokens: Sequence[int]) -> int:
+    # Số token đầu của prompt đã có sẵn trong KV cache (llama luôn eval lại ít nhất token cuối)
+    kv = getattr(llm, "input_ids", None)
+    if kv is None or not len(tokens):
+        return 0
+    return common_prefix(kv, tokens[:-1])
+
+
+class PromptTranscript:
+    """
+    start(text) -> token prompt đầy đủ (có BOS), extend(text) -> transcript
+    đã ghi + token của đoạn mới. commit(prompt, câu trả lời thô) sau khi sinh
+    xong: lấy token câu trả lời từ KV của llm (phần khớp với text giữ lại),
+    phần còn thiếu mới token hoá. Chưa commit thì transcript không đổi.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.tokens: List[int] = []
+        self.turns = 0
+        self.last_mode = ""
+        self.last_reused = 0
+        self.last_prompt_tokens = 0
+        self.key = None     # caller ghi phần hội thoại mà transcript đang phản ánh
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def reset(self):
+        self.tokens = []
+        self.turns = 0
+        self.key = None
+
+    def _tokenize(self, text: str, add_bos: bool) -> List[int]:
+        return list(self.llm.tokenize(text.encode("utf-8"), add_bos=add_bos, special=True))
+
+    def start(self, text: str) -> List[int]:
+        # Cả prompt token hoá một lần như trước đây (khớp snapshot prefix của raspdbot_kvcache)
+        self.reset()
+        self.last_mode = "rebuild"
+        return self._tokenize(text, add_bos=True)
+
+    def begin(self, text: str) -> List[int]:
+        # Transcript mới chỉ gồm phần đầu cố định (system, có BOS); caller nối tiếp bằng segment()
+        self.reset()
+        self.last_mode = "rebuild"
+        self.tokens = self._tokenize(text, add_bos=True)
+        return self.tokens
+
+    def extend(self, text: str) -> List[int]:
+        self.last_mode = "extend"
+        return self.tokens + self._tokenize(text, add_bos=False)
+
+    def segment(self, text: str) -> List[int]:
+        # Token của một đoạn nối sau transcript (không BOS), không đổi last_mode
+        return self._tokenize(text, add_bos=False)
+
+    def measure(self, tokens: Sequence[int]) -> int:
+        # Gọi ngay trước llm(tokens): ghi lại phần prefix dùng lại được
+        self.last_reused = reused_prefix(self.llm, tokens)
+        self.last_prompt_tokens = len(tokens)
+        return self.last_reused
+
+    def commit(self, prompt: Sequence[int], answer: str, key=None, base: Optional[Sequence[int]] = None):
+        """
+        answer: text model sinh ra trước khi hậu xử lý (đã cắt marker, bỏ
+        khoảng trắng cuối). Token sinh ra nằm sau prompt trong KV; lấy phần
+        dài nhất detokenize ra đúng đầu của answer (bỏ token của stop marker),
+        phần đuôi chưa eval (token cuối cùng) thì token hoá lại.
+        key: phần hội thoại transcript phản ánh sau lượt này (do caller định nghĩa).
+        base: phần đặt trước câu trả lời trong transcript nếu khác prompt
+        (vd prompt có khối tham chiếu chỉ dùng cho lượt này); mặc định = prompt.
+        """
+        prompt = list(prompt)
+        data = answer.encode("utf-8")
+        gen: List[int] = []
+        kv = getattr(self.llm, "input_ids", None)
+        if kv is not None and len(kv) > len(prompt) and common_prefix(kv, prompt) == len(prompt):
+            gen = [int(t) for t in kv[len(prompt):]]
+
+        # Tìm nhị phân số token sinh ra dài nhất vẫn là prefix của answer
+        lo, hi = 0, len(gen)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if data.startswith(self.llm.detokenize(gen[:mid])):
+                lo = mid
+            else:
+                hi = mid - 1
+        kept = gen[:lo]
+        rest = data[len(self.llm.detokenize(kept)):].decode("utf-8", errors="ignore") if kept else answer
+        head = prompt if base is None else list(base)
+        self.tokens = head + kept + (self._tokenize(rest, add_bos=False) if rest else [])
+        self.turns += 1
+        self.key = key
+
+    def digest(self) -> str:
+        # Cho cache key: câu trả lời của lượt tiếp theo phụ thuộc cả phần hội thoại đã ghi
+        return hashlib.sha1(",".join(map(str, self.tokens)).encode("ascii")).hexdigest()
+
+    def fits(self, tokens: Sequence[int], max_tokens: int, n_ctx: Optional[int] = None) -> bool:
+        n_ctx = n_ctx or self.llm.n_ctx()
+        return len(tokens) + max_tokens <= n_ctx
@@ -0,0 +1,362 @@
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import statistics
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from raspdbot_cache import STATE_DIR, atomic_write_bytes, file_signature, short_hash
+
+# =========================
+# Tự tinh chỉnh tham số Llama theo máy + model
+# =========================
+# Sweep ngắn (coordinate descent, mỗi bước giữ giá trị tốt nhất của bước trước):
+#   1) n_threads (decode) và n_threads_batch (prefill) — một lượt đo cho cả hai
+#   2) n_batch
+#   3) kiểu KV cache (f16 / q8_0; q8_0 cần flash_attn)
+#   4) use_mmap / use_mlock
+# Mục tiêu = thời gian một lượt điển hình: prefill PROMPT_TOKENS + decode
+# DECODE_TOKENS. Lựa chọn khác mặc định chỉ được giữ khi nhanh hơn MIN_GAIN
+# (tránh chọn theo nhiễu). Profile lưu theo hash model + chữ ký CPU trong
+# STATE_DIR/tune_profiles.json; create_llm() tự nạp (RASPDBOT_TUNE_PROFILE=0 để bỏ qua).
+# n_ctx / n_gpu_layers vẫn do caller quyết định (bộ nhớ, không phải tốc độ).
+PROFILE_PATH = STATE_DIR / "tune_profiles.json"
+PROFILE_ENV = "RASPDBOT_TUNE_PROFILE"
+PROJECT_DIR = Path(__file__).resolve().parent
+PROMPT_TOKENS = 384
+DECODE_TOKENS = 48
+MIN_GAIN = 0.03
+BATCH_SIZES = [64, 128, 256, 512]
+KV_TYPES = {"f16": 1, "q8_0": 8, "q4_0": 2}     # giá trị enum ggml_type cho type_k / type_v
+HASH_BYTES = 1 << 20
+
+_HASH_CACHE: Dict[Tuple[str, int, int], str] = {}
+
+
+def model_hash(model_path: str) -> str:
+    # Không đọc cả file GGUF (vài GB): size + 1 MiB đầu + 1 MiB cuối (header GGUF
+    # + metadata nằm ở đầu file) — đổi tên / copy sang máy khác vẫn khớp profile
+    path = os.path.abspath(model_path)
+    sig = file_signature(path)
+    key = (path, sig["size"], sig["mtime_ns"])
+    cached = _HASH_CACHE.get(key)
+    if cached is None:
+        h = hashlib.sha256(str(sig["size"]).encode("ascii"))
+        with open(path, "rb") as f:
+            h.update(f.read(HASH_BYTES))
+            if sig["size"] > 2 * HASH_BYTES:
+                f.seek(-HASH_BYTES, os.SEEK_END)
+                h.update(f.read(HASH_BYTES))
+        cached = _HASH_CACHE[key] = h.hexdigest()[:16]
+    return cached
+
+
+def usable_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def cpu_description() -> str:
+    # x86: "model name"; Pi: "Model" + "CPU part" (big.LITTLE có nhiều part khác nhau)
+    names: List[str] = []
+    parts = set()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                key, _, val = line.partition(":")
+                key, val = key.strip().lower(), val.strip()
+                if key in ("model name", "model", "hardware") and not val.isdigit() and val not in names:
+                    names.append(val)
+                elif key == "cpu part":
+                    parts.add(val)
+    except OSError:
+        pass
+    desc = " / ".join(names) or platform.processor() or "unknown"
+    if parts:
+        desc += " [" + ",".join(sorted(parts)) + "]"
+    return f"{platform.machine()} {desc}, {usable_cpus()}/{os.cpu_count()} cpu"
+
+
+def cpu_signature() -> str:
+    return f"{platform.machine()}-{usable_cpus()}-{short_hash(cpu_description())}"
+
+
+def profile_key(model_path: str) -> str:
+    return f"{model_hash(model_path)}@{cpu_signature()}"
+
+
+def load_profiles(path: Path = PROFILE_PATH) -> Dict[str, Dict]:
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_profile(model_path: str, profile: Dict, path: Path = PROFILE_PATH):
+    profiles = load_profiles(path)
+    profiles[profile_key(model_path)] = profile
+    atomic_write_bytes(Path(path), json.dumps(profiles, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def load_profile(model_path: str, path: Path = PROFILE_PATH) -> Dict:
+    # -> params đã tune ({} nếu chưa tune / bị tắt / không đọc được model)
+    if os.environ.get(PROFILE_ENV, "1").strip().lower() in ("0", "false", "no", "off"):
+        return {}
+    try:
+        key = profile_key(model_path)
+    except OSError:
+        return {}
+    return dict(load_profiles(path).get(key, {}).get("params", {}))
+
+
+def llama_kwargs(params: Dict) -> Dict:
+    # Params của profile -> kwargs cho Llama(...)
+    out = dict(params)
+    kv = out.pop("kv_type", "f16")
+    if kv in KV_TYPES and kv != "f16":
+        out["type_k"] = out["type_v"] = KV_TYPES[kv]
+        out["flash_attn"] = True     # llama.cpp chỉ cho quantize V cache khi bật flash attention
+    return out
+
+
+# =========================
+# Đo một cấu hình
+# =========================
+def calibration_prompt(llm, n_tokens: int) -> List[int]:
+    # Q/A của dataset đi kèm, giống prompt thật của JSONL bot (có khối "Đáp:")
+    from raspdbot_corpus import load_corpus
+    from raspdbot_registry import DEFAULT_SOURCES
+
+    text = ""
+    for s in DEFAULT_SOURCES:
+        if os.path.exists(s["path"]):
+            pairs = load_corpus(s["path"]).qa_pairs
+            text = "\n\n".join(f"Hỏi: {q}\nĐáp: {a}" for q, a in pairs[:64])
+            break
+    text = text or "RaspDbot là robot tự hành chạy trên Raspberry Pi. " * 64
+    tokens = llm.tokenize(text.encode("utf-8"), add_bos=True, special=True)
+    while len(tokens) < n_tokens:
+        tokens = tokens + tokens[1:]
+    return tokens[:n_tokens]
+
+
+def measure(
+    make_llm: Callable[[Dict], object],
+    params: Dict,
+    prompt_tokens: int = PROMPT_TOKENS,
+    decode_tokens: int = DECODE_TOKENS,
+    repeats: int = 2,
+) -> Dict[str, float]:
+    t0 = time.perf_counter()
+    llm = make_llm(params)
+    load_s = time.perf_counter() - t0
+    try:
+        tokens = calibration_prompt(llm, prompt_tokens)
+        bias = {}
+        if hasattr(llm, "token_eos"):
+            bias = {llm.token_eos(): -100.0}    # không dừng sớm ở EOS -> đủ số token decode
+        prefill, decode = [], []
+        for _ in range(repeats):
+            llm.reset()      # prefill lại toàn bộ prompt mỗi lần
+            t_start = time.perf_counter()
+            t_first, n = None, 0
+            stream = llm.create_completion(
+                tokens, max_tokens=decode_tokens, temperature=0.0, stream=True, logit_bias=bias or None
+            )
+            for _ in stream:
+                if t_first is None:
+                    t_first = time.perf_counter()
+                n += 1
+            t_end = time.perf_counter()
+            t_first = t_first or t_end
+            prefill.append(len(tokens) / max(t_first - t_start, 1e-9))
+            if n > 1:
+                decode.append((n - 1) / max(t_end - t_first, 1e-9))
+    finally:
+        close = getattr(llm, "close", None)
+        if close:
+            close()
+        del llm
+        gc.collect()
+
+    prefill_tps = statistics.median(prefill)
+    decode_tps = statistics.median(decode) if decode else 0.0
+    turn_s = prompt_tokens / prefill_tps + (decode_tokens / decode_tps if decode_tps else 0.0)
+    return {
+        "load_s": round(load_s, 3),
+        "prefill_tok_s": round(prefill_tps, 2),
+        "decode_tok_s": round(decode_tps, 2),
+        "turn_s": round(turn_s, 4),
+    }
+
+
+def _better(new: Dict, best: Dict, min_gain: float = MIN_GAIN) -> bool:
+    return new["turn_s"] < best["turn_s"] * (1.0 - min_gain)
+
+
+# =========================
+# Sweep
+# =========================
+def thread_candidates(n_cpu: Optional[int] = None) -> List[int]:
+    n = n_cpu or usable_cpus()
+    return sorted({c for c in (1, 2, n // 2, n - 1, n) if 1 <= c <= n})
+
+
+def tune(
+    make_llm: Callable[[Dict], object],
+    threads: Optional[List[int]] = None,
+    batch_sizes: Optional[List[int]] = None,
+    kv_types: Optional[List[str]] = None,
+    memory_modes: Optional[List[Tuple[bool, bool]]] = None,
+    prompt_tokens: int = PROMPT_TOKENS,
+    decode_tokens: int = DECODE_TOKENS,
+    repeats: int = 2,
+    log: Callable[[str], None] = print,
+) -> Dict:
+    """
+    make_llm(params) -> Llama đã nạp với params. Trả về
+    {"params", "result", "baseline", "trials"}; baseline = cấu hình mặc định cũ
+    (n_threads = số CPU).
+    """
+    threads = threads or thread_candidates()
+    batch_sizes = batch_sizes or BATCH_SIZES
+    kv_types = kv_types or ["f16", "q8_0"]
+    memory_modes = memory_modes or [(True, False), (False, False), (True, True)]
+    trials: List[Dict] = []
+
+    def run(stage: str, params: Dict) -> Optional[Dict]:
+        try:
+            res = measure(make_llm, params, prompt_tokens, decode_tokens, repeats)
+        except Exception as e:   # vd KV q8_0 / mlock không được build hoặc hệ thống hỗ trợ
+            log(f"  {stage:8s} {params} -> lỗi: {e}")
+            return None
+        trials.append({"stage": stage, "params": dict(params), **res})
+        log(
+            f"  {stage:8s} {params} -> prefill {res['prefill_tok_s']:8.1f} tok/s, "
+            f"decode {res['decode_tok_s']:7.2f} tok/s, lượt {res['turn_s']:.2f}s, nạp {res['load_s']:.2f}s"
+        )
+        return res
+
+    # 1) threads: mỗi lần nạp đo cả prefill lẫn decode -> chọn riêng cho từng pha
+    base_threads = usable_cpus()
+    per_thread: Dict[int, Dict] = {}
+    for t in threads:
+        res = run("threads", {"n_threads": t, "n_threads_batch": t})
+        if res:
+            per_thread[t] = res
+    if not per_thread:
+        raise RuntimeError("không nạp được model với cấu hình nào")
+    ref = base_threads if base_threads in per_thread else max(per_thread)
+    baseline = per_thread[ref]
+    t_dec = max(per_thread, key=lambda t: per_thread[t]["decode_tok_s"])
+    t_pre = max(per_thread, key=lambda t: per_thread[t]["prefill_tok_s"])
+    # Giữ số thread mặc định nếu lựa chọn mới không nhanh hơn rõ rệt
+    if per_thread[t_dec]["decode_tok_s"] < baseline["decode_tok_s"] * (1.0 + MIN_GAIN):
+        t_dec = ref
+    if per_thread[t_pre]["prefill_tok_s"] < baseline["prefill_tok_s"] * (1.0 + MIN_GAIN):
+        t_pre = ref
+    params, best = {"n_threads": ref, "n_threads_batch": ref}, baseline
+    if (t_dec, t_pre) != (ref, ref):
+        cand = {"n_threads": t_dec, "n_threads_batch": t_pre}
+        res = per_thread[t_dec] if t_dec == t_pre else run("threads", cand)
+        if res and _better(res, baseline):
+            params, best = cand, res
+
+    # 2) - 4): thử từng giá trị, giữ cái nhanh hơn rõ rệt
+    stages = [
+        ("n_batch", [{"n_batch": b} for b in batch_sizes if b != 512]),
+        ("kv", [{"kv_type": kv} for kv in kv_types if kv != "f16" and kv in KV_TYPES]),
+        ("memory", [{"use_mmap": m, "use_mlock": l} for m, l in memory_modes if (m, l) != (True, False)]),
+    ]
+    for stage, options in stages:
+        for opt in options:
+            res = run(stage, {**params, **opt})
+            if res and _better(res, best):
+                params, best = {**params, **opt}, res
+
+    return {"params": params, "result": best, "baseline": baseline, "trials": trials}
+
+
+def tune_model(model_path: str, n_ctx: int = 2048, **kwargs) -> Dict:
+    from raspdbot_llm import create_llm
+
+    def make_llm(params: Dict):
+        # profile=False: đo đúng params đang thử, không trộn với profile cũ
+        return create_llm(model_path, n_ctx=n_ctx, profile=False, lookup_tokens=0, **llama_kwargs(params))
+
+    out = tune(make_llm, **kwargs)
+    return {
+        "model_path": os.path.abspath(model_path),
+        "cpu": cpu_description(),
+        "n_ctx": n_ctx,
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **out,
+    }
+
+
+# =========================
+# CLI
+# =========================
+def _int_list(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tinh chỉnh n_threads / n_batch / KV cache / mmap cho từng model GGUF.")
+    ap.add_argument("models", nargs="*", help="file .gguf (mặc định: mọi *.gguf trong thư mục project)")
+    ap.add_argument("--show", action="store_true", help="chỉ in các profile đã lưu")
+    ap.add_argument("--n-ctx", type=int, default=2048)
+    ap.add_argument("--threads", type=_int_list, default=None, help="vd 2,3,4 (mặc định theo số CPU)")
+    ap.add_argument("--batch", type=_int_list, default=None, help=f"mặc định {','.join(map(str, BATCH_SIZES))}")
+    ap.add_argument("--kv", default="f16,q8_0", help="kiểu KV cache thử: " + ",".join(KV_TYPES))
+    ap.add_argument("--prompt-tokens", type=int, default=PROMPT_TOKENS)
+    ap.add_argument("--decode-tokens", type=int, default=DECODE_TOKENS)
+    ap.add_argument("--repeats", type=int, default=2)
+    ap.add_argument("--dry-run", action="store_true", help="không lưu profile")
+    args = ap.parse_args()
+
+    print(f"CPU: {cpu_description()} ({cpu_signature()})")
+    if args.show:
+        for key, p in load_profiles().items():
+            r, b = p.get("result", {}), p.get("baseline", {})
+            print(f"{key}  {Path(p.get('model_path', '?')).name}: {p.get('params')}")
+            if r and b:
+                print(f"    lượt {b.get('turn_s')}s -> {r.get('turn_s')}s (decode {r.get('decode_tok_s')} tok/s)")
+        return
+
+    models = args.models or sorted(str(p) for p in PROJECT_DIR.glob("*.gguf"))
+    if not models:
+        print("Không có file .gguf nào để tune.")
+        return
+    for model in models:
+        print(f"== {model}")
+        profile = tune_model(
+            model,
+            n_ctx=args.n_ctx,
+            threads=args.threads,
+            batch_sizes=args.batch,
+            kv_types=[k.strip() for k in args.kv.split(",") if k.strip()],
+            prompt_tokens=args.prompt_tokens,
+            decode_tokens=args.decode_tokens,
+            repeats=args.repeats,
+        )
+        b, r = profile["baseline"], profile["result"]
+        print(f"  => {profile['params']}")
+        print(
+            f"     lượt {b['turn_s']:.2f}s -> {r['turn_s']:.2f}s "
+            f"(prefill {b['prefill_tok_s']:.0f} -> {r['prefill_tok_s']:.0f}, "
+            f"decode {b['decode_tok_s']:.1f} -> {r['decode_tok_s']:.1f} tok/s)"
+        )
+        if not args.dry_run:
+            save_profile(model, profile)
+            print(f"  Đã lưu profile: {PROFILE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Cache / state của các module đọc từ biến môi trường lúc import -> trỏ vào thư mục tạm
+# trước khi test nào import code của project (không đụng ~/.cache, ~/.local/state)
+_TMP = Path(tempfile.mkdtemp(prefix="raspdbot-tests-"))
+os.environ["RASPDBOT_CACHE_DIR"] = str(_TMP / "cache")
+os.environ["RASPDBOT_STATE_DIR"] = str(_TMP / "state")
+os.environ["RASPDBOT_RELOAD_INTERVAL"] = "0"
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+import json  # noqa: E402
+
+import pytest  # noqa: E402
+
+
+def qa_line(question: str, answer: str) -> str:
+    # Một dòng JSONL cùng format với dataset đi kèm
+    return json.dumps(
+        {"messages": [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]},
+        ensure_ascii=False,
+    ) + "\n"
+
+
+@pytest.fixture
+def small_jsonl(tmp_path):
+    path = tmp_path / "data.jsonl"
+    path.write_text(
+        qa_line("Pin của robot sạc đầy mất bao lâu?", "Khoảng 2 giờ với bộ sạc 5A.")
+        + qa_line("Lidar dùng để làm gì?", "Lidar quét môi trường để lập bản đồ và tránh vật cản.")
+        + qa_line("Tốc độ tối đa của xe là bao nhiêu?", "Tốc độ tối đa là 1.5 m/s trong khuôn viên."),
+        encoding="utf-8",
+    )
+    return path
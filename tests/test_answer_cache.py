@@ -0,0 +1,47 @@
+from contextlib import closing
+
+import pytest
+
+from raspdbot_answer_cache import AnswerCache, conversation_key
+from raspdbot_bot import RaspDbotEngine
+from raspdbot_llm import StubLlama
+
+# Câu hỏi "tốc độ ..." là need_data với engine (trả lời cố định, không qua cache)
+QUESTION = "Giải thích cách robot tránh vật cản?"
+FIRST = [{"role": "user", "content": "xe nặng bao nhiêu?"}, {"role": "assistant", "content": "12 kg."}]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    cache = AnswerCache(tmp_path / "answers")
+    eng = RaspDbotEngine(str(tmp_path / "model.gguf"), llm=StubLlama(), answer_cache=cache, prefix_cache=False)
+    yield eng
+    eng.close()
+    cache.close()
+
+
+def test_conversation_key_empty_matches_standalone():
+    assert conversation_key("", []) == []
+    base = AnswerCache.make_key("fp", QUESTION, [1, 2], {"t": 0})
+    assert AnswerCache.make_key("fp", QUESTION, [1, 2], {"t": 0}, conversation=[]) == base
+    other = AnswerCache.make_key("fp", QUESTION, [1, 2], {"t": 0}, conversation=conversation_key("", FIRST))
+    assert other != base
+    assert conversation_key("tóm tắt", FIRST) != conversation_key("", FIRST)
+
+
+def test_engine_cache_depends_on_prior_conversation(engine):
+    first = engine.ask(QUESTION)
+    assert engine.answer_cache.stats()["misses"] == 1
+
+    # Hội thoại mới, cùng câu hỏi lượt đầu -> hit
+    history, window = [], engine.new_window()
+    with closing(engine.ask_stream(QUESTION, history, window)) as stream:
+        assert "".join(stream) == first
+    assert engine.answer_cache.stats()["hits"] == 1
+
+    # Cùng câu hỏi nhưng sau một lượt khác -> prompt khác -> không dùng lại câu trả lời
+    history, window = list(FIRST), engine.new_window()
+    with closing(engine.ask_stream(QUESTION, history, window)) as stream:
+        "".join(stream)
+    assert engine.answer_cache.stats()["hits"] == 1
+    assert history[-1]["role"] == "assistant"
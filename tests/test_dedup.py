@@ -0,0 +1,115 @@
+import pytest
+
+from conftest import qa_line
+from raspdbot_corpus import CompiledCorpus, compile_corpus
+from raspdbot_dedup import find_clusters, group_clusters
+from raspdbot_llm import StubLlama
+
+ANSWER = "Robot dùng pin lithium 24V, sạc đầy trong khoảng 2 giờ với bộ sạc đi kèm và chạy được 6 giờ liên tục."
+
+
+def test_exact_duplicates_after_normalize():
+    pairs = [
+        ("Pin robot sạc bao lâu?", ANSWER),
+        ("  pin ROBOT sạc bao lâu? ", ANSWER.upper()),
+        ("Lidar dùng để làm gì?", "Lidar quét môi trường."),
+    ]
+    rep_of = find_clusters(pairs)
+    assert rep_of == [0, 0, 2]
+    assert group_clusters(rep_of) == {0: [0, 1]}
+
+
+def test_near_duplicates_cluster_to_lowest_id():
+    pairs = [
+        ("Lidar dùng để làm gì?", "Lidar quét môi trường."),
+        ("Pin của robot sạc đầy mất bao lâu?", ANSWER),
+        ("Pin của robot sạc đầy mất bao lâu vậy?", ANSWER.rstrip(".") + " nhé."),
+    ]
+    rep_of = find_clusters(pairs)
+    assert rep_of == [0, 1, 1]
+
+
+def test_same_answer_different_question_kept():
+    # Câu trả lời chung chung giống nhau nhưng câu hỏi khác hẳn -> không gộp
+    pairs = [
+        ("Pin của robot sạc đầy mất bao lâu?", ANSWER),
+        ("Camera của robot có quay đêm được không?", ANSWER),
+    ]
+    assert find_clusters(pairs) == [0, 1]
+
+
+def test_similar_question_different_answer_kept():
+    pairs = [
+        ("Tốc độ tối đa của xe là bao nhiêu?", "Tốc độ tối đa là 1.5 m/s trong khuôn viên."),
+        ("Tốc độ tối đa của xe là bao nhiêu?", "Ngoài đường xe chạy tối đa 5 m/s khi có người giám sát."),
+    ]
+    assert find_clusters(pairs) == [0, 1]
+
+
+def test_compiled_corpus_indexes_representatives_only(tmp_path):
+    path = tmp_path / "dup.jsonl"
+    path.write_text(
+        qa_line("Pin robot sạc bao lâu?", ANSWER)
+        + qa_line("pin robot sạc bao lâu?", ANSWER)
+        + qa_line("Lidar dùng để làm gì?", "Lidar quét môi trường."),
+        encoding="utf-8",
+    )
+    corpus = CompiledCorpus(compile_corpus(str(path), tmp_path / "dup.rdbidx", dedup=True))
+    assert len(corpus) == 3
+    assert corpus.index.n_indexed == 2
+    hits = corpus.index.search("pin robot sạc", k=5)
+    assert len(hits) == 1
+
+
+@pytest.fixture
+def dup_corpus(tmp_path):
+    # Ba biến thể gần trùng của cùng một Q/A + vài Q/A khác
+    answer = "DWB bám quỹ đạo bằng cách lấy mẫu vận tốc, RPP đi theo điểm nhìn trước trên đường đi; RPP mượt hơn ở tốc độ thấp."
+    path = tmp_path / "dwb.jsonl"
+    path.write_text(
+        qa_line("So sánh DWB và RPP trên robot?", answer)
+        + qa_line("So sánh DWB với RPP trên robot?", answer)
+        + qa_line("So sánh DWB và RPP trên robot vậy?", answer.replace("mượt hơn", "êm hơn"))
+        + qa_line("Lidar dùng để làm gì?", "Lidar quét môi trường để lập bản đồ và tránh vật cản.")
+        + qa_line("Pin của robot sạc đầy mất bao lâu?", "Khoảng 2 giờ với bộ sạc 5A.")
+        + qa_line("DWB có chạy được trên Raspberry Pi không?", "Có, với tần số điều khiển 10 Hz."),
+        encoding="utf-8",
+    )
+    return CompiledCorpus(compile_corpus(str(path), tmp_path / "dwb.rdbidx", dedup=True))
+
+
+@pytest.fixture
+def stub_embedder(tmp_path, monkeypatch):
+    import raspdbot_embed
+    import RaspDbot_jsonl_chatbot as jsonl_bot
+
+    model = tmp_path / "embed.gguf"
+    model.write_bytes(b"stub")
+    monkeypatch.setattr(jsonl_bot, "EMBED_MODEL_PATH", str(model))
+    monkeypatch.setattr(raspdbot_embed, "create_embedder", lambda path: StubLlama())
+
+
+@pytest.mark.parametrize("backend", ["dense", "hybrid"])
+def test_dense_backends_return_one_doc_per_cluster(dup_corpus, stub_embedder, backend):
+    from RaspDbot_jsonl_chatbot import build_retriever
+
+    assert dup_corpus.index.n_indexed == 4
+    retriever = build_retriever(dup_corpus, backend)
+    hits = retriever.search("so sánh DWB và RPP", k=5)
+    docs = [d for _, d in hits]
+    assert docs and len(docs) <= 4
+    assert all(dup_corpus.representative(d) == d for d in docs)
+    assert len({dup_corpus.representative(d) for d in docs}) == len(docs)
+
+
+def test_embedding_cache_keyed_on_dedup(tmp_path, dup_corpus, stub_embedder):
+    from RaspDbot_jsonl_chatbot import build_retriever
+
+    dense = build_retriever(dup_corpus, "dense")
+    assert len(dense) == 4
+    # Cùng dataset, tắt dedup -> ma trận riêng (không dùng lại ma trận chỉ có đại diện)
+    src = dup_corpus.header["source"]
+    full = CompiledCorpus(compile_corpus(src, tmp_path / "full.rdbidx", dedup=False))
+    assert full.doc_key == dup_corpus.doc_key
+    assert len(build_retriever(full, "dense")) == 6
+    assert len(build_retriever(dup_corpus, "dense")) == 4
@@ -0,0 +1,28 @@
+from raspdbot_bot import RaspDbotEngine
+from raspdbot_llm import StubLlama
+
+
+def test_lock_released_when_stream_closed_early(tmp_path):
+    engine = RaspDbotEngine(str(tmp_path / "model.gguf"), llm=StubLlama(), prefix_cache=False)
+    try:
+        stream = engine.ask_stream("Giải thích cách robot tránh vật cản?")
+        next(stream)
+        assert engine._llm_lock.locked()
+        stream.close()
+        assert not engine._llm_lock.locked()
+        # Phần đã sinh vẫn vào history
+        assert engine.history[-1]["role"] == "assistant"
+    finally:
+        engine.close()
+
+
+def test_window_keeps_prompt_within_budget(tmp_path):
+    engine = RaspDbotEngine(str(tmp_path / "model.gguf"), llm=StubLlama(), prefix_cache=False, history_budget=200)
+    try:
+        for i in range(12):
+            engine.ask(f"Giải thích cảm biến số {i} của robot hoạt động thế nào?")
+        summary, recent = engine.window.select(engine.history)
+        assert recent and recent[-1] is engine.history[-1]
+        assert len(recent) < len(engine.history)
+    finally:
+        engine.close()
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import raspdbot_eval as ev
+from conftest import qa_line
+from raspdbot_corpus import load_corpus
+
+QA = [
+    ("Pin của robot sạc đầy mất bao lâu?", "Khoảng 2 giờ với bộ sạc 5A."),
+    ("Lidar dùng để làm gì?", "Lidar quét môi trường để lập bản đồ và tránh vật cản."),
+    ("Tốc độ tối đa của xe là bao nhiêu?", "Tốc độ tối đa là 1.5 m/s trong khuôn viên."),
+    ("Động cơ bị nóng khi chạy lâu thì sao?", "Cho robot nghỉ 10 phút và kiểm tra quạt tản nhiệt."),
+    ("Màn hình cảm ứng không phản hồi phải làm gì?", "Khởi động lại robot, nếu vẫn lỗi thì cân chỉnh lại cảm ứng."),
+]
+
+
+def test_handwritten_gold_resolves_and_unknown_question_fails(tmp_path):
+    path = tmp_path / "para.jsonl"
+    lines = [
+        {"dataset": "data", "query": "Bao lâu thì pin đầy?", "gold": ["pin của ROBOT sạc đầy mất bao lâu?"]},
+        {"dataset": "other", "query": "bỏ qua", "gold": ["không có"]},
+    ]
+    path.write_text("".join(json.dumps(x, ensure_ascii=False) + "\n" for x in lines), encoding="utf-8")
+    items = ev.load_handwritten("data", QA, path=path)
+    assert items == [{"query": "Bao lâu thì pin đầy?", "gold": [ev.normalize(QA[0][0])], "variant": "handwritten"}]
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"dataset": "data", "query": "x", "gold": ["Câu đã bị xoá?"]}, ensure_ascii=False) + "\n")
+    with pytest.raises(ValueError):
+        ev.load_handwritten("data", QA, path=path)
+
+
+def test_exact_is_left_out_of_totals():
+    miss = {"query": "camera quay đêm", "gold": [ev.normalize(QA[0][0])], "variant": "handwritten"}
+    queries = ev.build_queries(QA, ["exact"]) + [miss]
+    res = ev.evaluate(ev.load_backend("sequencematcher", None), QA, queries)
+    assert res["variants"]["exact"]["recall@1"] == 1.0
+    assert res["recall@1"] == res["variants"]["handwritten"]["recall@1"] == 0.0
+    assert res["n"] == 1
+
+
+def test_nofold_baseline_misses_diacritic_free_queries(tmp_path):
+    path = tmp_path / "data.jsonl"
+    path.write_text("".join(qa_line(q, a) for q, a in QA), encoding="utf-8")
+    corpus = load_corpus(str(path))
+    queries = ev.build_queries(corpus.qa_pairs, ["nodiacritics"], corpus=corpus)
+    folded = ev.evaluate(ev.load_backend("bm25-flat", corpus), corpus.qa_pairs, queries)
+    nofold = ev.evaluate(ev.load_backend("bm25-nofold", corpus), corpus.qa_pairs, queries)
+    assert folded["recall@1"] == 1.0
+    assert nofold["recall@1"] < folded["recall@1"]
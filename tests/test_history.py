@@ -0,0 +1,89 @@
+import json
+
+from raspdbot_history import HistoryJournal, journal_path_for, replay, trim_torn_tail
+
+TURN = [{"role": "user", "content": "xin chào"}, {"role": "assistant", "content": "chào bạn"}]
+
+
+def test_sync_then_replay(tmp_path):
+    snap = tmp_path / "history-model.json"
+    j = HistoryJournal(snap, model_path="model.gguf", fsync_interval=0.01)
+    history = []
+    j.attach(history)
+    history.extend(TURN)
+    j.sync(history)
+    history.append({"role": "user", "content": "pin bao lâu?"})
+    j.sync(history)
+    j.close()
+
+    data, n_records = replay(snap)
+    assert data["history"] == TURN + [{"role": "user", "content": "pin bao lâu?"}]
+    assert n_records == 3
+    assert HistoryJournal(snap).load()["history"] == data["history"]
+
+
+def test_replace_after_reset(tmp_path):
+    snap = tmp_path / "history-model.json"
+    j = HistoryJournal(snap, fsync_interval=0.01)
+    history = list(TURN)
+    j.sync(history)
+    j.sync([])          # reset -> list mới
+    j.close()
+    assert replay(snap)[0]["history"] == []
+
+
+def test_torn_tail_is_trimmed_before_append(tmp_path):
+    snap = tmp_path / "history-model.json"
+    j = HistoryJournal(snap, fsync_interval=0.01)
+    history = list(TURN)
+    j.sync(history)
+    j.close()
+
+    # Crash giữa lúc ghi: dòng cuối thiếu "\n"
+    journal = journal_path_for(snap)
+    with open(journal, "ab") as f:
+        f.write(b'{"op": "add", "m": {"role": "user", "con')
+    assert replay(snap)[0]["history"] == TURN
+
+    j = HistoryJournal(snap, fsync_interval=0.01)
+    history = j.load()["history"]
+    j.attach(history)
+    history.append({"role": "user", "content": "sau crash"})
+    j.sync(history)
+    j.close()
+
+    data, _ = replay(snap)
+    assert data["history"] == TURN + [{"role": "user", "content": "sau crash"}]
+    assert journal.read_bytes().endswith(b"\n")
+    assert trim_torn_tail(journal) == 0
+
+
+def test_compact_folds_journal_into_snapshot(tmp_path):
+    snap = tmp_path / "history-model.json"
+    j = HistoryJournal(snap, fsync_interval=0.01)
+    history = list(TURN)
+    j.sync(history)
+    j.flush()
+    j.compact()
+    assert journal_path_for(snap).stat().st_size == 0
+    history.append({"role": "assistant", "content": "thêm"})
+    j.sync(history)
+    j.close()
+
+    saved = json.loads(snap.read_text(encoding="utf-8"))
+    assert saved["history"] == TURN and saved["seq"] == 1     # một record "replace"
+    data, n_records = replay(snap)
+    assert data["history"] == TURN + [{"role": "assistant", "content": "thêm"}]
+    assert n_records == 1
+
+
+def test_replay_skips_records_already_in_snapshot(tmp_path):
+    # Crash giữa rename snapshot và truncate journal: record cũ không được áp lại
+    snap = tmp_path / "history-model.json"
+    snap.write_text(json.dumps({"history": TURN, "seq": 2}), encoding="utf-8")
+    journal_path_for(snap).write_text(
+        "".join(json.dumps({"op": "add", "m": m, "seq": i + 1}) + "\n" for i, m in enumerate(TURN)),
+        encoding="utf-8",
+    )
+    data, n_records = replay(snap)
+    assert data["history"] == TURN and n_records == 0
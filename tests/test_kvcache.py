@@ -0,0 +1,69 @@
+import pickle
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import raspdbot_kvcache as kv
+from raspdbot_llm import StubLlama
+
+PREFIX = "### Hệ thống: Bạn là RaspDbot, trợ lý của robot.\n"
+CONTINUATIONS = ["### Người dùng: Pin sạc bao lâu?", "### Người dùng: Lidar để làm gì?"]
+
+
+def prime(tmp_path):
+    model = tmp_path / "stub.gguf"
+    model.write_bytes(b"GGUF")
+    llm = StubLlama()
+    return llm, kv.prime_prefix(llm, str(model), PREFIX, CONTINUATIONS), model
+
+
+def test_snapshot_round_trip_without_pickle(tmp_path):
+    llm, state, model = prime(tmp_path)
+    path = kv.prefix_state_path(str(model), llm.n_ctx(), state.input_ids)
+    assert path.read_bytes().startswith(kv.KV_MAGIC)
+
+    fresh = StubLlama()
+    again = kv.prime_prefix(fresh, str(model), PREFIX, CONTINUATIONS)
+    assert again.input_ids == state.input_ids
+    assert fresh.input_ids == state.input_ids
+
+
+@pytest.mark.parametrize("damage", ["truncate", "magic", "pickle"])
+def test_damaged_snapshot_warns_and_reprimes(tmp_path, capsys, damage):
+    llm, state, model = prime(tmp_path)
+    path = kv.prefix_state_path(str(model), llm.n_ctx(), state.input_ids)
+    data = path.read_bytes()
+    if damage == "truncate":
+        path.write_bytes(data[:-3])
+    elif damage == "magic":
+        path.write_bytes(b"XXXXXXXX" + data[8:])
+    else:
+        path.write_bytes(pickle.dumps(state))
+    capsys.readouterr()
+
+    fresh = StubLlama()
+    again = kv.prime_prefix(fresh, str(model), PREFIX, CONTINUATIONS)
+    assert "[WARN] Bỏ qua snapshot KV" in capsys.readouterr().out
+    assert again.input_ids == state.input_ids
+    # Snapshot prefill lại đã ghi đè file hỏng
+    assert path.read_bytes() == data
+
+
+def test_encode_decode_llama_like_state():
+    state = SimpleNamespace(
+        input_ids=np.arange(7, dtype=np.intc),
+        scores=np.linspace(0, 1, 12, dtype=np.single).reshape(1, 12),
+        n_tokens=7,
+        llama_state=b"\x00\x01raw-kv\xff",
+        llama_state_size=10,
+        seed=None,
+    )
+    out = kv.decode_state(kv.encode_state(state))
+    assert set(out) == {"input_ids", "scores", "n_tokens", "llama_state", "llama_state_size"}
+    assert out["input_ids"].dtype == np.intc and list(out["input_ids"]) == list(range(7))
+    assert out["scores"].shape == (1, 12) and np.array_equal(out["scores"], state.scores)
+    assert out["llama_state"] == state.llama_state and out["n_tokens"] == 7
+
+    with pytest.raises(kv.SnapshotError):
+        kv.encode_state(SimpleNamespace(input_ids=np.array([object()])))
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from raspdbot_pool import EnginePool
+
+
+class FakeEngine:
+    def __init__(self, path):
+        self.model_path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(budget=200, sizes=None, fail=(), gate=None, events=None):
+    sizes = sizes or {}
+
+    def factory(path):
+        if gate is not None:
+            gate.wait(5)
+        if path in fail:
+            raise RuntimeError(f"nạp lỗi: {path}")
+        return FakeEngine(path)
+
+    def on_evict(path, engine):
+        # Hook chạy trước khi engine bị đóng (để còn lưu history)
+        events.append((path, engine.closed))
+
+    return EnginePool(factory, budget, lambda p: sizes.get(p, 100), on_evict if events is not None else None)
+
+
+def test_lru_eviction_runs_hook_before_close():
+    events = []
+    pool = make_pool(events=events)
+    a = pool.get("a")
+    pool.get("b")
+    pool.get("a")
+    assert pool.would_evict("c") == ["b"]
+    pool.get("c")
+    assert pool.resident() == ["a", "c"]
+    assert events == [("b", False)]
+    assert not a.closed
+
+
+def test_failed_load_restores_evicted_engine():
+    pool = make_pool(budget=100, fail={"bad"})
+    pool.get("a")
+    with pytest.raises(RuntimeError):
+        pool.get("bad")
+    assert pool.resident() == ["a"]
+    assert pool.peek("a") is not None
+
+
+def test_concurrent_preloads_respect_budget():
+    gate = threading.Event()
+    pool = make_pool(budget=200, sizes={"a": 60, "b": 60, "c": 60, "d": 60}, gate=gate)
+    for path in "abcd":
+        pool.preload(path)
+    # Chỗ được giữ ngay lúc nhận việc -> preload thứ 4 bị bỏ dù chưa model nào nạp xong
+    assert pool._used() == 180
+    gate.set()
+    for _ in range(500):
+        if len(pool.resident()) == 3 and not pool._reserved:
+            break
+        time.sleep(0.01)
+    assert sorted(pool.resident()) == ["a", "b", "c"]
+    assert pool.used_bytes() == 180
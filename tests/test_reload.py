@@ -0,0 +1,111 @@
+import os
+from contextlib import closing
+
+from conftest import qa_line
+from raspdbot_llm import StubLlama
+from RaspDbot_jsonl_chatbot import JsonlChat, new_clarify_state
+from raspdbot_corpus import CompiledCorpus, compile_corpus
+from raspdbot_reload import LiveCorpus
+
+
+def make_live(path):
+    return LiveCorpus(str(path), lambda c: c.index)
+
+
+def top_answer(live, query):
+    snap = live.snapshot
+    hits = snap.retriever.search(query, k=1)
+    assert hits, f"không tìm thấy: {query}"
+    return snap.qa_pairs[hits[0][1]][1]
+
+
+def test_poll_unchanged_file_returns_none(small_jsonl):
+    live = make_live(small_jsonl)
+    assert live.poll() is None
+
+
+def test_append_is_indexed_without_recompile(small_jsonl):
+    live = make_live(small_jsonl)
+    base = live.snapshot.retriever
+    with open(small_jsonl, "a", encoding="utf-8") as f:
+        f.write(qa_line("Camera của robot có độ phân giải bao nhiêu?", "Camera 1080p ở 30 khung hình mỗi giây."))
+
+    rec = live.poll()
+    assert rec["mode"] == "append" and rec["added"] == 1
+    assert len(live.snapshot) == 4
+    assert live.snapshot.retriever.n_indexed == base.n_indexed + 1
+    assert top_answer(live, "camera độ phân giải") == "Camera 1080p ở 30 khung hình mỗi giây."
+    # Q/A cũ vẫn tìm được qua phần base của index chồng
+    assert top_answer(live, "lidar dùng làm gì") == "Lidar quét môi trường để lập bản đồ và tránh vật cản."
+
+
+def test_partial_trailing_line_waits_for_newline(small_jsonl):
+    live = make_live(small_jsonl)
+    line = qa_line("Robot nặng bao nhiêu kg?", "Robot nặng 12 kg.")
+    with open(small_jsonl, "a", encoding="utf-8") as f:
+        f.write(line[:20])
+    assert live.poll() is None
+    with open(small_jsonl, "a", encoding="utf-8") as f:
+        f.write(line[20:])
+    rec = live.poll()
+    assert rec["mode"] == "append" and rec["added"] == 1
+    assert top_answer(live, "robot nặng bao nhiêu kg") == "Robot nặng 12 kg."
+
+
+def test_rewrite_recompiles(small_jsonl):
+    live = make_live(small_jsonl)
+    small_jsonl.write_text(
+        qa_line("Loa của robot công suất bao nhiêu?", "Loa 5W."), encoding="utf-8"
+    )
+    st = os.stat(small_jsonl)
+    os.utime(small_jsonl, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+    rec = live.poll()
+    assert rec["mode"] == "rewrite"
+    assert len(live.snapshot) == 1
+    assert top_answer(live, "loa công suất") == "Loa 5W."
+
+
+def test_stacked_scores_match_recompile(small_jsonl, tmp_path):
+    live = make_live(small_jsonl)
+    with open(small_jsonl, "a", encoding="utf-8") as f:
+        f.write(qa_line("Pin có thay được không?", "Pin thay nóng được trong 1 phút."))
+        f.write(qa_line("Lidar quét xa bao nhiêu?", "Lidar quét xa 12 m."))
+    assert live.poll()["mode"] == "append"
+
+    fresh = CompiledCorpus(compile_corpus(str(small_jsonl), tmp_path / "fresh.rdbidx"))
+    for query in ["pin", "lidar quét", "tốc độ tối đa"]:
+        stacked = {live.snapshot.qa_pairs[d]: s for s, d in live.snapshot.retriever.search(query, k=10)}
+        full = {fresh.qa_pairs[d]: s for s, d in fresh.index.search(query, k=10)}
+        assert stacked.keys() == full.keys()
+        # Chỉ avgdl của delta là xấp xỉ (theo base) -> so lệch nhỏ, không bằng tuyệt đối
+        for key, score in full.items():
+            assert abs(stacked[key] - score) < 0.05 * max(1.0, score)
+
+
+def test_jsonl_bot_append_rebinds_answer_cache(small_jsonl, tmp_path):
+    # Ngưỡng > 1 -> mọi câu hỏi đều qua LLM; scope cache theo path trong tmp_path
+    chat = JsonlChat(
+        str(tmp_path / "model.gguf"),
+        str(small_jsonl),
+        llm=StubLlama(n_ctx=4096),
+        direct_threshold=2.0,
+        rewrite_threshold=2.0,
+        reload_interval=0,
+    )
+    try:
+        question = "Tốc độ tối đa của xe là bao nhiêu?"
+        with closing(chat.ask_stream(question, new_clarify_state())) as stream:
+            "".join(stream)
+        with open(small_jsonl, "a", encoding="utf-8") as f:
+            f.write(qa_line("Robot nặng bao nhiêu kg?", "Robot nặng 12 kg."))
+        assert chat.live.poll()["mode"] == "append"
+        # Thông báo nạp lại chờ main loop lấy ra, không in từ thread theo dõi
+        assert [r["mode"] for r in chat.pop_reload_notices()] == ["append"]
+        assert chat.pop_reload_notices() == []
+        # Dataset đổi -> câu trả lời cũ bị bỏ
+        with closing(chat.ask_stream(question, new_clarify_state())) as stream:
+            "".join(stream)
+        assert chat.answer_cache.stats()["hits"] == 0
+    finally:
+        chat.close()
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import threading
+
+from raspdbot_server import ChatServer
+
+
+class GateResponder:
+    # Câu trả lời đầu tiên bị giữ lại tới khi gate mở -> worker bận, request sau phải xếp hàng
+    def __init__(self):
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def new_state(self):
+        return {}
+
+    def ask_stream(self, text, state, cancel=None):
+        def gen():
+            self.started.set()
+            self.gate.wait(5)
+            yield f"echo:{text}"
+        return gen()
+
+    def close(self):
+        pass
+
+
+async def request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = b"" if body is None else json.dumps(body).encode("utf-8")
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+    )
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    return status, head.decode("latin-1"), payload
+
+
+async def wait_for(cond, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    while not cond():
+        assert loop.time() < end, "hết thời gian chờ"
+        await asyncio.sleep(0.01)
+
+
+def test_full_queue_returns_503_and_queued_request_completes():
+    async def scenario():
+        responder = GateResponder()
+        server = ChatServer(responder, max_queue=1, timeout=10)
+        srv = await server.start("127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        try:
+            first = asyncio.create_task(request(port, "POST", "/chat", {"message": "A"}))
+            await asyncio.get_running_loop().run_in_executor(None, responder.started.wait, 5)
+            second = asyncio.create_task(request(port, "POST", "/chat", {"message": "B"}))
+            await wait_for(lambda: server.worker.queue.qsize() == 1)
+
+            status, head, _ = await request(port, "POST", "/chat", {"message": "C"})
+            assert status == 503
+            assert "Retry-After: 1" in head
+            # Session tạo ngầm cho request bị từ chối không được giữ lại
+            assert len(server.sessions) == 2
+
+            responder.gate.set()
+            (s1, _, body1), (s2, _, body2) = await asyncio.gather(first, second)
+            assert (s1, s2) == (200, 200)
+            assert b"echo:A" in body1 and b"echo:B" in body2
+
+            status, _, payload = await request(port, "GET", "/health")
+            health = json.loads(payload)
+            assert status == 200
+            assert health["rejected"] == 1 and health["completed"] == 2
+        finally:
+            responder.gate.set()
+            srv.close()
+            await srv.wait_closed()
+            await server.stop()
+
+    asyncio.run(scenario())
+
+
+def test_busy_session_returns_409():
+    async def scenario():
+        responder = GateResponder()
+        server = ChatServer(responder, max_queue=4, timeout=10)
+        srv = await server.start("127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        try:
+            status, _, payload = await request(port, "POST", "/sessions")
+            sid = json.loads(payload)["session_id"]
+            first = asyncio.create_task(request(port, "POST", "/chat", {"session_id": sid, "message": "A"}))
+            await asyncio.get_running_loop().run_in_executor(None, responder.started.wait, 5)
+
+            status, _, _ = await request(port, "POST", "/chat", {"session_id": sid, "message": "B"})
+            assert status == 409
+            status, _, _ = await request(port, "DELETE", f"/sessions/{sid}")
+            assert status == 409
+
+            responder.gate.set()
+            status, _, _ = await first
+            assert status == 200
+        finally:
+            responder.gate.set()
+            srv.close()
+            await srv.wait_closed()
+            await server.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,23 @@
+from RaspDbot_jsonl_chatbot import choose_tier
+
+QUESTION = "Tốc độ tối đa của xe là bao nhiêu?"
+ANSWER = "Tốc độ tối đa là 1.5 m/s trong khuôn viên."
+
+
+def test_short_query_is_not_answered_directly():
+    # Điểm BM25 cao nhưng câu hỏi chỉ phủ một phần nhỏ câu mẫu -> không trả câu mẫu nguyên văn
+    top = [(0.95, QUESTION, ANSWER)]
+    assert choose_tier("xe", top) == "generate"
+    assert choose_tier(QUESTION, top) == "direct"
+
+
+def test_ambiguous_top_two_falls_back_to_generate():
+    top = [(0.95, QUESTION, ANSWER), (0.94, "Tốc độ tối đa khi chở hàng?", "1 m/s.")]
+    assert choose_tier(QUESTION, top) == "generate"
+    # Hai câu mẫu cùng câu trả lời thì không coi là mơ hồ
+    top = [(0.95, QUESTION, ANSWER), (0.94, "Xe chạy nhanh nhất bao nhiêu?", ANSWER)]
+    assert choose_tier(QUESTION, top) == "direct"
+
+
+def test_no_hits_generates():
+    assert choose_tier(QUESTION, []) == "generate"
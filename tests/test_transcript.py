@@ -0,0 +1,60 @@
+from contextlib import closing
+
+import pytest
+
+from raspdbot_llm import StubLlama
+from RaspDbot_jsonl_chatbot import JsonlChat, new_clarify_state
+
+QUESTION = "Tốc độ tối đa của xe là bao nhiêu?"
+
+
+@pytest.fixture
+def chat(small_jsonl, tmp_path):
+    # Ngưỡng > 1 -> mọi câu hỏi đều qua LLM (tầng generate).
+    # Scope cache theo path model + dataset (nằm trong tmp_path) -> không lẫn giữa các test
+    bot = JsonlChat(
+        str(tmp_path / "model.gguf"),
+        str(small_jsonl),
+        llm=StubLlama(n_ctx=4096),
+        direct_threshold=2.0,
+        rewrite_threshold=2.0,
+        reload_interval=0,
+    )
+    yield bot
+    bot.close()
+
+
+def ask(chat, state, text):
+    with closing(chat.ask_stream(text, state)) as stream:
+        return "".join(stream)
+
+
+def test_cache_hit_commits_transcript(chat):
+    a = new_clarify_state()
+    first = ask(chat, a, QUESTION)
+    assert a["transcript"].turns == 1
+
+    b = new_clarify_state()
+    assert ask(chat, b, QUESTION) == first
+    assert chat.answer_cache.stats()["hits"] == 1
+    # Lượt trả từ cache vẫn phải vào transcript: lượt sau của model thấy câu trả lời này
+    assert b["transcript"].turns == 1
+
+    # Câu hỏi lặp lại sau một lượt khác trong cùng session -> key khác -> miss
+    ask(chat, b, QUESTION)
+    assert chat.answer_cache.stats()["hits"] == 1
+    assert b["transcript"].turns == 2
+
+
+def test_second_turn_extends_transcript(chat):
+    # Lượt sau chỉ nối thêm vào transcript: phần đã commit nằm nguyên ở đầu prompt
+    state = new_clarify_state()
+    ask(chat, state, QUESTION)
+    transcript = state["transcript"]
+    committed = list(transcript.tokens)
+    ask(chat, state, "Pin của robot sạc đầy mất bao lâu?")
+    assert transcript.turns == 2
+    assert transcript.last_mode == "extend"
+    assert transcript.tokens[: len(committed)] == committed
+    # Khối tham chiếu của lượt trước không nằm trong transcript -> KV chỉ dùng lại được phần trước nó
+    assert transcript.last_reused > 0